@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Measures the client against the local stand-in UWS service of the tests.
+
+Usage: python benchmarks/end_to_end.py [-o results.json] [--baseline old.json]
+
+Every benchmark starts its own server on localhost and is repeated, the
+best and the median run are reported. The results are written as JSON,
+and with --baseline the rates are compared to those of an earlier run.
+A negative change is a slowdown.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from uws import UWS
+from uws.UWS.tests.uws_server import UWSServer
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summary(runs, count, unit):
+    # rates are computed from the best run, noise only makes runs slower
+    best = min(runs)
+    return {
+        'runs': runs,
+        'best': best,
+        'median': percentile(runs, 0.5),
+        'count': count,
+        'unit': unit,
+        'rate': count / best if best else None,
+    }
+
+
+def repeated(repeat, function):
+    runs = []
+    for i in range(repeat):
+        started = time.time()
+        function()
+        runs.append(time.time() - started)
+    return runs
+
+
+def new_client(server):
+    # a pool of its own, so no benchmark reuses connections of another
+    return UWS.client.Client(server.url, pool=UWS.connection.ConnectionPool(max_size=16))
+
+
+def bench_job_list(arguments):
+    server = UWSServer.generated(arguments.jobs, version="1.1", latency=arguments.latency)
+    server.start()
+    results = {}
+    try:
+        client = new_client(server)
+
+        def full():
+            assert len(client.get_job_list().job_reference) == arguments.jobs
+
+        def compact():
+            assert len(client.get_job_list(compact=True).job_reference) == arguments.jobs
+
+        def stream():
+            assert sum(1 for job in client.get_job_list(stream=True, compact=True)) == arguments.jobs
+
+        for name, function in (('full', full), ('compact', compact), ('stream', stream)):
+            results['job_list_' + name] = summary(repeated(arguments.repeat, function), arguments.jobs, 'jobs/s')
+    finally:
+        server.stop()
+    return results
+
+
+def bench_get_job(arguments):
+    server = UWSServer.generated(arguments.jobs, version="1.1", latency=arguments.latency)
+    server.start()
+    results = {}
+    try:
+        client = new_client(server)
+        ids = [str(i % arguments.jobs + 1) for i in range(arguments.requests)]
+        latencies = []
+
+        def sequential():
+            for id in ids:
+                started = time.time()
+                client.get_job(id)
+                latencies.append(time.time() - started)
+
+        def concurrent():
+            for id, job in client.get_jobs(ids, max_workers=arguments.workers):
+                if isinstance(job, UWS.UWSError):
+                    raise job
+
+        results['get_job'] = summary(repeated(arguments.repeat, sequential), len(ids), 'requests/s')
+        results['get_job']['latency_p50'] = percentile(latencies, 0.5)
+        results['get_job']['latency_p95'] = percentile(latencies, 0.95)
+        results['get_jobs_concurrent'] = summary(repeated(arguments.repeat, concurrent), len(ids), 'requests/s')
+    finally:
+        server.stop()
+    return results
+
+
+def bench_submission(arguments):
+    server = UWSServer(version="1.1", latency=arguments.latency)
+    server.start()
+    results = {}
+    try:
+        client = new_client(server)
+
+        def submit():
+            parameter_sets = ({'query': 'SELECT %d' % i} for i in range(arguments.submissions))
+            for index, job in client.new_jobs(parameter_sets, max_in_flight=arguments.workers):
+                if isinstance(job, UWS.UWSError):
+                    raise job
+
+        results['new_jobs'] = summary(repeated(arguments.repeat, submit), arguments.submissions, 'jobs/s')
+    finally:
+        server.stop()
+    return results
+
+
+def bench_download(arguments):
+    row = "1234567,0.123456789,-12.3456789\n"
+    result = "id,ra,dec\n" + row * (arguments.result_mb * 1024 * 1024 // len(row))
+    size_mb = len(result) / 1024.0 / 1024.0
+
+    server = UWSServer(jobs={'1': 'COMPLETED'}, version="1.1", result=result, ranges=True,
+                       latency=arguments.latency)
+    server.chunk_size = 65536
+    server.start()
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        client = new_client(server)
+        url = server.url + '/1/results/csv'
+        file_name = os.path.join(directory, 'result.csv')
+
+        for name, segments, compress in (('plain', 1, False), ('segmented', 4, False), ('gzip', 1, True)):
+            server.compress = compress
+
+            def download():
+                os.remove(client.connection.download_file(url, None, None, file_name, segments=segments))
+
+            results['download_' + name] = summary(repeated(arguments.repeat, download), size_mb, 'MB/s')
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+    return results
+
+
+benchmarks = [
+    ('job_list', bench_job_list),
+    ('get_job', bench_get_job),
+    ('submission', bench_submission),
+    ('download', bench_download),
+]
+
+
+def compare(results, baseline):
+    print
+    print "%-28s %14s %14s %8s" % ("compared to baseline", "before", "now", "change")
+    for name, result in sorted(results.items()):
+        previous = baseline.get('benchmarks', {}).get(name)
+        if not previous or not previous.get('rate') or not result['rate']:
+            continue
+        change = (result['rate'] - previous['rate']) / previous['rate'] * 100
+        print "%-28s %14.1f %14.1f %+7.1f%%" % (name, previous['rate'], result['rate'], change)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the UWS client against a local stand-in service.")
+    parser.add_argument('-o', '--output', default='benchmark-results.json', help="JSON file the results are written to")
+    parser.add_argument('--baseline', help="JSON file of an earlier run to compare with")
+    parser.add_argument('--only', action='append', choices=[name for name, function in benchmarks],
+                        help="run only this benchmark, can be given several times")
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=10000, help="jobs in the job list")
+    parser.add_argument('--requests', type=int, default=500, help="get_job requests per run")
+    parser.add_argument('--submissions', type=int, default=200, help="jobs submitted per run")
+    parser.add_argument('--result-mb', type=int, default=20, help="size of the downloaded result")
+    parser.add_argument('--workers', type=int, default=8, help="concurrent requests")
+    parser.add_argument('--latency', type=float, default=0, help="seconds the server delays each request")
+    arguments = parser.parse_args()
+
+    results = {}
+    for name, function in benchmarks:
+        if arguments.only and name not in arguments.only:
+            continue
+        results.update(function(arguments))
+
+    print "%-22s %10s %10s %14s" % ("benchmark", "best", "median", "rate")
+    for name, result in sorted(results.items()):
+        print "%-22s %9.3fs %9.3fs %9.1f %s" % (name, result['best'], result['median'], result['rate'],
+                                               result['unit'])
+
+    report = {
+        'date': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(arguments),
+        'benchmarks': results,
+    }
+    with open(arguments.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
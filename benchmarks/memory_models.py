@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Compares the memory used by a job list of JobRef and of CompactJobRef.
+
+Usage: python benchmarks/memory_models.py [--jobs N]
+
+Each design is parsed in a separate process, so the growth of the peak
+resident set size is not hidden by memory freed earlier. The deep size
+sums sys.getsizeof over all objects reachable from the job references,
+counting shared objects (interned strings, phase tuples) only once.
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from uws.UWS import models
+
+phases = ['COMPLETED', 'ERROR', 'ABORTED', 'EXECUTING', 'PENDING']
+owners = ['owner%d' % i for i in range(20)]
+
+
+def job_list_xml(count):
+    jobrefs = []
+    for i in range(count):
+        jobrefs.append(
+            '<uws:jobref id="%d" xlink:href="https://example.org/uws/query/%d" xlink:type="simple" '
+            'ownerId="%s" creationTime="2016-01-01T00:00:%02d"><uws:phase>%s</uws:phase></uws:jobref>'
+            % (i, i, random.choice(owners), i % 60, random.choice(phases))
+        )
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<uws:jobs xmlns:uws="http://www.ivoa.net/xml/UWS/v1.0" xmlns:xlink="http://www.w3.org/1999/xlink">'
+            '%s</uws:jobs>' % ''.join(jobrefs))
+
+
+def deep_size(root):
+    seen = set()
+    size = 0
+    stack = [root]
+
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or obj is None or isinstance(obj, (bool, int)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, (models.BaseUWSModel, models.CompactModel)):
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for name in cls.__dict__.get('__slots__', ()):
+                    stack.append(getattr(obj, name, None))
+
+    return size
+
+
+def measure(xml, compact, pipe):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.time()
+    jobs = models.Jobs(xml, compact=compact)
+    elapsed = time.time() - started
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    os.write(pipe, '%d %d %f' % (deep_size(jobs.job_reference), after - before, elapsed))
+    os._exit(0)
+
+
+def run(xml, compact):
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        measure(xml, compact, write_end)
+
+    os.close(write_end)
+    output = os.read(read_end, 1024)
+    os.waitpid(pid, 0)
+    os.close(read_end)
+
+    deep, rss, elapsed = output.split()
+    return int(deep), int(rss), float(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the memory used by JobRef and CompactJobRef.")
+    parser.add_argument('--jobs', type=int, default=100000, help="job references in the job list")
+    count = parser.parse_args().jobs
+    xml = job_list_xml(count)
+
+    print "%d job references" % count
+    print "%-14s %14s %14s %10s" % ("design", "deep size", "peak rss", "parse")
+    for name, compact in (("JobRef", False), ("CompactJobRef", True)):
+        deep, rss, elapsed = run(xml, compact)
+        print "%-14s %11.1f MB %11.1f MB %9.2fs" % (name, deep / 1e6, rss / 1e3, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Measures the startup cost of the uws command line client.
+
+Usage: python benchmarks/startup.py [-o startup.json] [--baseline old.json]
+
+Every measurement runs in a new Python process: the import time of the
+client modules, and the wall time of complete 'uws' commands against the
+local stand-in service. For each command the heavy modules it loaded are
+recorded as well, e.g. a 'job phase' should not need lxml. The results
+are written as JSON in the format of end_to_end.py.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+from end_to_end import compare, summary
+from uws.UWS.tests.uws_server import UWSServer
+
+modules = ['uws.UWS', 'uws.UWS.connection', 'uws.UWS.models', 'uws.UWS.client', 'uws.cli.main']
+
+commands = [
+    ('phase', ['job', 'phase', '1']),
+    ('show', ['job', 'show', '1']),
+    ('list', ['list']),
+]
+
+# third party and larger standard library modules worth avoiding
+heavy_modules = ['lxml.etree', 'dateutil.parser', 'pytz', 'texttable', 'multiprocessing', 'email.utils',
+                 'mimetypes', 'subprocess']
+
+import_script = '''
+import sys, time
+started = time.time()
+import %s
+sys.stdout.write(repr(time.time() - started))
+'''
+
+command_script = '''
+import json, sys
+from uws.cli import main
+sys.argv = ['uws'] + sys.argv[1:]
+main.main()
+sys.stderr.write(json.dumps(sorted(name for name in %r if sys.modules.get(name))))
+'''
+
+
+def python(script, *args):
+    environment = dict(os.environ, PYTHONPATH=root)
+    process = subprocess.Popen([sys.executable, '-c', script] + list(args), stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, env=environment)
+    out, err = process.communicate()
+    if process.returncode:
+        raise RuntimeError(err)
+    return out, err
+
+
+def bench_imports(arguments):
+    results = {}
+    for module in modules:
+        runs = [float(python(import_script % module)[0]) for i in range(arguments.repeat)]
+        results['import_' + module] = summary(runs, 1, 'imports/s')
+    return results
+
+
+def bench_commands(arguments):
+    server = UWSServer.generated(arguments.jobs, version="1.1")
+    server.start()
+    results = {}
+    try:
+        for name, command in commands:
+            runs = []
+            for i in range(arguments.repeat):
+                started = time.time()
+                out, err = python(command_script % heavy_modules, '-H', server.url, *command)
+                runs.append(time.time() - started)
+
+            results['command_' + name] = summary(runs, 1, 'commands/s')
+            results['command_' + name]['loaded'] = json.loads(err.strip().splitlines()[-1])
+    finally:
+        server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the startup time of the uws command.")
+    parser.add_argument('-o', '--output', default='startup-results.json', help="JSON file the results are written to")
+    parser.add_argument('--baseline', help="JSON file of an earlier run to compare with")
+    parser.add_argument('-r', '--repeat', type=int, default=10)
+    parser.add_argument('--jobs', type=int, default=100, help="jobs in the job list")
+    arguments = parser.parse_args()
+
+    # compile once, so the first run does not pay for writing .pyc files
+    python(import_script % 'uws.cli.main, uws.UWS.client')
+
+    results = bench_imports(arguments)
+    results.update(bench_commands(arguments))
+
+    print "%-28s %10s %10s  %s" % ("benchmark", "best", "median", "heavy modules loaded")
+    for name, result in sorted(results.items()):
+        print "%-28s %8.1fms %8.1fms  %s" % (name, result['best'] * 1000, result['median'] * 1000,
+                                           ', '.join(result.get('loaded', [])))
+
+    report = {
+        'date': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(arguments),
+        'benchmarks': results,
+    }
+    with open(arguments.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,26 @@
 # -*- coding: utf-8 -*-
-import client
-import connection
-import models
+import importlib
+import sys
+import types
 
 from errors import UWSError
+
+# The submodules are imported when they are first used, e.g. UWS.client,
+# so that a command which only asks for the phase of a job does not load
+# lxml, dateutil and pytz.
+submodules = ('async_client', 'client', 'connection', 'index', 'models', 'watcher')
+
+
+class LazyPackage(types.ModuleType):
+    def __getattr__(self, name):
+        if name in submodules:
+            return importlib.import_module(self.__name__ + '.' + name)
+        raise AttributeError("'module' object has no attribute '%s'" % name)
+
+
+_package = LazyPackage(__name__, __doc__)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+# keep the original module alive, Python 2 clears the globals of a
+# module object when it is deleted
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
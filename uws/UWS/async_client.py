@@ -0,0 +1,691 @@
+# -*- coding: utf-8 -*-
+import asynchat
+import asyncore
+import os
+import socket
+import ssl
+import sys
+import time
+import urllib
+
+from collections import deque
+from urlparse import urlparse, urljoin
+
+from lxml.etree import XMLSyntaxError as XMLSyntaxError
+
+import models
+from client import Client
+from connection import RequestEvent, body_size, streaming_body
+from errors import UWSError
+
+
+class AsyncCall(object):
+    """Result of a request issued by the AsyncClient.
+
+    The call is finished once the event loop of its client has processed the
+    request, callbacks added with add_callback are then called with the call
+    as their only argument.
+    """
+    def __init__(self):
+        self.done = False
+        self.error = None
+        self._result = None
+        self._callbacks = []
+
+    def add_callback(self, callback):
+        if self.done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def result(self):
+        if not self.done:
+            raise UWSError("Request has not finished yet, run the event loop of the client first.")
+
+        if self.error is not None:
+            raise self.error
+
+        return self._result
+
+    def then(self, function):
+        """Returns a new call finishing with function(result) of this call."""
+        call = AsyncCall()
+
+        def forward(previous):
+            if previous.error is not None:
+                call._set_error(previous.error)
+                return
+
+            try:
+                value = function(previous._result)
+            except UWSError as e:
+                call._set_error(e)
+            except Exception as e:
+                call._set_error(UWSError(str(e)))
+            else:
+                call._set_result(value)
+
+        self.add_callback(forward)
+        return call
+
+    def _set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def _set_error(self, error):
+        self.error = error
+        self._finish()
+
+    def _finish(self):
+        self.done = True
+
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class AsyncResponse(object):
+    # size of the body as sent by the server
+    bytes_received = 0
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def read(self):
+        return self.body
+
+
+class StreamProducer(object):
+    def __init__(self, stream, chunk_size=65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+
+    def more(self):
+        return self.stream.read(self.chunk_size)
+
+
+class AsyncHTTPConnection(asynchat.async_chat):
+    """A non-blocking HTTP/1.1 connection to one host, carrying one request
+    at a time.
+
+    The response body is written to the sink of a request if one is given
+    and the request was successful, otherwise it is collected in memory.
+    After a complete response the connection stays open unless the server
+    closes it, and on_idle is called with it, so the next request to the
+    host is sent without a new connect and TLS handshake.
+    """
+    def __init__(self, key, addresses, on_idle, map):
+        asynchat.async_chat.__init__(self, map=map)
+
+        self.key = key
+        self.host = key[1]
+        self.tls = key[0] == 'https'
+        self.on_idle = on_idle
+
+        # whether a request is in progress, and how many were sent before
+        self.active = False
+        self.requests = 0
+
+        self._pending = False
+        self._handshaking = False
+        self._want_read = False
+        self._started = time.time()
+        self._connect_time = 0.0
+        self._tls_time = 0.0
+
+        self._addresses = list(addresses)
+        self._connect_next()
+
+    def _connect_next(self):
+        # tries the addresses of the host in turn, e.g. IPv6 and IPv4, until
+        # a connect is under way
+        while True:
+            family, address = self._addresses.pop(0)
+            self.create_socket(family, socket.SOCK_STREAM)
+            try:
+                self.connect(address)
+                return
+            except socket.error:
+                self.close()
+                if not self._addresses:
+                    raise
+            except:
+                self.close()
+                raise
+
+    def request(self, method, url, body, headers, sink, event, on_complete, on_error):
+        """Sends a request once the connection is established. on_error is
+        called with the exception and whether the request failed because the
+        server had closed the connection while it was idle."""
+        url_parsed = urlparse(url)
+        path = url_parsed.path or '/'
+        if url_parsed.query:
+            path += '?' + url_parsed.query
+
+        lines = ["%s %s HTTP/1.1" % (method, path), "Host: %s" % url_parsed.netloc]
+        headers = dict(headers)
+        if isinstance(body, str):
+            headers['Content-Length'] = str(len(body))
+        elif body is not None:
+            body = streaming_body(body, headers)
+        for name, value in headers.items():
+            lines.append("%s: %s" % (name, value))
+        self._request_head = '\r\n'.join(lines) + '\r\n\r\n'
+        self._request_body = body
+
+        self.method = method
+        self.sink = sink
+        self.event = event
+        self.on_complete = on_complete
+        self.on_error = on_error
+
+        self.active = True
+        self.reused = self.requests > 0
+        self.requests += 1
+
+        self._state = 'headers'
+        self._buffer = []
+        self._body = []
+        self._received = 0
+        self._keep_alive = False
+        self.set_terminator('\r\n\r\n')
+
+        self._pending = True
+        if self.connected and not self._handshaking:
+            self._send_request()
+
+    def handle_connect(self):
+        self._connect_time = time.time() - self._started
+        if not self.tls:
+            if self._pending:
+                self._send_request()
+            return
+
+        context = ssl.create_default_context()
+        self.socket = context.wrap_socket(self.socket, server_hostname=self.host, do_handshake_on_connect=False)
+        self._handshaking = True
+        self._do_handshake()
+
+    def _do_handshake(self):
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLWantReadError:
+            self._want_read = True
+            return
+        except ssl.SSLWantWriteError:
+            self._want_read = False
+            return
+
+        self._handshaking = False
+        self._tls_time = time.time() - self._started - self._connect_time
+        if self._pending:
+            self._send_request()
+
+    def _send_request(self):
+        self._pending = False
+        if not self.reused:
+            self.event.connect = self._connect_time
+            self.event.tls = self._tls_time
+
+        self._sent = time.time()
+        self.push(self._request_head)
+        if isinstance(self._request_body, str):
+            self.push(self._request_body)
+        elif self._request_body is not None:
+            # file-like bodies are read piecewise while the socket accepts data
+            self.push_with_producer(StreamProducer(self._request_body))
+
+    def readable(self):
+        if self._handshaking:
+            return self._want_read
+        return asynchat.async_chat.readable(self)
+
+    def writable(self):
+        if self._handshaking:
+            return not self._want_read
+        return asynchat.async_chat.writable(self)
+
+    def handle_read_event(self):
+        if self._handshaking:
+            self._do_handshake()
+        else:
+            asynchat.async_chat.handle_read_event(self)
+
+    def handle_write_event(self):
+        if self._handshaking:
+            self._do_handshake()
+        else:
+            asynchat.async_chat.handle_write_event(self)
+
+    def handle_read(self):
+        asynchat.async_chat.handle_read(self)
+
+        # decrypted data buffered by ssl is not signalled by poll
+        while self.tls and self.connected and self.active and self.socket.pending():
+            asynchat.async_chat.handle_read(self)
+
+    def recv(self, buffer_size):
+        try:
+            return asynchat.async_chat.recv(self, buffer_size)
+        except ssl.SSLWantReadError:
+            return ''
+
+    def send(self, data):
+        try:
+            return asynchat.async_chat.send(self, data)
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return 0
+
+    def collect_incoming_data(self, data):
+        if not self.active:
+            # nothing is expected on an idle connection
+            self.close()
+            return
+
+        if self._state in ('body', 'chunk-data'):
+            self._received += len(data)
+            if self.sink is not None and self.status == 200:
+                self.sink.write(data)
+            else:
+                self._body.append(data)
+        else:
+            self._buffer.append(data)
+
+    def found_terminator(self):
+        if not self.active:
+            self.close()
+            return
+
+        line = ''.join(self._buffer)
+        self._buffer = []
+
+        if self._state == 'headers':
+            self._parse_headers(line)
+        elif self._state == 'body':
+            self._finish()
+        elif self._state == 'chunk-size':
+            size = int(line.split(';', 1)[0], 16)
+            if size == 0:
+                self._state = 'trailer'
+                self.set_terminator('\r\n')
+            else:
+                self._state = 'chunk-data'
+                self.set_terminator(size)
+        elif self._state == 'chunk-data':
+            self._state = 'chunk-end'
+            self.set_terminator('\r\n')
+        elif self._state == 'chunk-end':
+            self._state = 'chunk-size'
+        elif self._state == 'trailer':
+            if not line:
+                self._finish()
+
+    def _parse_headers(self, data):
+        lines = data.split('\r\n')
+        version, status, reason = (lines[0].split(' ', 2) + [''])[:3]
+        self.status = int(status)
+        self.reason = reason
+
+        self.headers = {}
+        for line in lines[1:]:
+            name, value = line.split(':', 1)
+            self.headers[name.strip().lower()] = value.strip()
+
+        if self.status == 100:
+            # interim response, the real one follows
+            return
+
+        self.event.responded(self.reused, self._sent)
+        self._keep_alive = version == 'HTTP/1.1' and self.headers.get('connection', '').lower() != 'close'
+
+        if self.method == 'HEAD' or self.status in (204, 304):
+            self._finish()
+        elif self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            self._state = 'chunk-size'
+            self.set_terminator('\r\n')
+        elif 'content-length' in self.headers:
+            length = int(self.headers['content-length'])
+            if length == 0:
+                self._finish()
+            else:
+                self._state = 'body'
+                self.set_terminator(length)
+        else:
+            # body is delimited by the server closing the connection
+            self._keep_alive = False
+            self._state = 'body'
+            self.set_terminator(None)
+
+    def handle_close(self):
+        if not self.active:
+            # the server closed the idle connection
+            self.close()
+            return
+
+        if self._reconnect():
+            return
+
+        if self._state == 'body' and self.get_terminator() is None:
+            self._finish()
+            return
+
+        error = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        # nothing was received on a reused connection, the server closed it
+        # before the request arrived
+        stale = self.reused and self._state == 'headers' and not self._buffer
+        self.close()
+        if error:
+            self._fail(socket.error(error, os.strerror(error)), stale)
+        else:
+            self._fail(RuntimeError("Connection closed before the response was complete"), stale)
+
+    def handle_error(self):
+        error = sys.exc_info()[1]
+        if self.active and isinstance(error, socket.error) and self._reconnect():
+            return
+
+        self.close()
+        if self.active:
+            self._fail(error)
+
+    def _reconnect(self):
+        # the connect failed, but the host has more addresses
+        if self.connected or not self._addresses:
+            return False
+
+        self.close()
+        try:
+            self._connect_next()
+        except socket.error as e:
+            self._fail(e)
+        return True
+
+    def _fail(self, error, stale=False):
+        on_error = self.on_error
+        self._clear()
+        on_error(error, stale)
+
+    def _finish(self):
+        response = AsyncResponse(self.status, self.reason, self.headers, ''.join(self._body))
+        response.bytes_received = self._received
+
+        on_complete = self.on_complete
+        self._clear()
+
+        if self._keep_alive:
+            self.on_idle(self)
+        else:
+            self.close()
+        on_complete(response)
+
+    def _clear(self):
+        self.active = False
+        self.sink = self.event = self.on_complete = self.on_error = None
+        self._request_body = None
+        self._body = []
+
+
+class AsyncClient(object):
+    """Non-blocking counterpart of Client.
+
+    All request methods return an AsyncCall immediately, the requests are
+    processed by run() or wait() in a single thread. At most max_connections
+    connections are open, requests which find none free are queued. Idle
+    keep-alive connections are reused for further requests to their host
+    and closed by close().
+
+    The hooks of the connection get a RequestEvent for every request. The
+    ConnectionPool, RetryPolicy, ResponseCache and RedirectMap of the
+    connection are bypassed: failed requests are not repeated, responses
+    are always downloaded in full and redirects are followed anew for every
+    request.
+    """
+    def __init__(self, url=None, user=None, password=None, connection=None, max_connections=100, lazy=False):
+        # the blocking client shares the connection settings and is used
+        # for validating request arguments
+        self.client = Client(url, user, password, connection=connection, lazy=lazy)
+        self.connection = self.client.connection
+
+        self.max_connections = max_connections
+        self.max_redirects = 20
+
+        self._map = {}
+        self._queue = deque()
+        self._addresses = {}
+        # idle connections by (scheme, host, port), and the number of
+        # requests sent but not finished
+        self._idle = {}
+        self._active = 0
+
+    def close(self):
+        """Closes the idle connections."""
+        idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def run(self, timeout=None):
+        """Processes requests until all of them are finished or timeout
+        seconds have passed."""
+        self._loop(lambda: False, timeout)
+
+    def wait(self, call, timeout=None):
+        """Processes requests until the given call is finished and returns its
+        result."""
+        self._loop(lambda: call.done, timeout)
+        return call.result()
+
+    def _loop(self, finished, timeout):
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while (self._active or self._queue) and not finished():
+            if not self._active:
+                self._start_queued()
+
+            asyncore.loop(timeout=0.5, use_poll=True, map=self._map, count=1)
+
+            if deadline is not None and time.time() > deadline:
+                break
+
+    def get_job_list(self, filters=None):
+        params = None
+        if filters:
+            params = self.client._validate_and_parse_filters(filters)
+
+        return self._fetch("GET", self._url('', params)).then(self._parse(models.Jobs))
+
+    def get_job(self, id, wait=None, phase=None):
+        params = None
+        if wait:
+            params = self.client._validate_and_parse_wait(wait, phase)
+
+        return self._fetch("GET", self._url(id, params)).then(self._parse(self.client.job_model))
+
+    def get_phase(self, id):
+        return self._fetch("GET", self._url(id + '/phase')).then(lambda response: response.body)
+
+    def new_job(self, args={}):
+        return self._post('', args).then(self._parse(self.client.job_model))
+
+    def set_parameters_job(self, id, args={}):
+        return self._post(id, args).then(self._parse(self.client.job_model))
+
+    def run_job(self, id):
+        return self._post(id + '/phase', {"PHASE": "RUN"}).then(self._parse(self.client.job_model))
+
+    def abort_job(self, id):
+        return self._post(id, {"PHASE": "ABORT"}).then(self._parse(self.client.job_model))
+
+    def delete_job(self, id):
+        return self._fetch("DELETE", self._url(id)).then(lambda response: True)
+
+    def download_result(self, url, file_name):
+        file_handler = open(file_name, 'wb')
+
+        def close(call):
+            file_handler.close()
+
+        call = self._fetch("GET", str(url), sink=file_handler)
+        call.add_callback(close)
+
+        return call.then(lambda response: True)
+
+    def _parse(self, model):
+        def parse(response):
+            try:
+                return model(response.body)
+            except XMLSyntaxError:
+                raise UWSError("Malformatted response. Are you sure the host you specified is a IVOA UWS service?", response.body)
+        return parse
+
+    def _url(self, path, params=None):
+        url = "%s://%s%s" % (self.connection.pool_key[0], self.connection.clean_url, self.connection.base_path)
+        if path:
+            url += "/" + path
+        if params:
+            url += '?' + urllib.urlencode(params, True)
+        return url
+
+    def _post(self, path, args):
+        content_type, body = self.connection._encode_multipart(args)
+
+        def close(call):
+            body.close()
+
+        call = self._fetch("POST", self._url(path), body, {'Content-type': content_type})
+        call.add_callback(close)
+        return call
+
+    def _fetch(self, method, url, body=None, headers=None, sink=None):
+        call = AsyncCall()
+        self._send(call, method, url, body, headers or {}, sink, 0)
+        return call
+
+    def _send(self, call, method, url, body, headers, sink, redirects):
+        try:
+            key, path = self.connection._split_url(url)
+        except RuntimeError as e:
+            call._set_error(UWSError(str(e)))
+            return
+
+        event = RequestEvent(method, key, path, 0, body_size(body))
+
+        def complete(response):
+            self._active -= 1
+            event.finish(response)
+            self.connection.emit(event)
+            self._start_queued()
+
+            if response.status in (302, 303):
+                if redirects >= self.max_redirects:
+                    call._set_error(UWSError("Too many redirects."))
+                    return
+
+                location = urljoin(url, response.getheader('location'))
+                if response.status == 303:
+                    # see other
+                    self._send(call, "GET", location, None, {}, sink, redirects + 1)
+                else:
+                    # found - redirect
+                    if hasattr(body, 'seek'):
+                        try:
+                            body.seek(0)
+                        except IOError as e:
+                            call._set_error(UWSError(str(e)))
+                            return
+                    self._send(call, method, location, body, headers, sink, redirects + 1)
+                return
+
+            try:
+                self.connection._check_response(response)
+            except RuntimeError as e:
+                call._set_error(UWSError(str(e)))
+                return
+
+            call._set_result(response)
+
+        def error(exception, stale=False):
+            self._active -= 1
+            if stale and self._rewind(body):
+                # the server closed the idle connection in the meantime,
+                # try once more on a fresh one
+                self._queue.appendleft((key, True, method, url, body, request_headers, sink, event, complete, error))
+                self._start_queued()
+                return
+
+            event.finish(error=exception)
+            self.connection.emit(event)
+            self._start_queued()
+            call._set_error(UWSError(str(exception)))
+
+        request_headers = dict(self.connection.headers)
+        request_headers.update(headers)
+        self._queue.append((key, False, method, url, body, request_headers, sink, event, complete, error))
+        self._start_queued()
+
+    def _rewind(self, body):
+        if not hasattr(body, 'seek'):
+            return True
+        try:
+            body.seek(0)
+        except IOError:
+            return False
+        return True
+
+    def _start_queued(self):
+        while self._queue:
+            key, fresh = self._queue[0][:2]
+
+            connection = None
+            if not fresh:
+                connection = self._idle_connection(key)
+            if connection is None and len(self._map) >= self.max_connections and not self._close_idle():
+                break
+
+            request = self._queue.popleft()
+            self._active += 1
+            if connection is None:
+                try:
+                    connection = AsyncHTTPConnection(key, self._resolve(key), self._release, self._map)
+                except socket.error as e:
+                    request[-1](e)
+                    continue
+            connection.request(*request[2:])
+
+    def _idle_connection(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            connection = idle.pop()
+            # the server may have closed it
+            if connection.connected:
+                return connection
+        return None
+
+    def _close_idle(self):
+        # makes room for a connection to another host
+        for connections in self._idle.values():
+            while connections:
+                connection = connections.pop()
+                if connection.connected:
+                    connection.close()
+                    return True
+        return False
+
+    def _release(self, connection):
+        self._idle.setdefault(connection.key, []).append(connection)
+
+    def _resolve(self, key):
+        # name resolution blocks, so it is done only once per host
+        if key not in self._addresses:
+            scheme, host, port = key
+            self._addresses[key] = [(family, address) for family, socktype, proto, canonname, address
+                                    in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)]
+        return self._addresses[key]
@@ -1,6 +1,14 @@
 # -*- coding: utf-8 -*-
 from lxml.etree import XMLSyntaxError as XMLSyntaxError
 
+import Queue
+import collections
+import copy
+import random
+import sys
+import threading
+import time
+
 import connection as UWSConnection
 import models
 from errors import UWSError
@@ -10,20 +18,36 @@ import pytz
 
 
 class Client(object):
-    def __init__(self, url=None, user=None, password=None, connection=None):
+    def __init__(self, url=None, user=None, password=None, connection=None, pool=None, lazy=False, cache=None,
+                 retry=None, hooks=None):
         if connection:
             self.connection = connection
+            if hooks:
+                connection.hooks.extend(hook for hook in hooks if hook not in connection.hooks)
+        else:
+            # with a cache, unchanged jobs and job lists are neither
+            # downloaded nor parsed again
+            self.connection = UWSConnection.Connection(url, user, password, pool=pool, cache=cache, retry=retry,
+                                                       hooks=hooks)
+
+        # lazy jobs only build parameters, results etc. when they are used
+        if lazy:
+            self.job_model = models.LazyJob
         else:
-            self.connection = UWSConnection.Connection(url, user, password)
+            self.job_model = models.Job
 
-    def get_job_list(self, filters=None):
+    def get_job_list(self, filters=None, stream=False, compact=False):
         params = None
         if filters:
             params = self._validate_and_parse_filters(filters)
             # print 'params: ', params ## debug
 
+        cache_key = None
+        if not stream:
+            cache_key = ('jobs', compact)
+
         try:
-            response = self.connection.get('', params)
+            response = self.connection.get('', params, cache_key=cache_key)
         except Exception as e:
             # Do not try to make a second request without parameters here,
             # because cannot call self.connection.get() a second time and reusing the connection
@@ -32,17 +56,40 @@ class Client(object):
             # Let's just raise the error immediately.
             raise UWSError(str(e))
 
+        if stream:
+            # parse job references directly from the response while they arrive
+            try:
+                return models.JobRefStream(response, compact=compact)
+            except XMLSyntaxError as e:
+                raise UWSError("Malformatted response. Are you sure the host you specified is a IVOA UWS service?", str(e))
+
+        if response.status == 304:
+            return response.cached
+
         raw = response.read()
 
         try:
-            job_list = models.Jobs(raw)
+            job_list = self._parse(models.Jobs, response, raw, compact=compact)
         except XMLSyntaxError as e:
             raise UWSError("Malformatted response. Are you sure the host you specified is a IVOA UWS service?", raw)
         except Exception as e:
             raise e
 
+        self.connection.remember(response, job_list)
+
         return job_list
 
+    def _parse(self, model, response, raw, **kwargs):
+        # the time spent in the models is reported to the hooks
+        if not self.connection.hooks:
+            return model(raw, **kwargs)
+
+        started = time.time()
+        result = model(raw, **kwargs)
+        self.connection.emit(UWSConnection.ParseEvent(model.__name__, len(raw), time.time() - started,
+                                                      getattr(response, 'event', None)))
+        return result
+
     def _validate_and_parse_filters(self, filters):
         filters_copy = filters.copy()
         phases = filters_copy.pop('phases', None)
@@ -118,22 +165,198 @@ class Client(object):
             params = self._validate_and_parse_wait(wait, phase)
 
         try:
-            response = self.connection.get(id, params)
+            response = self.connection.get(id, params, cache_key=self.job_model)
         except Exception as e:
             # Do not make a second request without params, throw error
             # immediately
             raise UWSError(str(e))
 
+        if response.status == 304:
+            return response.cached
+
         raw = response.read()
         try:
-            result = models.Job(raw)
+            result = self._parse(self.job_model, response, raw)
         except XMLSyntaxError as e:
             raise UWSError("Malformatted response. Are you sure the host you specified is a IVOA UWS service?", raw)
         except Exception as e:
             raise e
 
+        self.connection.remember(response, result)
+
         return result
 
+    def get_jobs(self, ids, max_workers=4, ordered=False):
+        """Fetches many jobs concurrently.
+
+        Yields (id, job) tuples as soon as each job has been retrieved, or in
+        the order of ids if ordered is True. Failures do not stop the batch,
+        job is the UWSError instead.
+        """
+        return self._map_concurrently(lambda client, id: client.get_job(id), ids, max_workers, ordered)
+
+    def _thread_client(self, local):
+        # every worker thread uses its own connection, the underlying
+        # sockets come from the shared connection pool
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = type(self)(connection=copy.copy(self.connection))
+            client.job_model = self.job_model
+        return client
+
+    def _map_concurrently(self, function, items, workers, ordered=False, drain=False):
+        # Calls function(client, item) for each of items on up to workers
+        # threads, each with its own client, and yields (item, result) tuples
+        # as the calls finish, or in the order of items if ordered is True.
+        # result is the UWSError if the call failed, failures do not stop the
+        # batch. items is consumed lazily, one item per finished call.
+        #
+        # With drain, an exception raised by items or thrown in at a yield
+        # (e.g. KeyboardInterrupt) does not abandon the calls in flight: they
+        # are waited for and yielded before the exception is raised again.
+        from multiprocessing.pool import ThreadPool
+
+        local = threading.local()
+        finished = Queue.Queue()
+        # results waiting for the results of earlier items, if ordered
+        waiting = {}
+        ready = collections.deque()
+        expected = [0]
+
+        def call(position, item):
+            client = self._thread_client(local)
+            try:
+                result = function(client, item)
+            except UWSError as e:
+                result = e
+            except Exception as e:
+                result = UWSError(str(e))
+            finished.put((position, (item, result)))
+
+        def collect():
+            # waits with a timeout, so the main thread can be interrupted
+            while True:
+                try:
+                    position, result = finished.get(True, 1)
+                    break
+                except Queue.Empty:
+                    pass
+
+            if not ordered:
+                ready.append(result)
+                return
+
+            waiting[position] = result
+            while expected[0] in waiting:
+                ready.append(waiting.pop(expected[0]))
+                expected[0] += 1
+
+        pool = ThreadPool(workers)
+        in_flight = 0
+        try:
+            try:
+                for position, item in enumerate(items):
+                    if in_flight == workers:
+                        collect()
+                        in_flight -= 1
+                        while ready:
+                            yield ready.popleft()
+
+                    pool.apply_async(call, (position, item))
+                    in_flight += 1
+
+                while in_flight:
+                    collect()
+                    in_flight -= 1
+                    while ready:
+                        yield ready.popleft()
+            except GeneratorExit:
+                raise
+            except BaseException:
+                if not drain:
+                    raise
+                error = sys.exc_info()
+
+                while in_flight:
+                    collect()
+                    in_flight -= 1
+                while ready:
+                    yield ready.popleft()
+
+                raise error[0], error[1], error[2]
+        finally:
+            pool.terminate()
+
+    def wait_for(self, ids, target_phases=None, timeout=None, max_workers=8,
+                 poll_interval=1, max_poll_interval=30, max_wait=60):
+        """Waits until all jobs reached one of target_phases (by default the
+        final phases) or timeout seconds have passed.
+
+        UWS 1.1 services are asked to block with the WAIT parameter, for other
+        services the phase is polled with an exponentially growing interval.
+        Returns a dictionary with the last known phase of each job, or the
+        UWSError if a job could not be retrieved.
+        """
+        if target_phases is None:
+            target_phases = models.JobPhases.final_phases
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        def wait(client, id):
+            return client._wait_for_job(id, target_phases, deadline, poll_interval, max_poll_interval, max_wait)
+
+        return dict(self._map_concurrently(wait, ids, max_workers))
+
+    def _wait_for_job(self, id, target_phases, deadline, poll_interval, max_poll_interval, max_wait):
+        job = self.get_job(id)
+        phase = job.phase[0]
+        delay = poll_interval
+
+        while phase not in target_phases:
+            remaining = max_wait
+            if deadline is not None:
+                remaining = min(deadline - time.time(), max_wait)
+                if remaining < 1:
+                    break
+
+            if job.version == "1.1" and phase in models.JobPhases.active_phases:
+                started = time.time()
+                job = self.get_job(id, str(int(remaining)), phase)
+
+                if job.phase[0] != phase or time.time() - started >= 1:
+                    # the server blocked as requested, no need to back off
+                    phase = job.phase[0]
+                    delay = poll_interval
+                    continue
+
+            # back off, with jitter so many waiting clients do not poll in step
+            time.sleep(min(random.uniform(delay / 2.0, delay), remaining))
+            delay = min(delay * 2, max_poll_interval)
+
+            phase = self.get_phase(id).strip()
+
+        return phase
+
+    def run_jobs(self, ids, concurrency=8):
+        """Starts many jobs concurrently, see _batch()."""
+        return self._batch('run_job', ids, concurrency)
+
+    def abort_jobs(self, ids, concurrency=8):
+        """Aborts many jobs concurrently, see _batch()."""
+        return self._batch('abort_job', ids, concurrency)
+
+    def delete_jobs(self, ids, concurrency=8):
+        """Deletes many jobs concurrently, see _batch()."""
+        return self._batch('delete_job', ids, concurrency)
+
+    def _batch(self, name, ids, concurrency):
+        # Calls the method name for each id on up to concurrency worker
+        # threads. Returns a dictionary with the result for each id, or the
+        # UWSError if the call failed; failures do not stop the batch.
+        return dict(self._map_concurrently(lambda client, id: getattr(client, name)(id), ids, concurrency))
+
     def get_phase(self, id):
         try:
             response = self.connection.get(id + '/phase')
@@ -153,7 +376,7 @@ class Client(object):
 
         raw = response.read()
         try:
-            result = models.Job(raw)
+            result = self._parse(self.job_model, response, raw)
         except XMLSyntaxError as e:
             raise UWSError("Malformatted response. Are you sure the host you specified is a IVOA UWS service?", raw)
         except Exception as e:
@@ -161,6 +384,66 @@ class Client(object):
 
         return result
 
+    def new_jobs(self, parameter_sets, max_in_flight=8, run=False, max_retries=5):
+        """Creates a job for each parameter dictionary in parameter_sets.
+
+        parameter_sets is consumed lazily, at most max_in_flight jobs are
+        submitted at the same time. With run=True each job is started right
+        after its creation. Requests answered with 503 are repeated up to
+        max_retries times, after the delay given by Retry-After.
+
+        Yields (index, job) tuples in the order the jobs are created, index
+        being the position in parameter_sets. Failures do not stop the
+        batch, job is the UWSError instead. If reading parameter_sets fails
+        or the generator is interrupted (an exception thrown in with
+        throw()), the jobs already being submitted are still yielded before
+        the exception is raised again.
+        """
+        # the workers take the parameters of a job by its index, so the
+        # index is what comes back with the job
+        parameters = {}
+
+        def indexes():
+            for index, args in enumerate(parameter_sets):
+                parameters[index] = args
+                yield index
+
+        def submit(client, index):
+            return client._submit(parameters.pop(index), run, max_retries)
+
+        return self._map_concurrently(submit, indexes(), max_in_flight, drain=True)
+
+    def _submit(self, args, run, max_retries):
+        job = self._parse_job(self._post_when_available('', args, max_retries))
+
+        if run:
+            job = self._parse_job(self._post_when_available(job.job_id + '/phase', {"PHASE": "RUN"}, max_retries))
+
+        return job
+
+    def _post_when_available(self, path, args, max_retries):
+        # a 503 means the request was not processed, so it is safe to repeat.
+        # A RetryPolicy of the connection never repeats a POST, this is the
+        # only loop doing so, with the delays of the policy. While the
+        # circuit of the server is open, the request waits for it as well.
+        retry = self.connection.retry or UWSConnection.RetryPolicy(backoff=1)
+        for attempt in range(max_retries + 1):
+            try:
+                return self.connection.post(path, args)
+            except (UWSConnection.ServiceUnavailable, UWSConnection.CircuitOpen) as e:
+                if attempt == max_retries:
+                    raise UWSError(str(e))
+                time.sleep(retry.delay(attempt, e.retry_after))
+            except Exception as e:
+                raise UWSError(str(e))
+
+    def _parse_job(self, response):
+        raw = response.read()
+        try:
+            return self._parse(self.job_model, response, raw)
+        except XMLSyntaxError as e:
+            raise UWSError("Malformatted response. Are you sure the host you specified is a IVOA UWS service?", raw)
+
     def set_parameters_job(self, id, args={}):
         try:
             response = self.connection.post(id, args)
@@ -169,7 +452,7 @@ class Client(object):
 
         raw = response.read()
         try:
-            result = models.Job(raw)
+            result = self._parse(self.job_model, response, raw)
         except XMLSyntaxError as e:
             raise UWSError("Malformatted response. Are you sure the host you specified is a IVOA UWS service?", raw)
         except Exception as e:
@@ -185,7 +468,7 @@ class Client(object):
 
         raw = response.read()
         try:
-            result = models.Job(raw)
+            result = self._parse(self.job_model, response, raw)
         except XMLSyntaxError as e:
             raise UWSError("Malformatted response. Are you sure the host you specified is a IVOA UWS service?", raw)
         except Exception as e:
@@ -201,7 +484,7 @@ class Client(object):
 
         raw = response.read()
         try:
-            result = models.Job(raw)
+            result = self._parse(self.job_model, response, raw)
         except XMLSyntaxError as e:
             raise UWSError("Malformatted response. Are you sure the host you specified is a IVOA UWS service?", raw)
         except Exception as e:
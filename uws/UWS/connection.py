@@ -1,16 +1,827 @@
 # -*- coding: utf-8 -*-
 import httplib
 import urllib
-import urllib2
 import base64
-import mimetypes
+import math
+import os
+import random
 import re
+import socket
+import stat
+import threading
+import time
+import zlib
 
-from urlparse import urlparse
+from collections import OrderedDict
+from urlparse import urlparse, urljoin
+
+
+class ServiceUnavailable(RuntimeError):
+    """The server answered 503, retry_after is the number of seconds it asked
+    to wait before trying again, or None."""
+    def __init__(self, message, retry_after=None):
+        super(ServiceUnavailable, self).__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_after(response):
+    """Returns the delay in seconds given in the Retry-After header of
+    response, or None."""
+    value = response.getheader('retry-after')
+    if value is None:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+
+    # the HTTP date form is rare, import its parser only when needed
+    import email.utils
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, email.utils.mktime_tz(date) - time.time())
+
+
+class CircuitOpen(RuntimeError):
+    """Raised without contacting a server which failed too often recently,
+    retry_after is the number of seconds until it is tried again."""
+    def __init__(self, message, retry_after=None):
+        super(CircuitOpen, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class PooledResponse(httplib.HTTPResponse):
+    """HTTP response handing its connection back to the pool once the body
+    has been read completely.
+
+    Responses closed before their body was consumed leave unread data on the
+    socket, so their connection is discarded instead.
+    """
+    _release = None
+    _reading = False
+    bytes_received = 0
+
+    def read(self, amt=None):
+        self._reading = True
+        try:
+            data = httplib.HTTPResponse.read(self, amt)
+        finally:
+            self._reading = False
+        self.bytes_received += len(data)
+
+        if self.fp is None:
+            self._release_connection(True)
+
+        return data
+
+    def close(self):
+        if self.fp is not None and not self._reading:
+            self._release_connection(False)
+        httplib.HTTPResponse.close(self)
+
+    def _release_connection(self, reusable):
+        release, self._release = self._release, None
+        if release is not None:
+            release(reusable)
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of keep-alive connections keyed by (scheme, host, port).
+
+    At most max_size idle connections are kept per key, idle connections
+    older than idle_timeout seconds are closed instead of being reused.
+    """
+    connection_classes = {
+        'http': httplib.HTTPConnection,
+        'https': httplib.HTTPSConnection
+    }
+
+    def __init__(self, max_size=4, idle_timeout=60):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """Returns a tuple (connection, reused) for the given key."""
+        now = time.time()
+        stale = []
+        connection = None
+
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                last_used, candidate = idle.pop()
+                if now - last_used > self.idle_timeout:
+                    stale.append(candidate)
+                else:
+                    connection = candidate
+                    break
+
+        for candidate in stale:
+            candidate.close()
+
+        if connection is not None:
+            return connection, True
+
+        return self._new_connection(key), False
+
+    def release(self, key, connection, reusable=True):
+        if not reusable or connection.sock is None:
+            connection.close()
+            return
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_size:
+                idle.append((time.time(), connection))
+                return
+
+        connection.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for last_used, connection in connections:
+                connection.close()
+
+    def _new_connection(self, key):
+        scheme, host, port = key
+        connection = self.connection_classes[scheme](host, port)
+        connection.response_class = PooledResponse
+        return connection
+
+
+class ResponseCache(object):
+    """Remembers ETag and Last-Modified of responses together with the
+    objects parsed from them, so unchanged resources can be requested
+    conditionally and do not need to be parsed again.
+
+    At most max_size entries are kept, the least recently used ones are
+    evicted first. Cached objects are shared between all users of the cache.
+    """
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """Returns the (etag, last_modified, value) entry stored for key, or
+        None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def store(self, key, response, value):
+        etag = response.getheader('etag')
+        last_modified = response.getheader('last-modified')
+        if etag is None and last_modified is None:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (etag, last_modified, value)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RetryPolicy(object):
+    """Decides when failed requests are repeated and when a server is given
+    a break.
+
+    Requests with an idempotent method are repeated up to max_retries times
+    if the connection fails or the server answers with one of
+    retry_statuses. The delay grows exponentially from backoff up to
+    max_backoff seconds and is jittered, a Retry-After header given by the
+    server is used instead, but at most max_backoff seconds as well.
+
+    After failure_threshold failures in a row a server is not contacted for
+    reset_timeout seconds, or for the time given by the Retry-After of the
+    last failure, requests fail immediately with CircuitOpen instead. The
+    next failure after this pause opens the circuit again, a success closes
+    it. Failures of requests which are not repeated do not count towards
+    opening the circuit.
+
+    counters holds the number of requests, retries, failures, tripped and
+    rejected requests of all connections using the policy.
+    """
+    idempotent_methods = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+    retry_statuses = (502, 503, 504)
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=30, failure_threshold=5, reset_timeout=30):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.counters = {'requests': 0, 'retries': 0, 'failures': 0, 'trips': 0, 'rejected': 0}
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def check(self, key):
+        """Raises CircuitOpen while the server for key is given a break."""
+        with self._lock:
+            failures, reopens = self._circuits.get(key, (0, None))
+            remaining = reopens - time.time() if reopens is not None else 0
+            if failures >= self.failure_threshold and remaining > 0:
+                self.counters['rejected'] += 1
+                raise CircuitOpen('Server %s://%s:%s failed repeatedly, not trying again for now' % key, remaining)
+            self.counters['requests'] += 1
+
+    def success(self, key):
+        with self._lock:
+            self._circuits.pop(key, None)
+
+    def failure(self, key, method=None, retry_after=None):
+        with self._lock:
+            self.counters['failures'] += 1
+            if method is not None and method not in self.idempotent_methods:
+                return
+
+            failures, reopens = self._circuits.get(key, (0, None))
+            failures += 1
+            if failures >= self.failure_threshold:
+                if failures == self.failure_threshold:
+                    self.counters['trips'] += 1
+                # an overloaded server says itself when to come back
+                pause = self.reset_timeout
+                if retry_after is not None:
+                    pause = min(retry_after, self.max_backoff)
+                reopens = time.time() + pause
+            self._circuits[key] = (failures, reopens)
+
+    def can_retry(self, method, attempt):
+        return method in self.idempotent_methods and attempt < self.max_retries
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        return random.uniform(delay / 2.0, delay)
+
+
+class RequestEvent(object):
+    """Sizes and timings of one HTTP request, passed to the hooks of a
+    Connection when the response body has been read or the response was
+    closed, or when the request failed.
+
+    Times are in seconds. connect is the name lookup and TCP connect, tls
+    the handshake of https connections, both are 0 on reused connections.
+    first_byte runs from sending the request until the response headers
+    arrived, transfer from then until the body was read, total from the
+    start to the end. bytes_sent is the size of the request body, if known,
+    bytes_received that of the response body as sent by the server.
+    """
+    type = 'request'
+
+    def __init__(self, method, key, path, attempt=0, bytes_sent=None):
+        self.method = method
+        self.host = "%s:%d" % (key[1], key[2])
+        self.path = path
+        self.attempt = attempt
+        self.bytes_sent = bytes_sent
+
+        self.status = None
+        self.error = None
+        self.reused = None
+        self.bytes_received = 0
+        self.connect = 0.0
+        self.tls = 0.0
+        self.first_byte = None
+        self.transfer = None
+        self.total = None
+
+        self.started = time.time()
+        self._received = None
+
+    def responded(self, reused, sent):
+        self._received = time.time()
+        self.reused = reused
+        self.first_byte = self._received - sent
+
+    def finish(self, response=None, error=None):
+        finished = time.time()
+        self.total = finished - self.started
+        if response is not None:
+            self.status = response.status
+            self.bytes_received = response.bytes_received
+            self.transfer = finished - self._received
+        if error is not None:
+            self.error = str(error) or type(error).__name__
+
+    def __str__(self):
+        if self.status is None:
+            return "%s %s%s failed after %.1f ms: %s" % (self.method, self.host, self.path, self.total * 1000,
+                                                         self.error)
+        return "%s %s%s %d, %d bytes in %.1f ms" % (self.method, self.host, self.path, self.status,
+                                                    self.bytes_received, self.total * 1000)
+
+
+class ParseEvent(object):
+    """Time a Client spent parsing a response body into a model.
+
+    size is the length of the parsed body after a gzip or deflate encoding
+    was removed, bytes_received that of the body as sent by the server,
+    like in the RequestEvent of the response, or None if it is not known.
+    """
+    type = 'parse'
+
+    def __init__(self, model, size, parse, request=None):
+        self.model = model
+        self.size = size
+        self.parse = parse
+        # the RequestEvent of the response, if known
+        self.request = request
+        self.bytes_received = request.bytes_received if request is not None else None
+
+    def __str__(self):
+        return "parsed %d bytes into %s in %.1f ms" % (self.size, self.model, self.parse * 1000)
+
+
+def body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, basestring):
+        return len(body)
+    return getattr(body, 'size', None)
+
+
+class Histogram(object):
+    """Counts values, e.g. seconds, in buckets growing by a factor of two
+    from smallest on, so the memory used does not depend on the number of
+    values. Percentiles are estimated as the upper bound of their bucket.
+    """
+
+    def __init__(self, smallest=0.0001, buckets=24):
+        self.smallest = smallest
+        self.counts = [0] * (buckets + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def add(self, value):
+        index = 0
+        if value > self.smallest:
+            index = min(len(self.counts) - 1, int(math.ceil(math.log(value / self.smallest, 2))))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+
+        rank = max(1, int(math.ceil(fraction * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.max, self.smallest * 2 ** index)
+
+
+class RequestStats(object):
+    """Hook collecting the events of connections and clients in memory.
+
+    Add it to the hooks of a Connection or Client, or to default_hooks for
+    all of them. summary() returns the counts, throughput and latencies as
+    text.
+    """
+    phases = ('total', 'connect', 'tls', 'first_byte', 'transfer', 'parse')
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = dict((phase, Histogram()) for phase in self.phases)
+        # bytes_received counts the bytes sent by the server, bytes_parsed
+        # the same bodies after decompression
+        self.counters = {'requests': 0, 'retries': 0, 'errors': 0, 'connections': 0, 'bytes_sent': 0,
+                         'bytes_received': 0, 'parsed': 0, 'bytes_parsed': 0}
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            if event.type == ParseEvent.type:
+                self.counters['parsed'] += 1
+                self.counters['bytes_parsed'] += event.size
+                self.histograms['parse'].add(event.parse)
+                return
+
+            self.counters['requests'] += 1
+            if event.attempt:
+                self.counters['retries'] += 1
+            if event.status is None:
+                self.counters['errors'] += 1
+            else:
+                self.statuses[event.status] = self.statuses.get(event.status, 0) + 1
+            self.counters['bytes_sent'] += event.bytes_sent or 0
+            self.counters['bytes_received'] += event.bytes_received
+
+            self.histograms['total'].add(event.total)
+            if event.reused is False:
+                self.counters['connections'] += 1
+                self.histograms['connect'].add(event.connect)
+                if event.tls:
+                    self.histograms['tls'].add(event.tls)
+            if event.first_byte is not None:
+                self.histograms['first_byte'].add(event.first_byte)
+            if event.transfer is not None:
+                self.histograms['transfer'].add(event.transfer)
+
+    def summary(self, now=None):
+        if now is None:
+            now = time.time()
+        elapsed = max(now - self.started, 1e-6)
+
+        with self._lock:
+            counters = dict(self.counters)
+            lines = [
+                "%d requests in %.2f s, %.1f requests/s, %d retries, %d errors, %d new connections" % (
+                    counters['requests'], elapsed, counters['requests'] / elapsed, counters['retries'],
+                    counters['errors'], counters['connections']),
+                "received %.1f kB (%.1f kB/s) as sent by the server, sent %.1f kB" % (
+                    counters['bytes_received'] / 1024.0, counters['bytes_received'] / 1024.0 / elapsed,
+                    counters['bytes_sent'] / 1024.0),
+            ]
+            if counters['parsed']:
+                lines.append("parsed %d responses, %.1f kB after decompression" % (
+                    counters['parsed'], counters['bytes_parsed'] / 1024.0))
+            if self.statuses:
+                lines.append("status " + ", ".join("%d: %d" % item for item in sorted(self.statuses.items())))
+
+            lines.append("%-12s %7s %9s %9s %9s %9s %9s" % ("ms", "count", "mean", "p50", "p95", "p99", "max"))
+            for phase in self.phases:
+                histogram = self.histograms[phase]
+                if not histogram.count:
+                    continue
+                values = [histogram.mean(), histogram.percentile(0.5), histogram.percentile(0.95),
+                          histogram.percentile(0.99), histogram.max]
+                lines.append("%-12s %7d %s" % (phase, histogram.count,
+                                               " ".join("%9.1f" % (value * 1000) for value in values)))
+        return "\n".join(lines)
+
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class MultipartStream(object):
+    """File-like multipart/form-data request body.
+
+    Arguments starting with '@' are uploaded as files, which are read in
+    chunks while the body is sent. size is None if the length of a file
+    cannot be known up front, e.g. for a pipe. Unicode names and values are
+    sent encoded as UTF-8.
+    """
+    boundary = '--------UWS_Client_Separator'
+
+    def __init__(self, args, chunk_size=65536):
+        self.chunk_size = chunk_size
+        self.content_type = "multipart/form-data; boundary=%s" % self.boundary
+
+        crlf = '\r\n'
+        self._parts = []
+        self.size = 0
+        for key in args:
+            value = args[key]
+            name = _utf8(key)
+            if re.match('^@', value):
+                import mimetypes
+                file_name = value[1:]
+                header = '--' + self.boundary + crlf
+                header += 'Content-Disposition: form-data; '
+                header += 'name="%s"; filename="%s"' % (name, _utf8(file_name)) + crlf
+                header += 'Content-Type: '
+                header += (mimetypes.guess_type(file_name)[0] or 'application/octet-stream') + crlf + crlf
+                self._add(header)
+                self._add_file(file_name)
+                self._add(crlf)
+            else:
+                part = '--' + self.boundary + crlf
+                part += 'Content-Disposition: form-data; name="%s"' % name + crlf + crlf
+                part += _utf8(value) + crlf
+                self._add(part)
+        self._add('--' + self.boundary + '--' + crlf)
+
+        self._file = None
+        self._started = False
+        self.seek(0)
+
+    def _add(self, data):
+        self._parts.append(data)
+        if self.size is not None:
+            self.size += len(data)
+
+    def _add_file(self, file_name):
+        self._parts.append(('file', file_name))
+
+        mode = os.stat(file_name).st_mode
+        if self.size is not None and stat.S_ISREG(mode):
+            self.size += os.path.getsize(file_name)
+        else:
+            self.size = None
+
+    def seek(self, offset, whence=0):
+        if offset != 0 or whence != 0:
+            raise IOError("MultipartStream can only be rewound to its start")
+
+        if self._started and self.size is None:
+            raise IOError("Cannot rewind a request body read from a pipe")
+
+        self.close()
+        self._index = 0
+        self._pending = ''
+        self._started = False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.chunk_size
+        self._started = True
+
+        while not self._pending and self._index < len(self._parts):
+            part = self._parts[self._index]
+            if not isinstance(part, tuple):
+                self._pending = part
+                self._index += 1
+                continue
+
+            if self._file is None:
+                self._file = open(part[1], 'rb')
+            self._pending = self._file.read(self.chunk_size)
+            if not self._pending:
+                self.close()
+                self._index += 1
+
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ChunkedStream(object):
+    """Wraps a file-like body in the chunked transfer encoding."""
+    def __init__(self, stream, chunk_size=65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self._done = False
+
+    def seek(self, offset, whence=0):
+        self.stream.seek(offset, whence)
+        self._done = False
+
+    def read(self, size=-1):
+        if self._done:
+            return ''
+
+        data = self.stream.read(self.chunk_size)
+        if not data:
+            self._done = True
+            return '0\r\n\r\n'
+
+        return '%x\r\n%s\r\n' % (len(data), data)
+
+    def close(self):
+        self.stream.close()
+
+
+class DecodedResponse(object):
+    """Wraps a gzip or deflate encoded response and decompresses its body
+    while it is read. Everything else is taken from the wrapped response.
+
+    bytes_read counts the compressed bytes read so far.
+    """
+    def __init__(self, response, encoding, chunk_size=65536):
+        self.response = response
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+        if self.encoding == 'gzip':
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            # whether deflate is zlib wrapped or raw is seen in the data
+            self._decoder = None
+        self._buffer = ''
+        self._done = False
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def read(self, amt=None):
+        if amt is None or amt < 0:
+            while not self._done:
+                self._fill()
+            data, self._buffer = self._buffer, ''
+            return data
+
+        while len(self._buffer) < amt and not self._done:
+            self._fill()
+
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def _fill(self):
+        chunk = self.response.read(self.chunk_size)
+        if not chunk:
+            if self._decoder is not None:
+                self._buffer += self._decoder.flush()
+            self._done = True
+            return
+
+        self.bytes_read += len(chunk)
+
+        if self._decoder is None:
+            # zlib streams start with a header whose first two bytes are a
+            # multiple of 31
+            wrapped = len(chunk) > 1 and ord(chunk[0]) & 0x0f == 8 and (ord(chunk[0]) * 256 + ord(chunk[1])) % 31 == 0
+            self._decoder = zlib.decompressobj(zlib.MAX_WBITS if wrapped else -zlib.MAX_WBITS)
+
+        try:
+            self._buffer += self._decoder.decompress(chunk)
+        except zlib.error as e:
+            self.response.close()
+            raise RuntimeError("Cannot decode %s encoded response: %s" % (self.encoding, e))
+
+
+def decoded(response):
+    """Returns response, wrapped in a DecodedResponse if it is compressed."""
+    encoding = content_encoding(response)
+    if encoding is not None:
+        return DecodedResponse(response, encoding)
+    return response
+
+
+def content_encoding(response):
+    """Returns 'gzip' or 'deflate' if the body of response is compressed with
+    one of them, otherwise None."""
+    encoding = response.getheader('content-encoding', '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return 'gzip'
+    if encoding == 'deflate':
+        return 'deflate'
+    return None
+
+
+def streaming_body(body, headers):
+    """Sets the length headers for a MultipartStream body and returns the
+    body to send, chunk encoded if its size is unknown."""
+    if body.size is None:
+        headers['Transfer-Encoding'] = 'chunked'
+        return ChunkedStream(body)
+
+    headers['Content-Length'] = str(body.size)
+    return body
+
+
+class RedirectMap(object):
+    """Remembers where the resources of a host are redirected to, so later
+    requests can go to the target directly.
+
+    Permanent redirects (301, 308) are remembered at once, temporary ones
+    (302, 307) once a resource was redirected to the same target
+    stable_after times in a row. If the target keeps the end of the
+    requested path, the whole prefix is mapped, e.g. a redirect of /uws/1
+    to http://node/uws/1 sends all requests below /uws to http://node/uws.
+    Other redirects, e.g. of /uws to http://node/uws/, only apply to the
+    path itself. At most max_size redirects of each kind are kept.
+    """
+    def __init__(self, stable_after=2, max_size=256):
+        self.stable_after = stable_after
+        self.max_size = max_size
+
+        self._exact = OrderedDict()
+        self._targets = OrderedDict()
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, key, path):
+        """Returns the url path of host key is redirected to, or None."""
+        with self._lock:
+            target = self._exact.get((key, path))
+            if target is not None:
+                return target
+
+            for prefix, rest in self._prefixes(path):
+                target = self._targets.get((key, prefix))
+                if target is not None:
+                    if target.endswith('/') and rest.startswith('/'):
+                        rest = rest[1:]
+                    return target + rest
+        return None
+
+    def learn(self, key, path, status, location):
+        """Records that path on host key was redirected to the absolute url
+        location with the given status."""
+        prefix, target = self._common_prefix(path, location)
+
+        with self._lock:
+            if status in (302, 307):
+                last, count = self._seen.pop((key, path), (None, 0))
+                count = count + 1 if last == location else 1
+                self._remember(self._seen, (key, path), (location, count))
+                if count < self.stable_after:
+                    return
+
+            if prefix is None:
+                self._remember(self._exact, (key, path), location)
+            else:
+                self._remember(self._targets, (key, prefix), target)
+
+    def forget(self, key, path):
+        with self._lock:
+            self._exact.pop((key, path), None)
+            for prefix, rest in self._prefixes(path):
+                self._targets.pop((key, prefix), None)
+            self._seen.pop((key, path), None)
+
+    def _remember(self, entries, key, value):
+        entries.pop(key, None)
+        entries[key] = value
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+    def _prefixes(self, path):
+        # the path itself, then all shorter prefixes ending before a '/' or '?'
+        yield path, ''
+        for i in range(len(path) - 1, -1, -1):
+            if path[i] in '/?':
+                yield path[:i], path[i:]
+
+    def _common_prefix(self, path, location):
+        # the prefixes of path and location before their longest common end
+        # starting with '/' or '?', or (None, None) if they have none
+        common = 0
+        for prefix, rest in self._prefixes(path):
+            if prefix and rest and location.endswith(rest) and len(location) > len(rest):
+                common = len(rest)
+        if not common:
+            return None, None
+        return path[:len(path) - common], location[:len(location) - common]
+
+
+# shared by all connections which are not given a pool, redirect map or hooks
+default_pool = ConnectionPool()
+default_redirects = RedirectMap()
+default_hooks = []
 
 
 class Connection(object):
-    def __init__(self, url, user=None, password=None):
+    max_redirects = 10
+
+    def __init__(self, url, user=None, password=None, pool=None, cache=None, retry=None, compression=True,
+                 redirects=None, hooks=None):
+        if pool is None:
+            pool = default_pool
+        self.pool = pool
+
+        if redirects is None:
+            redirects = default_redirects
+        self.redirects = redirects
+
+        # optional ResponseCache for conditional requests
+        self.cache = cache
+
+        # optional RetryPolicy, without one failed requests are not repeated
+        self.retry = retry
+
+        # ask for compressed responses, they are decompressed while read
+        self.compression = compression
+
+        # callables given a RequestEvent for every request, and by a Client
+        # a ParseEvent for every response it parsed. The list is copied, so
+        # adding a hook later only affects this connection (and its copies)
+        if hooks is None:
+            hooks = default_hooks
+        self.hooks = list(hooks)
+
         self._set_url(url)
 
         if user is not None and password is not None:
@@ -20,8 +831,6 @@ class Connection(object):
         else:
             self.headers = {}
 
-        self.redirect_count = 0
-
     def _set_url(self, url):
         url = url.rstrip("/")
         url_parsed = urlparse(url)
@@ -29,43 +838,152 @@ class Connection(object):
         if url_parsed.scheme == '':
             url_parsed = urlparse("http://" + url)
 
+        if url_parsed.scheme not in self.pool.connection_classes:
+            raise RuntimeError('Wrong protocol specified')
+
         self.url = url
         self.clean_url = url_parsed.netloc
         self.base_path = url_parsed.path
+        self.pool_key = self._pool_key(url_parsed)
 
-        if url_parsed.scheme == "http":
-            self.connection = httplib.HTTPConnection(self.clean_url)
-        elif url_parsed.scheme == "https":
-            self.connection = httplib.HTTPSConnection(self.clean_url)
-        else:
-            raise RuntimeError('Wrong protocol specified')
+    def _pool_key(self, url_parsed):
+        port = url_parsed.port
+        if port is None:
+            port = httplib.HTTPS_PORT if url_parsed.scheme == 'https' else httplib.HTTP_PORT
+        return (url_parsed.scheme, url_parsed.hostname, port)
 
-    def get(self, path, params=None):
+    def _request(self, method, url, body=None, headers=None, key=None):
+        if key is None:
+            key = self.pool_key
 
-        if path:
-            destination_url = self.base_path + "/" + path
-        else:
-            destination_url = self.base_path
+        retry = self.retry
+        if retry is None:
+            return self._send(method, url, body, headers, key)
 
-        if params:
-            params = urllib.urlencode(params, True)
-            self.connection.request("GET", destination_url+'?'+params, headers=self.headers)
-        else:
-            self.connection.request("GET", destination_url, headers=self.headers)
+        attempt = 0
+        while True:
+            retry.check(key)
+
+            try:
+                response = self._send(method, url, body, headers, key, attempt)
+            except (httplib.HTTPException, socket.error):
+                retry.failure(key, method)
+                if not retry.can_retry(method, attempt):
+                    raise
+                delay = retry.delay(attempt)
+            else:
+                if response.status not in retry.retry_statuses:
+                    retry.success(key)
+                    return response
+
+                wait = retry_after(response)
+                retry.failure(key, method, wait)
+                if not retry.can_retry(method, attempt):
+                    return response
+
+                delay = retry.delay(attempt, wait)
+                response.read()
+
+            retry.count('retries')
+            time.sleep(delay)
+            attempt += 1
+
+            if hasattr(body, 'seek'):
+                body.seek(0)
+
+    def _send(self, method, url, body, headers, key, attempt=0):
+        event = RequestEvent(method, key, url, attempt, body_size(body))
+        try:
+            connection, response = self._open(method, url, body, headers, key, event)
+        except (httplib.HTTPException, socket.error) as error:
+            event.finish(error=error)
+            self.emit(event)
+            raise
+
+        def release(reusable):
+            self.pool.release(key, connection, reusable)
+            event.finish(response)
+            self.emit(event)
+        response._release = release
+        response.event = event
+
+        return response
+
+    def _open(self, method, url, body, headers, key, event):
+        if headers is None:
+            headers = self.headers
+
+        connection, reused = self.pool.acquire(key)
+
+        try:
+            response = self._exchange(connection, reused, method, url, body, headers, event)
+        except (httplib.BadStatusLine, socket.error) as error:
+            connection.close()
+            if not reused:
+                raise
+
+            # the server closed the idle connection in the meantime,
+            # try once more on a fresh one
+            if hasattr(body, 'seek'):
+                try:
+                    body.seek(0)
+                except IOError:
+                    raise error
+
+            connection, reused = self.pool._new_connection(key), False
+            try:
+                response = self._exchange(connection, reused, method, url, body, headers, event)
+            except:
+                connection.close()
+                raise
+        except:
+            connection.close()
+            raise
+
+        return connection, response
+
+    def _exchange(self, connection, reused, method, url, body, headers, event):
+        if not reused:
+            self._connect(connection, event)
+
+        sent = time.time()
+        connection.request(method, url, body=body, headers=headers)
+        response = connection.getresponse()
+        event.responded(reused, sent)
+        return response
 
-        response = self.connection.getresponse()
+    def _connect(self, connection, event):
+        # the name lookup and TCP connect are timed apart from the TLS
+        # handshake which follows them in HTTPSConnection.connect
+        create_connection = connection._create_connection
 
-        if response.status == 302 or response.status == 303:
-            # found - redirect
-            location = response.getheader("location")
-            new_base_path = location.replace(path, '').lstrip("/")
-            self._set_url(new_base_path)
+        def timed_create_connection(*args, **kwargs):
+            started = time.time()
+            try:
+                return create_connection(*args, **kwargs)
+            finally:
+                event.connect = time.time() - started
 
-            self.redirect_count += 1
-            if self.redirect_count > 100:
-                raise RuntimeError("Too many redirects.")
+        connection._create_connection = timed_create_connection
+        started = time.time()
+        try:
+            connection.connect()
+        finally:
+            connection._create_connection = create_connection
 
-            return self.get(path)
+        if isinstance(connection, httplib.HTTPSConnection):
+            event.tls = time.time() - started - event.connect
+
+    def emit(self, event):
+        for hook in self.hooks:
+            hook(event)
+
+    def _check_response(self, response):
+        if response.status == 200:
+            return
+
+        # read body of request so the connection can be reused
+        response.read()
 
         if response.status == 400:
             raise RuntimeError('Resource responded with bad request')
@@ -79,142 +997,361 @@ class Connection(object):
         if response.status == 404:
             raise RuntimeError('Resource does not exist')
 
-        if response.status != 200:
-            raise RuntimeError('Error with connection to server: Got response: %s %s' % (response.status, response.reason))
+        if response.status == 503:
+            raise ServiceUnavailable('Error with connection to server: Got response: %s %s' % (response.status, response.reason),
+                                     retry_after(response))
 
-        return response
+        raise RuntimeError('Error with connection to server: Got response: %s %s' % (response.status, response.reason))
 
-    def post(self, path, args):
-        # prepare multipart/form-data request
-        limit = '--------UWS_Client_Separator'
-        crlf = '\r\n'
-        params_list = []
-        for key in args:
-            params_list.append('--' + limit)
-            if re.match('^@', args[key]):
-                dummy = 'Content-Disposition: form-data; '
-                dummy += 'name="%s"; filename="%s"' % (key, args[key][1:])
-                params_list.append(dummy)
-                dummy = 'Content-Type: '
-                dummy += (mimetypes.guess_type(args[key])[0] or 'application/octet-stream')
-                params_list.append(dummy)
-                params_list.append('')
-                params_list.append(open(args[key][1:]).read())
-            else:
-                params_list.append('Content-Disposition: form-data; name="%s"'%key)
-                params_list.append('')
-                params_list.append(args[key])
-        params_list.append('--' + limit + '--')
-        params_list.append('')
-        params = crlf.join(params_list)
+    def get(self, path, params=None, cache_key=None):
+        """Sends a GET request for path.
+
+        If a cache is set and cache_key is given, the request is conditional
+        on the cached version of the resource. For unchanged resources the
+        response has status 304 and the cached object in its cached
+        attribute, otherwise remember() can be used to store the object
+        parsed from the response.
+        """
 
         if path:
             destination_url = self.base_path + "/" + path
         else:
             destination_url = self.base_path
 
-        self.headers['Content-type'] = "multipart/form-data; boundary=%s"%limit
-        self.connection.request("POST", destination_url, body=params, headers=self.headers)
-        response = self.connection.getresponse()
-        response.read()  # read body of request so we can send another
+        if params:
+            params = urllib.urlencode(params, True)
+            destination_url = destination_url + '?' + params
 
-        if response.status == 302:
-            # found - redirect
-            location = response.getheader("location")
-            new_base_path = location.replace(path, '').lstrip("/")
-            self._set_url(new_base_path)
+        headers = self._get_headers()
 
-            self.redirect_count += 1
-            if self.redirect_count > 100:
-                raise RuntimeError("Too many redirects.")
+        entry = None
+        if self.cache is not None and cache_key is not None:
+            cache_key = (self.pool_key, destination_url, cache_key)
+            entry = self.cache.lookup(cache_key)
 
-            return self.post(path, args)
+        if entry is not None:
+            etag, last_modified, value = entry
+            if etag is not None:
+                headers["If-None-Match"] = etag
+            if last_modified is not None:
+                headers["If-Modified-Since"] = last_modified
 
-        if response.status == 303:
-            # see other
-            location = response.getheader("location")
-            path = location.replace(self.url, '').lstrip('https://').lstrip('http://').lstrip("/")
-            return self.get(path)
+        key, url, response = self._follow("GET", self.pool_key, destination_url, headers=headers)
 
-        if response.status == 400:
-            raise RuntimeError('Resource responded with bad request')
+        if response.status == 304 and entry is not None:
+            response.read()
+            response.cached = entry[2]
+            return response
 
-        if response.status == 401:
-            raise RuntimeError('You are not authorized to access this resource')
+        self._check_response(response)
 
-        if response.status == 403:
-            raise RuntimeError('No permission to access this resource')
+        response.cache_key = cache_key
+        return decoded(response)
 
-        if response.status == 404:
-            raise RuntimeError('Resource does not exist')
+    def remember(self, response, value):
+        """Caches value as the object parsed from response."""
+        if self.cache is not None and getattr(response, 'cache_key', None) is not None:
+            self.cache.store(response.cache_key, response, value)
 
-        if response.status != 200:
-            raise RuntimeError('Error with connection to server: Got response: %s %s' % (response.status, response.reason))
+    def _encode_multipart(self, args):
+        # prepare multipart/form-data request, files are streamed
+        body = MultipartStream(args)
+        return body.content_type, body
 
-        return response
+    def post(self, path, args):
+        content_type, params = self._encode_multipart(args)
+
+        if path:
+            destination_url = self.base_path + "/" + path
+        else:
+            destination_url = self.base_path
+
+        headers = dict(self.headers)
+        headers['Content-type'] = content_type
+        try:
+            key, url, response = self._follow("POST", self.pool_key, destination_url,
+                                              body=streaming_body(params, headers), headers=headers)
+        finally:
+            params.close()
+
+        self._check_response(response)
+
+        return decoded(response)
 
     def delete(self, path):
-        self.connection.request("DELETE", self.base_path + '/' + path, headers=self.headers)
-        response = self.connection.getresponse()
-        # read body of request so we can send another
-        response.read()
+        key, url, response = self._follow("DELETE", self.pool_key, self.base_path + '/' + path)
 
-        if response.status == 302:
-            # found - redirect
-            location = response.getheader("location")
-            new_base_path = location.replace(path, '').lstrip("/")
-            self._set_url(new_base_path)
+        self._check_response(response)
 
-            self.redirect_count += 1
-            if self.redirect_count > 100:
-                raise RuntimeError("Too many redirects.")
+        return decoded(response)
 
-            return self.delete(path)
+    def _get_headers(self):
+        headers = dict(self.headers)
+        if self.compression:
+            headers["Accept-Encoding"] = "gzip, deflate"
+        return headers
 
-        if response.status == 303:
-            # see other
-            location = response.getheader("location")
-            path = location.replace(self.url, '').lstrip('https://').lstrip('http://').lstrip("/")
-            return self.get(path)
+    def _follow(self, method, key, url, body=None, headers=None):
+        """Sends a request for url on host key and follows redirects.
 
-        if response.status == 400:
-            raise RuntimeError('Resource responded with bad request')
+        Redirects are looked up in and recorded to the redirect map, the url
+        of the service itself does not change. A 303 answer is followed with
+        a GET request. Returns the final host key, url and response.
+        """
+        source = (key, url)
+        target = self.redirects.resolve(key, url)
+        if target is not None:
+            key, url = self._split_url(target)
 
-        if response.status == 401:
-            raise RuntimeError('You are not authorized to access this resource')
+        for i in range(self.max_redirects + 1):
+            try:
+                response = self._request(method, url, body=body, headers=headers, key=key)
+            except (httplib.HTTPException, socket.error):
+                if target is None:
+                    raise
+                response = None
 
-        if response.status == 403:
-            raise RuntimeError('No permission to access this resource')
+            if target is not None and (response is None or response.status == 404 or response.status >= 500):
+                # the remembered target does not work (anymore), ask the
+                # original resource again
+                if response is not None:
+                    response.read()
+                self.redirects.forget(*source)
+                target = None
+                key, url = source
+                self._rewind(body)
+                continue
+            target = None
 
-        if response.status == 404:
-            raise RuntimeError('Resource does not exist')
+            if response.status not in (301, 302, 303, 307, 308):
+                return key, url, response
+
+            response.read()
+            location = urljoin(self._join_url(key, url), response.getheader("location"))
+
+            if response.status == 303:
+                # see other, e.g. the job created by a POST
+                method, body, headers = "GET", None, self._get_headers()
+            elif (key, url) == source:
+                self.redirects.learn(key, url, response.status, location)
+
+            key, url = self._split_url(location)
+            self._rewind(body)
+
+        raise RuntimeError("Too many redirects.")
+
+    def _rewind(self, body):
+        if hasattr(body, 'seek'):
+            body.seek(0)
+
+    def _split_url(self, url):
+        # host key and path of an absolute url
+        url_parsed = urlparse(url)
+        if url_parsed.scheme not in self.pool.connection_classes:
+            raise RuntimeError('Wrong protocol specified')
+
+        path = url_parsed.path or '/'
+        if url_parsed.query:
+            path += '?' + url_parsed.query
+        return self._pool_key(url_parsed), path
+
+    def _join_url(self, key, path):
+        scheme, host, port = key
+        return "%s://%s:%d%s" % (scheme, host, port, path)
+
+    def _open_url(self, method, url, headers=None):
+        """Requests an absolute url, which may point to another host, and
+        follows redirects. Returns the final url and the response."""
+        request_headers = dict(self.headers)
+        if headers:
+            request_headers.update(headers)
+
+        key, path = self._split_url(url)
+        key, path, response = self._follow(method, key, path, headers=request_headers)
+        return self._join_url(key, path), response
+
+    def _probe_download(self, url):
+        """Returns the final url, size and range support of a download, or
+        None if the server does not answer HEAD requests."""
+        try:
+            url, response = self._open_url("HEAD", url)
+        except (httplib.HTTPException, socket.error):
+            return None
+        response.read()
 
         if response.status != 200:
-            raise RuntimeError('Error with connection to server: Got response: %s %s' % (response.status, response.reason))
+            return None
 
-        return response
+        length = response.getheader('content-length')
+        if length is not None:
+            length = int(length)
+
+        accepts_ranges = response.getheader('accept-ranges', '').lower() == 'bytes'
 
-    def download_file(self, url, usr, pwd, file_name, chunk_size_kb=1024, callback=None):
-        request = urllib2.Request(url)
-        if hasattr(self, 'auth_string'):
-            request.add_header("Authorization", "Basic %s" % self.auth_string)
-        handler = urllib2.urlopen(request)
+        return url, length, accepts_ranges
 
+    def download_file(self, url, usr, pwd, file_name, chunk_size_kb=1024, callback=None, segments=1, resume=False,
+                      keep_compressed=False):
+        """Downloads url into file_name and returns the name of the file
+        written.
+
+        If the server supports range requests, the download is split into
+        the given number of segments which are fetched in parallel, and with
+        resume a partially downloaded file is continued from its current size.
+        The size of the downloaded file is verified against Content-Length.
+
+        Downloads in one piece are requested compressed and decompressed
+        while they are written. With keep_compressed a gzip compressed
+        result is stored as it is, in file_name with '.gz' appended.
+
+        callback is called with the expected size of the file, or None if it
+        is not known in advance, and the bytes written to it so far.
+        """
         chunk_size = int(chunk_size_kb * 1024)
 
-        if handler.headers.get('content-length') is not None:
-            file_size = handler.headers.get('content-length')
+        offset = 0
+        if resume and os.path.exists(file_name):
+            offset = os.path.getsize(file_name)
+
+        probe = None
+        if segments > 1 or offset:
+            probe = self._probe_download(url)
+
+        if probe is None or not probe[2] or probe[1] is None:
+            # no range support, fetch everything in one stream
+            return self._download_stream(url, file_name, 0, None, chunk_size, callback, keep_compressed)
+
+        url, file_size, accepts_ranges = probe
+
+        if offset > file_size:
+            offset = 0
+        elif offset == file_size:
+            if callback is not None:
+                callback(file_size, file_size)
+            return file_name
+
+        segments = max(1, min(segments, (file_size - offset) // chunk_size))
+        if segments == 1:
+            return self._download_stream(url, file_name, offset, file_size, chunk_size, callback, keep_compressed)
+
+        return self._download_segments(url, file_name, offset, file_size, segments, chunk_size, callback, resume)
+
+    def _download_stream(self, url, file_name, offset, file_size, chunk_size, callback, keep_compressed=False):
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        elif keep_compressed:
+            headers['Accept-Encoding'] = 'gzip'
+        elif self.compression:
+            # ranges of compressed responses would not fit the file on disk
+            headers['Accept-Encoding'] = 'gzip, deflate'
+
+        url, response = self._open_url("GET", url, headers)
+
+        if response.status == 206:
+            mode = 'ab'
         else:
-            file_size = None
+            self._check_response(response)
+            # the server sends the complete file
+            mode = 'wb'
+            offset = 0
+            file_size = response.getheader('content-length')
+            if file_size is not None:
+                file_size = int(file_size)
 
-        # write the data to file
-        file_read = 0
-        with open(file_name, 'wb') as file_handler:
-            for chunk in iter(lambda: handler.read(chunk_size), ''):
-                file_read += len(chunk)
+            encoding = content_encoding(response)
+            if encoding == 'gzip' and keep_compressed:
+                file_name += '.gz'
+            elif encoding is not None:
+                response = DecodedResponse(response, encoding, chunk_size)
+
+        # the size is checked against the bytes transferred, the progress
+        # reports the bytes written, whose total is unknown until decoded
+        total = None if isinstance(response, DecodedResponse) else file_size
+        file_read = offset
+        written = offset
+        with open(file_name, mode) as file_handler:
+            for chunk in iter(lambda: response.read(chunk_size), ''):
                 file_handler.write(chunk)
+                written += len(chunk)
+                if isinstance(response, DecodedResponse):
+                    file_read = response.bytes_read
+                else:
+                    file_read = written
 
                 if callback is not None:
-                    callback(file_size, file_read)
+                    callback(total, written)
+
+        if file_size is not None and file_read != file_size:
+            raise RuntimeError("Download incomplete: got %d of %d bytes" % (file_read, file_size))
+
+        return file_name
+
+    def _download_segments(self, url, file_name, offset, file_size, segments, chunk_size, callback, resume=False):
+        segment_size = (file_size - offset) // segments
+        ranges = []
+        for i in range(segments):
+            start = offset + i * segment_size
+            end = file_size - 1 if i == segments - 1 else start + segment_size - 1
+            ranges.append((start, end))
+
+        lock = threading.Lock()
+        progress = [offset]
+
+        def report(size):
+            with lock:
+                progress[0] += size
+                if callback is not None:
+                    callback(file_size, progress[0])
+
+        def fetch(byte_range):
+            start, end = byte_range
+
+            # every segment goes to its own part file, named by its range so
+            # an interrupted download can be resumed segment by segment, a
+            # part left over from another download is overwritten otherwise
+            part_name = "%s.part-%d-%d" % (file_name, start, end)
+            done = 0
+            mode = 'wb'
+            if resume and os.path.exists(part_name):
+                done = min(os.path.getsize(part_name), end - start + 1)
+                mode = 'ab'
+                report(done)
+
+            if start + done <= end:
+                headers = {'Range': 'bytes=%d-%d' % (start + done, end)}
+                final_url, response = self._open_url("GET", url, headers)
+
+                if response.status != 206:
+                    response.close()
+                    raise RuntimeError("Server did not respect the requested range of '%s'" % url)
+
+                with open(part_name, mode) as file_handler:
+                    for chunk in iter(lambda: response.read(chunk_size), ''):
+                        file_handler.write(chunk)
+                        report(len(chunk))
+
+            if os.path.getsize(part_name) != end - start + 1:
+                raise RuntimeError("Download incomplete: segment %d-%d of '%s'" % (start, end, url))
+
+            return part_name
+
+        from multiprocessing.pool import ThreadPool
+        workers = ThreadPool(segments)
+        try:
+            part_names = workers.map(fetch, ranges)
+        finally:
+            workers.terminate()
+
+        # join the segments
+        with open(file_name, 'ab' if offset else 'wb') as file_handler:
+            for part_name in part_names:
+                with open(part_name, 'rb') as part_handler:
+                    for chunk in iter(lambda: part_handler.read(chunk_size), ''):
+                        file_handler.write(chunk)
+                os.remove(part_name)
+
+        if os.path.getsize(file_name) != file_size:
+            raise RuntimeError("Download incomplete: got %d of %d bytes" % (os.path.getsize(file_name), file_size))
 
-        return True
+        return file_name
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import bisect
+import datetime
+import heapq
+import re
+
+import dateutil.parser
+import pytz
+
+_iso_datetime = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?(Z|[+-]\d\d:?\d\d)?$')
+
+
+def utc_datetime(value):
+    """Returns value, a datetime or a date string, as naive UTC datetime.
+    Naive datetimes are taken as UTC."""
+    if not hasattr(value, 'utcoffset'):
+        # the format of UWS creation times is parsed without dateutil,
+        # which is much slower
+        match = _iso_datetime.match(value)
+        if match is None:
+            value = dateutil.parser.parse(value)
+        else:
+            year, month, day, hour, minute, second, fraction, zone = match.groups()
+            value = datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                                      int((fraction or '0').ljust(6, '0')))
+            if zone and zone != 'Z':
+                offset = datetime.timedelta(hours=int(zone[1:3]), minutes=int(zone[-2:]))
+                value = value - offset if zone[0] == '+' else value + offset
+            return value
+
+    if value.utcoffset() is not None:
+        value = value.astimezone(pytz.utc).replace(tzinfo=None)
+    return value
+
+
+class JobIndex(object):
+    """Job references of a job list, indexed by id, phase, owner, runId and
+    creation time.
+
+    Lookups return the job references in the order of the job list, except
+    for creation time ranges, which are sorted by creation time. The
+    creation time index is built on the first range query.
+    """
+    def __init__(self, jobs=None):
+        self._jobs = []
+        self._ids = {}
+        self._phases = {}
+        self._owners = {}
+        self._run_ids = {}
+        self._creation = None
+
+        if jobs is not None:
+            # accept models.Jobs as well as a JobRefStream or a plain list
+            for job in getattr(jobs, 'job_reference', jobs):
+                self.add(job)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __iter__(self):
+        return iter(self._jobs)
+
+    def add(self, job):
+        position = len(self._jobs)
+        self._jobs.append(job)
+        self._ids[job.id] = position
+
+        for phase in job.phase:
+            self._phases.setdefault(phase, []).append(position)
+
+        owner = getattr(job, 'ownerId', None)
+        if owner is not None:
+            self._owners.setdefault(owner, []).append(position)
+
+        run_id = getattr(job, 'runId', None)
+        if run_id is not None:
+            self._run_ids.setdefault(run_id, []).append(position)
+
+        self._creation = None
+
+    def get(self, id):
+        position = self._ids.get(id)
+        if position is None:
+            return None
+        return self._jobs[position]
+
+    def by_phase(self, *phases):
+        return self._select(self._by_phase(phases))
+
+    def by_owner(self, owner):
+        return self._select(self._owners.get(owner, []))
+
+    def by_run_id(self, run_id):
+        return self._select(self._run_ids.get(run_id, []))
+
+    def created_between(self, after=None, before=None):
+        """Returns the jobs created after and before the given times (both
+        excluded), sorted by creation time. Jobs without creation time are
+        never returned."""
+        return self._select(self._created_between(after, before))
+
+    def select(self, phases=None, owner=None, run_id=None, after=None, before=None):
+        """Returns the jobs matching all given criteria, in list order."""
+        candidates = []
+        if phases:
+            candidates.append(self._by_phase(phases))
+        if owner is not None:
+            candidates.append(self._owners.get(owner, []))
+        if run_id is not None:
+            candidates.append(self._run_ids.get(run_id, []))
+        if after is not None or before is not None:
+            candidates.append(sorted(self._created_between(after, before)))
+
+        if not candidates:
+            return list(self._jobs)
+
+        # walk the smallest candidate list and look each position up in the
+        # others by bisection, all lists are sorted by position, so the
+        # work follows the size of the smallest list, not of the job list
+        candidates.sort(key=len)
+        smallest, others = candidates[0], candidates[1:]
+        starts = [0] * len(others)
+        selected = []
+        for position in smallest:
+            for i, other in enumerate(others):
+                index = starts[i] = bisect.bisect_left(other, position, starts[i])
+                if index == len(other) or other[index] != position:
+                    break
+            else:
+                selected.append(position)
+        return self._select(selected)
+
+    def _select(self, positions):
+        return [self._jobs[position] for position in positions]
+
+    def _by_phase(self, phases):
+        lists = [self._phases[phase] for phase in set(phases) if phase in self._phases]
+        if len(lists) == 1:
+            return lists[0]
+
+        positions = []
+        for position in heapq.merge(*lists):
+            # a job can be listed with several phases
+            if not positions or positions[-1] != position:
+                positions.append(position)
+        return positions
+
+    def _created_between(self, after, before):
+        if self._creation is None:
+            created = sorted(
+                (utc_datetime(job.creationTime), position) for position, job in enumerate(self._jobs)
+                if getattr(job, 'creationTime', None) is not None
+            )
+            self._creation = ([time for time, position in created],
+                              [position for time, position in created])
+
+        times, positions = self._creation
+        start = 0
+        end = len(times)
+        if after is not None:
+            start = bisect.bisect_right(times, utc_datetime(after))
+        if before is not None:
+            end = bisect.bisect_left(times, utc_datetime(before))
+
+        return positions[start:end]
@@ -1,37 +1,73 @@
 # -*- coding: utf-8 -*-
 from lxml import etree as et
 
+from errors import UWSError
+
 uws_1_namespace = "http://www.ivoa.net/xml/UWS/v1.0"
 #uws_2_namespace = "http://www.ivoa.net/xml/UWS/v2.0"
 xlink_namespace = "http://www.w3.org/1999/xlink"
 
+_xlink_type = et.QName(xlink_namespace, "type")
+_xlink_href = et.QName(xlink_namespace, "href")
+
 
 class UWS1Flavour(object):
+    """Element names of the UWS 1.x namespace, as QNames and as compiled
+    XPath expressions selecting the matching children of an element.
+
+    Use get_flavour() to get the shared instance for a document.
+    """
+    namespace = uws_1_namespace
+
+    elements = ("jobs", "jobref", "phase", "jobId", "runId", "ownerId", "quote",
+                "creationTime", "startTime", "endTime", "executionDuration",
+                "destruction", "parameters", "results", "errorSummary", "message",
+                "jobInfo")
+
     def __init__(self, namespaces=None):
 
-        if uws_1_namespace not in namespaces.values():
+        if namespaces is not None and self.namespace not in namespaces.values():
             raise RuntimeError("No supported UWS namespace found in xml-response, cannot parse xml.")
 
         # prepend each element's name with the correct uws-namespace
         # for this version
-        self.uws_namespace = uws_1_namespace
-        self.jobs = et.QName(self.uws_namespace, "jobs")
-        self.jobref = et.QName(self.uws_namespace, "jobref")
-        self.phase = et.QName(self.uws_namespace, "phase")
-        self.jobId = et.QName(self.uws_namespace, "jobId")
-        self.runId = et.QName(self.uws_namespace, "runId")
-        self.ownerId = et.QName(self.uws_namespace, "ownerId")
-        self.quote = et.QName(self.uws_namespace, "quote")
-        self.creationTime = et.QName(self.uws_namespace, "creationTime")
-        self.startTime = et.QName(self.uws_namespace, "startTime")
-        self.endTime = et.QName(self.uws_namespace, "endTime")
-        self.executionDuration = et.QName(self.uws_namespace, "executionDuration")
-        self.destruction = et.QName(self.uws_namespace, "destruction")
-        self.parameters = et.QName(self.uws_namespace, "parameters")
-        self.results = et.QName(self.uws_namespace, "results")
-        self.errorSummary = et.QName(self.uws_namespace, "errorSummary")
-        self.message = et.QName(self.uws_namespace, "message")
-        self.jobInfo = et.QName(self.uws_namespace, "jobInfo")
+        self.uws_namespace = self.namespace
+        self._paths = {}
+
+        for name in self.elements:
+            setattr(self, name, et.QName(self.uws_namespace, name))
+            self._paths[name] = et.ETXPath("{%s}%s" % (self.uws_namespace, name))
+
+    def find(self, element, name):
+        """Returns the first child of element with the given name, or None."""
+        found = self._paths[name](element)
+        if found:
+            return found[0]
+        return None
+
+    def findall(self, element, name):
+        """Returns all children of element with the given name."""
+        return self._paths[name](element)
+
+
+# flavour classes by UWS namespace, and their shared instances
+flavours = {uws_1_namespace: UWS1Flavour}
+_flavour_instances = {}
+
+
+def get_flavour(namespaces):
+    """Returns the flavour for the UWS namespace found in the namespace map of
+    a document. Flavours are created once per namespace and then reused."""
+    for namespace in namespaces.values():
+        flavour = _flavour_instances.get(namespace)
+        if flavour is not None:
+            return flavour
+
+        if namespace in flavours:
+            flavour = flavours[namespace]()
+            return _flavour_instances.setdefault(namespace, flavour)
+
+    raise RuntimeError("No supported UWS namespace found in xml-response, cannot parse xml.")
 
 
 class JobPhases(object):
@@ -53,6 +89,9 @@ class JobPhases(object):
     # phases for which blocking behaviour can occur:
     active_phases = [PENDING, QUEUED, EXECUTING]
 
+    # phases a job does not leave on its own:
+    final_phases = [COMPLETED, ERROR, ABORTED, ARCHIVED]
+
     versions = {
         COMPLETED: ['1.0', '1.1'],
         PENDING: ['1.0', '1.1'],
@@ -80,27 +119,36 @@ class BaseUWSModel(object):
 
 
 class Jobs(BaseUWSModel):
-    def __init__(self, xml=None):
+    def __init__(self, xml=None, compact=False):
         super(Jobs, self).__init__()
 
         self.job_reference = None
 
+        # compact job references save memory on very long job lists
+        if compact:
+            self.jobref_model = CompactJobRef
+            self.reference_model = CompactReference
+        else:
+            self.jobref_model = JobRef
+            self.reference_model = Reference
+
         if xml is not None:
             # parse xml
             parsed = et.fromstring(xml)
 
-            uws_flavour = UWS1Flavour(parsed.nsmap)
+            nsmap = parsed.nsmap
+            uws_flavour = get_flavour(nsmap)
 
             if parsed.get("version"):
                 self.version = parsed.get("version")
 
-            xml_jobs = parsed.findall(uws_flavour.jobref)
+            xml_jobs = uws_flavour.findall(parsed, 'jobref')
 
             self.job_reference = []
 
             for xmlJob in xml_jobs:
                 self.add_job(
-                    job=JobRef(xml_node=xmlJob, xml_namespace=parsed.nsmap, uws_flavour=uws_flavour)
+                    job=self.jobref_model(xml_node=xmlJob, xml_namespace=nsmap, uws_flavour=uws_flavour)
                 )
         else:
             self.job_reference = []
@@ -118,11 +166,69 @@ class Jobs(BaseUWSModel):
         if job is not None:
             self.job_reference.append(job)
         else:
-            reference = Reference(href=href, type="simple")
-            job_reference = JobRef(id=id, phase=phase, reference=reference)
+            reference = self.reference_model(href=href, type="simple")
+            job_reference = self.jobref_model(id=id, phase=phase, reference=reference)
             self.job_reference.append(job_reference)
 
 
+class JobRefStream(BaseUWSModel):
+    """Incrementally parses a job list from a file-like source.
+
+    Iterating yields one JobRef at a time; elements which have already been
+    processed are removed from the tree, so memory usage does not grow with
+    the length of the job list. The source is closed when the iteration
+    ends, fails or is abandoned, so a pooled connection is given back.
+    """
+    def __init__(self, source, compact=False):
+        super(JobRefStream, self).__init__()
+
+        if compact:
+            self.jobref_model = CompactJobRef
+        else:
+            self.jobref_model = JobRef
+
+        self._source = source
+        self._events = et.iterparse(source, events=("start", "end"))
+
+        # read up to the root element, so namespaces and version are known
+        # before the first job reference is requested
+        try:
+            event, self._root = next(self._events)
+        except:
+            self.close()
+            raise
+
+        self.uws_flavour = get_flavour(self._root.nsmap)
+
+        if self._root.get("version"):
+            self.version = self._root.get("version")
+
+    def __iter__(self):
+        jobref = self.uws_flavour.jobref.text
+        nsmap = self._root.nsmap
+
+        try:
+            for event, element in self._events:
+                if event != "end" or element.tag != jobref:
+                    continue
+
+                yield self.jobref_model(xml_node=element, xml_namespace=nsmap, uws_flavour=self.uws_flavour)
+
+                # drop the processed element and everything before it
+                element.clear()
+                while element.getprevious() is not None:
+                    del self._root[0]
+        except et.XMLSyntaxError as e:
+            raise UWSError("Malformatted response. Are you sure the host you specified is a IVOA UWS service?", str(e))
+        finally:
+            self.close()
+
+    def close(self):
+        close = getattr(self._source, 'close', None)
+        if close is not None:
+            close()
+
+
 class JobRef(BaseUWSModel):
     def __init__(self, id=None, phase=None, reference=None, xml_node=None, xml_namespace=None, uws_flavour=None):
         super(JobRef, self).__init__()
@@ -137,7 +243,7 @@ class JobRef(BaseUWSModel):
             # UWS standard defines array, therefore treat phase as array
             # (... actually it does not, but keep it anyway like this, maybe at
             # some point in the future all phases of a job are provided as list)
-            self.phase = [elm.text for elm in xml_node.findall(uws_flavour.phase)]
+            self.phase = [elm.text for elm in uws_flavour.findall(xml_node, 'phase')]
             self.reference = Reference(xml_node=xml_node, xml_namespace=xml_namespace)
             self.runId = xml_node.get('runId')
             self.ownerId = xml_node.get('ownerId')
@@ -177,14 +283,12 @@ class Reference(BaseUWSModel):
         self.href = ""
 
         if xml_node is not None:
-            # check that namespace for xlink really exists
-            if xlink_namespace not in xml_namespace.values():
-                raise RuntimeError("No supported xlink namespace found in xml-response, cannot parse xml.")
+            self.type = xml_node.get(_xlink_type)
+            self.href = xml_node.get(_xlink_href)
 
-            qualifiedname_type = et.QName(xlink_namespace, "type")
-            qualifiedname_href = et.QName(xlink_namespace, "href")
-            self.type = xml_node.get(qualifiedname_type)
-            self.href = xml_node.get(qualifiedname_href)
+            # only a missing href can be caused by a missing xlink namespace
+            if self.href is None and xlink_namespace not in xml_namespace.values():
+                raise RuntimeError("No supported xlink namespace found in xml-response, cannot parse xml.")
         elif href is not None and type is not None:
             self.type = type
             self.href = href
@@ -210,55 +314,65 @@ class Job(BaseUWSModel):
         self.end_time = None
         self.execution_duration = 0
         self.destruction = None
-        self.parameters = []
-        self.results = []
-        self.error_summary = None
-        self.job_info = []
 
-        if xml is not None:
+        if xml is None:
+            self.parameters = []
+            self.results = []
+            self.error_summary = None
+            self.job_info = []
+        else:
             # parse xml
             parsed = et.fromstring(xml)
 
             # again find proper UWS namespace-string as prefix for search paths in find
-            uws_flavour = UWS1Flavour(parsed.nsmap)
+            uws_flavour = get_flavour(parsed.nsmap)
 
             if parsed.get("version"):
                 self.version = parsed.get("version")
 
-            self.job_id        = self._get_mandatory(parsed, uws_flavour.jobId)
-            self.run_id        = self._get_optional(parsed, uws_flavour.runId)
-            self.owner_id      = self._get_optional(parsed, uws_flavour.ownerId)
-            self.phase         = [self._get_mandatory(parsed, uws_flavour.phase)]
-            self.quote         = self._get_optional(parsed, uws_flavour.quote)
-            self.creation_time = self._get_optional(parsed, uws_flavour.creationTime)
-            self.start_time    = self._get_mandatory(parsed, uws_flavour.startTime)
-            self.end_time      = self._get_mandatory(parsed, uws_flavour.endTime)
-            self.execution_duration = int(self._get_mandatory(parsed, uws_flavour.executionDuration))
-            self.destruction   = self._get_mandatory(parsed, uws_flavour.destruction)
-
-            self.parameters = []
-            tmp = parsed.find(uws_flavour.parameters)
-            if tmp is not None:
-                parameters = list(tmp)
-            for param in parameters:
-                self.add_parameter(parameter=Parameter(xml_node=param))
-
-            self.results = []
-            tmp = parsed.find(uws_flavour.results)
-            if tmp is not None:
-                results = list(tmp)
-            for res in results:
-                self.add_result(result=Result(xml_node=res, xml_namespace=parsed.nsmap))
-
-            self.error_summary = False
-            tmp = parsed.find(uws_flavour.errorSummary)
-            if tmp is not None:
-                self.error_summary = ErrorSummary(xml_node=tmp, uws_flavour=uws_flavour)
+            self.job_id        = self._get_mandatory(parsed, uws_flavour, 'jobId')
+            self.run_id        = self._get_optional(parsed, uws_flavour, 'runId')
+            self.owner_id      = self._get_optional(parsed, uws_flavour, 'ownerId')
+            self.phase         = [self._get_mandatory(parsed, uws_flavour, 'phase')]
+            self.quote         = self._get_optional(parsed, uws_flavour, 'quote')
+            self.creation_time = self._get_optional(parsed, uws_flavour, 'creationTime')
+            self.start_time    = self._get_mandatory(parsed, uws_flavour, 'startTime')
+            self.end_time      = self._get_mandatory(parsed, uws_flavour, 'endTime')
+            self.execution_duration = int(self._get_mandatory(parsed, uws_flavour, 'executionDuration'))
+            self.destruction   = self._get_mandatory(parsed, uws_flavour, 'destruction')
+
+            self._parse_details(parsed, uws_flavour)
+
+    def _parse_details(self, parsed, uws_flavour):
+        self.parameters = self._parse_parameters(parsed, uws_flavour)
+        self.results = self._parse_results(parsed, uws_flavour)
+        self.error_summary = self._parse_error_summary(parsed, uws_flavour)
+        self.job_info = self._parse_job_info(parsed, uws_flavour)
+
+    def _parse_parameters(self, parsed, uws_flavour):
+        tmp = uws_flavour.find(parsed, 'parameters')
+        if tmp is None:
+            return []
+        return [Parameter(xml_node=param) for param in tmp]
+
+    def _parse_results(self, parsed, uws_flavour):
+        tmp = uws_flavour.find(parsed, 'results')
+        if tmp is None:
+            return []
+        nsmap = parsed.nsmap
+        return [Result(xml_node=res, xml_namespace=nsmap) for res in tmp]
+
+    def _parse_error_summary(self, parsed, uws_flavour):
+        tmp = uws_flavour.find(parsed, 'errorSummary')
+        if tmp is None:
+            return False
+        return ErrorSummary(xml_node=tmp, uws_flavour=uws_flavour)
 
-            self.job_info = []
-            tmp = parsed.find(uws_flavour.jobInfo)
-            if tmp is not None:
-                self.job_info = list(tmp)
+    def _parse_job_info(self, parsed, uws_flavour):
+        tmp = uws_flavour.find(parsed, 'jobInfo')
+        if tmp is None:
+            return []
+        return list(tmp)
 
     def __unicode__(self):
         str = "JobId : '%s'\n" % self.job_id
@@ -304,27 +418,63 @@ class Job(BaseUWSModel):
 
         self.results.append(result)
 
-    def _get_optional(self, parsed, element_name):
+    def _get_optional(self, parsed, uws_flavour, element_name):
         """Returns the text value of element_name within the parsed elementTree.
 
         If element_name doesn't exist, return None.
         """
-        option = parsed.find(element_name)
+        option = uws_flavour.find(parsed, element_name)
         if option is None:
             return None
         else:
             return option.text
 
-    def _get_mandatory(self, parsed, element_name):
+    def _get_mandatory(self, parsed, uws_flavour, element_name):
         """Check if the element exists, return text or error"""
 
-        element = parsed.find(element_name)
+        element = uws_flavour.find(parsed, element_name)
         if element is None:
-            raise RuntimeError("Mandatory element ", element_name.text, " could not be found in xml-response.")
+            raise RuntimeError("Mandatory element ", getattr(uws_flavour, element_name).text, " could not be found in xml-response.")
         else:
             return element.text
 
 
+class LazyField(object):
+    """Attribute of a LazyJob, built by parser from the parsed document on
+    first access and stored on the instance afterwards."""
+    def __init__(self, name, parser):
+        self.name = name
+        self.parser = parser
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        value = self.parser(instance, instance._parsed, instance._uws_flavour)
+        instance.__dict__[self.name] = value
+
+        # the document is not needed anymore once everything is built
+        if all(name in instance.__dict__ for name in instance.lazy_fields):
+            del instance._parsed
+
+        return value
+
+
+class LazyJob(Job):
+    """Job which keeps the parsed document and builds parameters, results,
+    error_summary and job_info only when they are first accessed."""
+    lazy_fields = ('parameters', 'results', 'error_summary', 'job_info')
+
+    parameters = LazyField('parameters', Job._parse_parameters)
+    results = LazyField('results', Job._parse_results)
+    error_summary = LazyField('error_summary', Job._parse_error_summary)
+    job_info = LazyField('job_info', Job._parse_job_info)
+
+    def _parse_details(self, parsed, uws_flavour):
+        self._parsed = parsed
+        self._uws_flavour = uws_flavour
+
+
 class Parameter(BaseUWSModel):
     def __init__(self, id=None, by_reference=False, is_post=False, value=None, xml_node=None):
         super(Parameter, self).__init__()
@@ -391,7 +541,7 @@ class ErrorSummary(BaseUWSModel):
             self.has_detail = self._parse_bool(xml_node.get('hasDetail', default=False))
 
             self.messages = []
-            messages = xml_node.findall(uws_flavour.message)
+            messages = uws_flavour.findall(xml_node, 'message')
 
             for message in messages:
                 self.messages.append(message.text)
@@ -406,3 +556,199 @@ class ErrorSummary(BaseUWSModel):
 
     def __str__(self):
         return unicode(self).encode('utf-8')
+
+
+def _intern(value):
+    # only byte strings can be interned; lxml returns them for ascii content
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+class CompactModel(object):
+    """Base of the compact models, which have no per-instance __dict__ and
+    share the version with all other instances."""
+    __slots__ = ()
+
+    version = "1.0"
+
+    _parse_bool = BaseUWSModel.__dict__['_parse_bool']
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+
+class CompactReference(CompactModel):
+    __slots__ = ('type', 'href')
+
+    def __init__(self, href=None, type=None, xml_node=None, xml_namespace=None):
+        self.type = "simple"
+        self.href = ""
+
+        if xml_node is not None:
+            self.type = _intern(xml_node.get(_xlink_type))
+            self.href = xml_node.get(_xlink_href)
+
+            if self.href is None and xlink_namespace not in xml_namespace.values():
+                raise RuntimeError("No supported xlink namespace found in xml-response, cannot parse xml.")
+        elif href is not None and type is not None:
+            self.type = _intern(type)
+            self.href = href
+
+    def __unicode__(self):
+        return self.href
+
+
+class CompactJobRef(CompactModel):
+    """JobRef using __slots__. The phase is a tuple shared by all job
+    references in the same phase."""
+    __slots__ = ('id', 'phase', 'reference', 'runId', 'ownerId', 'creationTime')
+
+    _phases = {}
+
+    def __init__(self, id=None, phase=None, reference=None, xml_node=None, xml_namespace=None, uws_flavour=None):
+        self.id = None
+        self.reference = CompactReference()
+        self.phase = ()
+        self.runId = None
+        self.ownerId = None
+        self.creationTime = None
+
+        if xml_node is not None:
+            self.id = xml_node.get('id')
+            self.phase = self._shared_phase([elm.text for elm in uws_flavour.findall(xml_node, 'phase')])
+            self.reference = CompactReference(xml_node=xml_node, xml_namespace=xml_namespace)
+            self.runId = _intern(xml_node.get('runId'))
+            self.ownerId = _intern(xml_node.get('ownerId'))
+            self.creationTime = xml_node.get('creationTime')
+
+        elif id is not None and phase is not None and reference is not None:
+            self.id = id
+
+            if isinstance(phase, basestring):
+                phase = [phase]
+            self.phase = self._shared_phase(phase)
+
+            if isinstance(reference, (Reference, CompactReference)):
+                self.reference = reference
+            else:
+                raise RuntimeError("Malformated reference given in jobref id: %s" % id)
+
+    @classmethod
+    def _shared_phase(cls, phase):
+        phase = tuple(_intern(value) for value in phase)
+        return cls._phases.setdefault(phase, phase)
+
+    def set_phase(self, new_phase):
+        self.phase = self._shared_phase([new_phase])
+
+    def __unicode__(self):
+        if self.creationTime is not None:
+            return "Job '%s' in phase '%s' created at '%s' - %s" % (self.id, ', '.join(self.phase), self.creationTime, unicode(self.reference))
+        else:
+            return "Job '%s' in phase '%s' - %s" % (self.id, ', '.join(self.phase), unicode(self.reference))
+
+
+class CompactParameter(CompactModel):
+    __slots__ = ('id', 'by_reference', 'is_post', 'value')
+
+    def __init__(self, id=None, by_reference=False, is_post=False, value=None, xml_node=None):
+        self.id = None
+        self.by_reference = False
+        self.is_post = False
+        self.value = None
+
+        if xml_node is not None:
+            self.id = _intern(xml_node.get('id'))
+            self.by_reference = self._parse_bool(xml_node.get('by_reference', default=False))
+            self.is_post = self._parse_bool(xml_node.get('is_post', default=False))
+            self.value = xml_node.text
+        elif id is not None and value is not None:
+            self.id = _intern(id)
+            self.by_reference = by_reference
+            self.is_post = is_post
+            self.value = value
+
+    def __unicode__(self):
+        return "Parameter id '%s' byRef: %s is_post: %s - value: %s" % (self.id, self.by_reference, self.is_post, self.value)
+
+
+class CompactResult(CompactModel):
+    __slots__ = ('id', 'reference')
+
+    def __init__(self, id=None, reference=None, xml_node=None, xml_namespace=None):
+        self.id = None
+        self.reference = CompactReference()
+
+        if xml_node is not None:
+            self.id = _intern(xml_node.get('id'))
+            self.reference = CompactReference(xml_node=xml_node, xml_namespace=xml_namespace)
+        elif id is not None and reference is not None:
+            self.id = _intern(id)
+
+            if isinstance(reference, (Reference, CompactReference)):
+                self.reference = reference
+            else:
+                raise RuntimeError("Malformated reference given in result id: %s" % id)
+
+    def __unicode__(self):
+        return "Result id '%s' reference: %s" % (self.id, unicode(self.reference))
+
+
+class CompactErrorSummary(CompactModel):
+    __slots__ = ('type', 'has_detail', 'messages')
+
+    def __init__(self, type="transient", has_detail=False, messages=None,
+                 xml_node=None, uws_flavour=None):
+        self.type = "transient"
+        self.has_detail = False
+        self.messages = []
+
+        if xml_node is not None:
+            self.type = _intern(xml_node.get('type'))
+            self.has_detail = self._parse_bool(xml_node.get('hasDetail', default=False))
+            self.messages = [message.text for message in uws_flavour.findall(xml_node, 'message')]
+
+        elif messages is not None:
+            self.type = _intern(type)
+            self.has_detail = has_detail
+            self.messages = messages
+
+    def __unicode__(self):
+        return "Error Summary - type '%s' hasDetail: %s - message: %s" % (self.type, self.has_detail, "\n".join(self.messages))
+
+
+class CompactJob(Job):
+    """Job holding its parameters, results and error summary as compact
+    models."""
+    def _parse_parameters(self, parsed, uws_flavour):
+        tmp = uws_flavour.find(parsed, 'parameters')
+        if tmp is None:
+            return []
+        return [CompactParameter(xml_node=param) for param in tmp]
+
+    def _parse_results(self, parsed, uws_flavour):
+        tmp = uws_flavour.find(parsed, 'results')
+        if tmp is None:
+            return []
+        nsmap = parsed.nsmap
+        return [CompactResult(xml_node=res, xml_namespace=nsmap) for res in tmp]
+
+    def _parse_error_summary(self, parsed, uws_flavour):
+        tmp = uws_flavour.find(parsed, 'errorSummary')
+        if tmp is None:
+            return False
+        return CompactErrorSummary(xml_node=tmp, uws_flavour=uws_flavour)
+
+    def add_parameter(self, id=None, by_reference=False, is_post=False, value=None, parameter=None):
+        if not parameter:
+            parameter = CompactParameter(id=id, by_reference=by_reference, is_post=is_post, value=value)
+
+        self.parameters.append(parameter)
+
+    def add_result(self, id=None, href=None, result=None):
+        if not result:
+            reference = CompactReference(href=href, type="simple")
+            result = CompactResult(id=id, reference=reference)
+
+        self.results.append(result)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import sys
+import unittest
+from StringIO import StringIO
+
+from uws import UWS
+from uws.UWS.tests.uws_server import UWSServer
+
+
+def captured_output(function, *args, **kwargs):
+    """Calls function and returns what it wrote to stdout."""
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        function(*args, **kwargs)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+class ServerTestCase(unittest.TestCase):
+    """Runs a stand-in UWS service with the jobs of the class during each
+    test, and a Client for it."""
+    jobs = {}
+
+    def setUp(self):
+        self.server = self.create_server()
+        self.server.start()
+
+        self.client = UWS.client.Client(self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def create_server(self):
+        return UWSServer(jobs=self.jobs)
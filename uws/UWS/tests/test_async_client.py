@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import tempfile
+import unittest
+
+from uws import UWS
+from uws.UWS.async_client import AsyncClient
+from uws.UWS.tests.uws_server import UWSServer
+
+
+class AsyncClientTest(unittest.TestCase):
+    def setUp(self):
+        self.server = UWSServer(jobs={'1': 'COMPLETED', '2': 'ERROR'}, result="x" * 5000)
+        self.server.start()
+
+        self.client = AsyncClient(self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def testGetJobList(self):
+        jobs = self.client.wait(self.client.get_job_list())
+
+        self.assertEqual([job.id for job in jobs.job_reference], ['1', '2'])
+        self.assertEqual(jobs.job_reference[1].phase, ['ERROR'])
+
+    def testGetManyJobs(self):
+        calls = [self.client.get_job(id) for id in ['1', '2', '1', '2']]
+        self.client.run()
+
+        self.assertEqual([call.result().job_id for call in calls], ['1', '2', '1', '2'])
+        self.assertEqual(calls[1].result().phase, ['ERROR'])
+
+    def testMaxConnections(self):
+        self.client.max_connections = 1
+
+        calls = [self.client.get_phase(id) for id in ['1', '2', '1']]
+        self.assertEqual(len(self.client._map), 1)
+
+        self.client.run()
+        self.assertEqual([call.result() for call in calls], ['COMPLETED', 'ERROR', 'COMPLETED'])
+
+    def testJobLifecycle(self):
+        job = self.client.wait(self.client.new_job({'query': 'SELECT 1'}))
+        self.assertEqual(job.job_id, '3')
+        self.assertEqual(job.phase, ['PENDING'])
+
+        job = self.client.wait(self.client.run_job('3'))
+        self.assertEqual(job.phase, ['QUEUED'])
+
+        job = self.client.wait(self.client.abort_job('3'))
+        self.assertEqual(job.phase, ['ABORTED'])
+
+        self.assertTrue(self.client.wait(self.client.delete_job('3')))
+        self.assertNotIn('3', self.server.jobs)
+
+    def testErrorIsReported(self):
+        call = self.client.get_job('missing')
+        self.client.run()
+
+        self.assertIsInstance(call.error, UWS.UWSError)
+        self.assertEqual(call.error.msg, 'Resource does not exist')
+        self.assertRaises(UWS.UWSError, call.result)
+
+    def testDownloadResult(self):
+        job = self.client.wait(self.client.get_job('1'))
+
+        fd, file_name = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.assertTrue(self.client.wait(self.client.download_result(job.results[0].reference, file_name)))
+            with open(file_name) as file_handler:
+                self.assertEqual(file_handler.read(), "x" * 5000)
+        finally:
+            os.remove(file_name)
+
+    def testKeepAlive(self):
+        events = []
+        self.client.connection.hooks.append(events.append)
+
+        for id in ['1', '2', '1']:
+            self.client.wait(self.client.get_phase(id))
+
+        # one connection for all requests, only the first one connects
+        self.assertEqual(len(self.client._map), 1)
+        self.assertEqual([event.reused for event in events], [False, True, True])
+        self.assertEqual([event.status for event in events], [200, 200, 200])
+        self.assertEqual(events[1].connect, 0.0)
+
+    def testIdleConnectionClosed(self):
+        self.assertEqual(self.client.wait(self.client.get_phase('1')), 'COMPLETED')
+
+        for request in list(self.server.sockets):
+            request.shutdown(socket.SHUT_RDWR)
+
+        # the request is sent again on a new connection
+        self.assertEqual(self.client.wait(self.client.get_phase('2')), 'ERROR')
+
+    def testNextAddress(self):
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        refused = unused.getsockname()
+        unused.close()
+
+        key = self.client.connection.pool_key
+        self.client._addresses[key] = [(socket.AF_INET, refused), (socket.AF_INET, self.server.server_address)]
+
+        self.assertEqual(self.client.wait(self.client.get_phase('1')), 'COMPLETED')
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from uws.UWS.tests.helpers import ServerTestCase, captured_output
+from uws.UWS.tests.uws_server import UWSServer
+
+
+class LazyImportTest(unittest.TestCase):
+    def _loaded(self, statement, modules):
+        # run in a new interpreter, this one has imported everything already
+        script = "import sys; %s; print [name for name in %r if name in sys.modules]" % (statement, modules)
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..')
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=root)
+        return eval(output)
+
+    def testPackage(self):
+        self.assertEqual(self._loaded("from uws import UWS; UWS.UWSError", ['lxml.etree', 'uws.UWS.client']), [])
+        self.assertEqual(self._loaded("from uws import UWS; UWS.client.Client", ['lxml.etree', 'uws.UWS.client']),
+                         ['lxml.etree', 'uws.UWS.client'])
+        # the thread pool is only needed by the batch methods
+        self.assertEqual(self._loaded("from uws import UWS; UWS.client.Client", ['multiprocessing.pool']), [])
+
+    def testCommandLine(self):
+        self.assertEqual(self._loaded("import uws.cli.main", ['lxml.etree', 'dateutil.parser', 'texttable']), [])
+        self.assertEqual(self._loaded("import uws.cli.main", ['cmd', 'csv', 'json', 'shlex', 'uws.cli.shell']), [])
+
+
+class ShellTest(ServerTestCase):
+    jobs = {'1': 'COMPLETED', '2': 'EXECUTING'}
+
+    def setUp(self):
+        super(ShellTest, self).setUp()
+        fd, self.script = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        super(ShellTest, self).tearDown()
+        os.remove(self.script)
+
+    def _run(self, lines):
+        from uws.cli import main
+
+        with open(self.script, 'w') as script:
+            script.write('\n'.join(lines) + '\n')
+
+        return captured_output(main.run_shell, self.server.url, None, None, self.script)
+
+    def testScript(self):
+        output = self._run(['# comment', 'list', 'job phase 2', 'job abort 2', 'list', 'job phase 3', 'list'])
+
+        self.assertIn('EXECUTING\n', output)
+        self.assertIn('Resource does not exist', output)
+        self.assertEqual(output.count('2 jobs listed.'), 3)
+        self.assertEqual(self.server.jobs['2'], 'ABORTED')
+        # the unchanged job list was not sent again
+        self.assertEqual(self.server.not_modified, 1)
+
+    def testErrorsDoNotStop(self):
+        output = self._run(['job bogus', 'unknown', 'list --bad', 'job show 1'])
+
+        self.assertIn("Unknown command 'unknown'", output)
+        self.assertIn('COMPLETED', output)
+
+
+class BatchNewTest(ServerTestCase):
+    def setUp(self):
+        super(BatchNewTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(BatchNewTest, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def testMalformattedFile(self):
+        from uws.cli import main
+
+        self.server.latency = 0.2
+        file_name = os.path.join(self.directory, 'jobs.jsonl')
+        manifest_name = os.path.join(self.directory, 'manifest.jsonl')
+        with open(file_name, 'w') as f:
+            f.write('{"query": "SELECT 1"}\n{"query": "SELECT 2"}\n{"query": \n')
+
+        output = captured_output(main.batch_new_job, self.server.url, None, None, file_name, max_in_flight=4,
+                                 manifest_name=manifest_name)
+
+        self.assertIn('Malformatted JSON in line 3', output)
+        # the jobs submitted before the error are in the manifest
+        with open(manifest_name) as manifest:
+            entries = [json.loads(line) for line in manifest]
+        self.assertEqual(sorted(entry['record'] for entry in entries), [1, 2])
+        self.assertEqual(sorted(entry['job_id'] for entry in entries), sorted(self.server.jobs))
+
+
+class OutputFormatTest(ServerTestCase):
+    jobs = {'1': 'COMPLETED', '2': 'ERROR', '3': 'EXECUTING'}
+
+    def create_server(self):
+        return UWSServer(jobs=self.jobs, created={'1': '2016-01-01T10:00:00'})
+
+    def _output(self, function, *args):
+        return captured_output(function, self.server.url, None, None, *args)
+
+    def testListJsonLines(self):
+        from uws.cli import main
+
+        lines = self._output(main.list_jobs, ['ERROR', 'COMPLETED'], None, None, 'jsonl').splitlines()
+
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'id': '1', 'runId': None, 'ownerId': None, 'creationTime': '2016-01-01T10:00:00',
+             'phase': 'COMPLETED', 'href': self.server.url + '/1'},
+            {'id': '2', 'runId': None, 'ownerId': None, 'creationTime': None,
+             'phase': 'ERROR', 'href': self.server.url + '/2'},
+        ])
+        self.assertTrue(lines[0].startswith('{"id": "1", "runId": null'))
+
+    def testListCsv(self):
+        from uws.cli import main
+
+        rows = list(csv.reader(StringIO(self._output(main.list_jobs, [], None, None, 'csv'))))
+        self.assertEqual(rows[0], main.job_reference_fields)
+        self.assertEqual([row[0] for row in rows[1:]], ['1', '2', '3'])
+        self.assertEqual(rows[3][4], 'EXECUTING')
+
+        rows = list(csv.reader(StringIO(self._output(main.list_jobs, [], None, None, 'tsv')), dialect='excel-tab'))
+        self.assertEqual(rows[1][:5], ['1', '', '', '2016-01-01T10:00:00', 'COMPLETED'])
+
+    def testJob(self):
+        from uws.cli import main
+
+        job = json.loads(self._output(main.show_job, '2', None, None, 'jsonl'))
+        self.assertEqual(job['jobId'], '2')
+        self.assertEqual(job['phase'], 'ERROR')
+        self.assertEqual(job['parameters'], {'query': 'SELECT 1'})
+        self.assertEqual(job['results'], {'csv': self.server.url + '/2/results/csv'})
+
+        rows = list(csv.reader(StringIO(self._output(main.show_job, '2', None, None, 'csv'))))
+        self.assertEqual(rows[0], ['Field', 'Value'])
+        self.assertIn(['Parameter query', 'SELECT 1'], rows)
+
+
+class ResultsTest(ServerTestCase):
+    jobs = {'1': 'COMPLETED'}
+
+    def setUp(self):
+        super(ResultsTest, self).setUp()
+        self.server.result = 'x' * 2048
+        self.server.result_ids = ['csv', 'xml', 'bad']
+        self.server.results = {'xml': 'y' * 1024}
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(ResultsTest, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def testParallelDownloads(self):
+        from uws.cli import main
+
+        file_base = os.path.join(self.directory, 'job')
+        output = captured_output(main.results_job, self.server.url, None, None, '1', None, file_base, parallel=3)
+
+        # the missing result is reported, the others are complete
+        self.assertIn("Finished downloading file '%s.csv'" % file_base, output)
+        self.assertIn("Finished downloading file '%s.xml'" % file_base, output)
+        self.assertIn("Failed downloading file '%s.bad': Resource does not exist" % file_base, output)
+        with open(file_base + '.csv') as result:
+            self.assertEqual(result.read(), 'x' * 2048)
+        with open(file_base + '.xml') as result:
+            self.assertEqual(result.read(), 'y' * 1024)
+
+        self.assertEqual(len([path for path in self.server.requests if '/results/' in path]), 3)
+        self.assertIn("\rcsv: 2.0 kB (", output)
+
+    def testCompressedProgress(self):
+        from uws.cli import main
+
+        self.server.compress = True
+        file_base = os.path.join(self.directory, 'job')
+        output = captured_output(main.results_job, self.server.url, None, None, '1', 'csv', file_base)
+
+        # the size written to disk, not the few compressed bytes
+        self.assertIn("\rcsv: 2.0 kB (", output)
+
+    def testProgress(self):
+        from uws.cli import main
+
+        progress = main.DownloadProgress(['a', 'b', 'c'])
+        progress.console_width = 200
+        progress.started = 100.0
+        progress.progress = {
+            'a': [100.0, 0, 2048, 102.0],
+            # resumed from 1 kB, only the bytes transferred now count
+            'b': [101.0, 1024, 3072, 102.0],
+        }
+
+        line = captured_output(progress.draw).strip()
+
+        self.assertEqual(line, "a: 2.0 kB (1.0 kB/s) | b: 3.0 kB (2.0 kB/s) | total: 2.0 kB/s")
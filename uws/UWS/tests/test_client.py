@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from uws import UWS
+from uws.UWS.tests.helpers import ServerTestCase
+from uws.UWS.tests.uws_server import UWSServer
+
+
+class FakeJobClient(UWS.client.Client):
+    def get_job(self, id, wait=None, phase=None):
+        # let later ids finish first
+        time.sleep(0.01 * (5 - int(id)))
+
+        if id == '3':
+            raise UWS.UWSError("Resource does not exist")
+        return "job %s" % id
+
+
+class GetJobsTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeJobClient("http://www.example.com/uws")
+        self.ids = ['1', '2', '3', '4']
+
+    def testOrdered(self):
+        results = list(self.client.get_jobs(self.ids, max_workers=4, ordered=True))
+
+        self.assertEqual([id for id, job in results], self.ids)
+        self.assertEqual(results[0], ('1', 'job 1'))
+        self.assertIsInstance(results[2][1], UWS.UWSError)
+        self.assertEqual(results[2][1].msg, "Resource does not exist")
+
+    def testUnordered(self):
+        results = list(self.client.get_jobs(self.ids, max_workers=4))
+
+        self.assertEqual(sorted(id for id, job in results), self.ids)
+        self.assertEqual(results[0], ('4', 'job 4'))
+
+
+class BatchTest(ServerTestCase):
+    jobs = {'1': 'PENDING', '2': 'PENDING', '3': 'EXECUTING'}
+
+    def testRunJobs(self):
+        results = self.client.run_jobs(['1', '2', '9'], concurrency=2)
+
+        self.assertEqual(results['1'].phase, ['QUEUED'])
+        self.assertEqual(results['2'].phase, ['QUEUED'])
+        self.assertIsInstance(results['9'], UWS.UWSError)
+        self.assertEqual(self.server.jobs, {'1': 'QUEUED', '2': 'QUEUED', '3': 'EXECUTING'})
+
+    def testAbortAndDeleteJobs(self):
+        results = self.client.abort_jobs(['3'])
+        self.assertEqual(results['3'].phase, ['ABORTED'])
+
+        self.assertEqual(self.client.delete_jobs(['1', '3']), {'1': True, '3': True})
+        self.assertEqual(self.server.jobs, {'2': 'PENDING'})
+
+        # the ids of deleted jobs are not given to new ones
+        self.assertEqual(self.client.new_job({'query': 'SELECT 1'}).job_id, '4')
+        self.assertEqual(self.server.jobs, {'2': 'PENDING', '4': 'PENDING'})
+
+
+class NewJobsTest(ServerTestCase):
+
+    def testNewJobs(self):
+        self.server.busy = 2
+        parameter_sets = ({'query': 'SELECT %d' % i} for i in range(5))
+
+        results = list(self.client.new_jobs(parameter_sets, max_in_flight=2, run=True))
+
+        self.assertEqual(sorted(index for index, job in results), range(5))
+        self.assertEqual(sorted(job.job_id for index, job in results), ['1', '2', '3', '4', '5'])
+        self.assertEqual(set(self.server.jobs.values()), set(['QUEUED']))
+        self.assertEqual(self.server.busy, 0)
+
+    def testServiceUnavailable(self):
+        self.server.busy = 10
+
+        results = list(self.client.new_jobs([{'query': 'SELECT 1'}], max_retries=2))
+
+        self.assertIsInstance(results[0][1], UWS.UWSError)
+        self.assertEqual(self.server.busy, 7)
+        self.assertEqual(self.server.jobs, {})
+
+    def testFailingParameterSets(self):
+        self.server.latency = 0.2
+
+        def parameter_sets():
+            for i in range(3):
+                yield {'query': 'SELECT %d' % i}
+            raise ValueError('malformatted')
+
+        results = []
+        with self.assertRaises(ValueError):
+            for result in self.client.new_jobs(parameter_sets(), max_in_flight=4):
+                results.append(result)
+
+        # the jobs submitted before the error are not lost
+        self.assertEqual(sorted(index for index, job in results), [0, 1, 2])
+        self.assertEqual(len(self.server.jobs), 3)
+
+    def testInterrupted(self):
+        self.server.latency = 0.2
+        jobs = self.client.new_jobs(({'query': 'SELECT %d' % i} for i in range(10)), max_in_flight=4)
+
+        results = [next(jobs)]
+        with self.assertRaises(KeyboardInterrupt):
+            results.append(jobs.throw(KeyboardInterrupt))
+            for result in jobs:
+                results.append(result)
+
+        # the first job and the three in flight, no new ones
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(self.server.jobs), 4)
+
+
+class CacheTest(ServerTestCase):
+    jobs = {'1': 'EXECUTING', '2': 'COMPLETED'}
+
+    def setUp(self):
+        super(CacheTest, self).setUp()
+        self.client = UWS.client.Client(self.server.url, cache=UWS.connection.ResponseCache())
+
+    def testNotModified(self):
+        job = self.client.get_job('1')
+        self.assertIs(self.client.get_job('1'), job)
+        self.assertEqual(self.server.not_modified, 1)
+
+        job_list = self.client.get_job_list()
+        self.assertIs(self.client.get_job_list(), job_list)
+        self.assertIsNot(self.client.get_job_list(compact=True), job_list)
+        self.assertEqual(self.server.not_modified, 2)
+
+    def testModified(self):
+        job = self.client.get_job('1')
+        self.server.jobs['1'] = 'COMPLETED'
+
+        changed = self.client.get_job('1')
+        self.assertIsNot(changed, job)
+        self.assertEqual(changed.phase, ['COMPLETED'])
+        self.assertEqual(self.server.not_modified, 0)
+
+    def testEviction(self):
+        self.client.connection.cache.max_size = 1
+
+        job = self.client.get_job('1')
+        self.client.get_job('2')
+        self.assertIsNot(self.client.get_job('1'), job)
+        self.assertEqual(self.server.not_modified, 0)
+
+
+class WaitForTest(ServerTestCase):
+    jobs = {'1': 'EXECUTING', '2': 'QUEUED', '3': 'ERROR'}
+
+    def _finish_later(self, id, phase, delay=0.3):
+        timer = threading.Timer(delay, self.server.jobs.__setitem__, (id, phase))
+        timer.start()
+
+    def testPolling(self):
+        self._finish_later('1', 'COMPLETED')
+
+        phases = self.client.wait_for(['1', '3'], poll_interval=0.05)
+
+        self.assertEqual(phases, {'1': 'COMPLETED', '3': 'ERROR'})
+        self.assertIn('/uws/1/phase', self.server.requests)
+
+    def testWait(self):
+        self.server.version = "1.1"
+        self._finish_later('1', 'COMPLETED')
+
+        phases = self.client.wait_for(['1'], poll_interval=10)
+
+        self.assertEqual(phases, {'1': 'COMPLETED'})
+        self.assertEqual(self.server.requests, ['/uws/1', '/uws/1?WAIT=60&PHASE=EXECUTING'])
+
+    def testTimeout(self):
+        phases = self.client.wait_for(['2'], timeout=1.5, poll_interval=0.05)
+
+        self.assertEqual(phases, {'2': 'QUEUED'})
+
+    def testTargetPhases(self):
+        phases = self.client.wait_for(['2'], target_phases=['QUEUED', 'EXECUTING'])
+
+        self.assertEqual(phases, {'2': 'QUEUED'})
+
+    def testMissingJob(self):
+        phases = self.client.wait_for(['missing'])
+
+        self.assertIsInstance(phases['missing'], UWS.UWSError)
+
+    def testRunAndWait(self):
+        self.server.version = "1.1"
+        self.server.run_time = 0.3
+
+        job = self.client.run_job('2')
+        self.assertEqual(job.phase, ['EXECUTING'])
+
+        phases = self.client.wait_for(['2'], poll_interval=10)
+        self.assertEqual(phases, {'2': 'COMPLETED'})
+
+
+class GeneratedServerTest(ServerTestCase):
+    def create_server(self):
+        return UWSServer.generated(250, version="1.1", latency=0.01)
+
+    def testJobList(self):
+        jobs = self.client.get_job_list(compact=True).job_reference
+
+        self.assertEqual(len(jobs), 250)
+        self.assertEqual(set(job.phase[0] for job in jobs),
+                         set(['COMPLETED', 'ERROR', 'ABORTED', 'EXECUTING', 'PENDING']))
+
+        jobs = self.client.get_job_list({'after': '2016-01-01T00:04:00'}).job_reference
+        self.assertEqual(len(jobs), 9)
+
+    def testLatency(self):
+        started = time.time()
+        self.client.get_job('1')
+        self.assertGreaterEqual(time.time() - started, 0.01)
@@ -1,7 +1,50 @@
 # -*- coding: utf-8 -*-
+import glob
+import gzip
+import os
+import shutil
+import tempfile
 import unittest
+import threading
+import time
+import BaseHTTPServer
 
 from uws import UWS
+from uws.UWS.tests.uws_server import UWSServer
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = "%s %s" % (self.path, self.server.connections)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class KeepAliveServer(BaseHTTPServer.HTTPServer):
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), KeepAliveHandler)
+        self.connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        thread = threading.Thread(target=self.finish_request_and_close, args=(request, client_address))
+        thread.daemon = True
+        thread.start()
+
+    def finish_request_and_close(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            pass
+        finally:
+            self.shutdown_request(request)
 
 
 class ConnectionTest(unittest.TestCase):
@@ -27,7 +70,11 @@ class ConnectionTest(unittest.TestCase):
         self.assertEqual(connection.url, "http://www.example.com/uws")
         self.assertEqual(connection.clean_url, "www.example.com")
         self.assertEqual(connection.base_path, "/uws")
-        self.assertIsInstance(connection.connection, httplib.HTTPConnection)
+        self.assertEqual(connection.pool_key, ("http", "www.example.com", 80))
+
+        http_connection, reused = connection.pool.acquire(connection.pool_key)
+        self.assertIsInstance(http_connection, httplib.HTTPConnection)
+        self.assertFalse(reused)
 
     def testSetURLHTTPS(self):
         import httplib
@@ -41,4 +88,560 @@ class ConnectionTest(unittest.TestCase):
         self.assertEqual(connection.url, "https://www.example.com/uws")
         self.assertEqual(connection.clean_url, "www.example.com")
         self.assertEqual(connection.base_path, "/uws")
-        self.assertIsInstance(connection.connection, httplib.HTTPSConnection)
+        self.assertEqual(connection.pool_key, ("https", "www.example.com", 443))
+
+        http_connection, reused = connection.pool.acquire(connection.pool_key)
+        self.assertIsInstance(http_connection, httplib.HTTPSConnection)
+
+    def testSetURLWrongProtocol(self):
+        self.assertRaises(
+            RuntimeError,
+            UWS.connection.Connection,
+            "ftp://www.example.com/uws/"
+        )
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.server = KeepAliveServer()
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+        self.url = "http://127.0.0.1:%d/uws" % self.server.server_address[1]
+        self.pool = UWS.connection.ConnectionPool(max_size=2, idle_timeout=60)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testConnectionIsReused(self):
+        for i in range(5):
+            connection = UWS.connection.Connection(self.url, pool=self.pool)
+            self.assertEqual(connection.get("job%d" % i).read(), "/uws/job%d 1" % i)
+
+        self.assertEqual(self.server.connections, 1)
+
+    def testUnreadResponseIsDiscarded(self):
+        connection = UWS.connection.Connection(self.url, pool=self.pool)
+        connection.get("job").close()
+        self.assertEqual(connection.get("job").read(), "/uws/job 2")
+
+    def testIdleTimeout(self):
+        self.pool.idle_timeout = -1
+
+        connection = UWS.connection.Connection(self.url, pool=self.pool)
+        connection.get("job").read()
+        self.assertEqual(connection.get("job").read(), "/uws/job 2")
+
+    def testMaxSize(self):
+        connection = UWS.connection.Connection(self.url, pool=self.pool)
+        responses = [connection.get("job") for i in range(3)]
+        for response in responses:
+            response.read()
+
+        self.assertEqual(len(self.pool._idle[connection.pool_key]), 2)
+
+    def testReconnectStaleConnection(self):
+        connection = UWS.connection.Connection(self.url, pool=self.pool)
+        connection.get("job").read()
+
+        # simulate the server dropping the idle socket
+        last_used, http_connection = self.pool._idle[connection.pool_key][0]
+        http_connection.sock.close()
+
+        self.assertEqual(connection.get("job").read(), "/uws/job 2")
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.result = ''.join(chr(i % 256) for i in range(10000))
+        self.server = UWSServer(jobs={'1': 'COMPLETED'}, result=self.result, ranges=True)
+        self.server.start()
+
+        self.url = self.server.url + '/1/results/csv'
+        self.connection = UWS.connection.Connection(self.server.url)
+
+        fd, self.file_name = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        self.server.stop()
+        for file_name in glob.glob(self.file_name + '*'):
+            os.remove(file_name)
+
+    def _read(self):
+        with open(self.file_name, 'rb') as file_handler:
+            return file_handler.read()
+
+    def testDownload(self):
+        progress = []
+        self.connection.download_file(self.url, None, None, self.file_name, chunk_size_kb=1,
+                                      callback=lambda total, current: progress.append((total, current)))
+
+        self.assertEqual(self._read(), self.result)
+        self.assertEqual(progress[-1], (10000, 10000))
+
+    def testDownloadChunked(self):
+        self.server.ranges = False
+        self.connection.download_file(self.url, None, None, self.file_name, segments=4)
+
+        self.assertEqual(self._read(), self.result)
+
+    def testSegments(self):
+        progress = []
+        self.connection.download_file(self.url, None, None, self.file_name, chunk_size_kb=1, segments=4,
+                                      callback=lambda total, current: progress.append(current))
+
+        self.assertEqual(self._read(), self.result)
+        self.assertEqual(progress[-1], 10000)
+        self.assertEqual(len([path for path in self.server.requests if path == '/uws/1/results/csv']), 4)
+        self.assertEqual(glob.glob(self.file_name + '.part*'), [])
+
+    def testResume(self):
+        with open(self.file_name, 'wb') as file_handler:
+            file_handler.write(self.result[:3000])
+
+        self.connection.download_file(self.url, None, None, self.file_name, resume=True)
+
+        self.assertEqual(self._read(), self.result)
+
+    def testResumeSegments(self):
+        with open(self.file_name, 'wb') as file_handler:
+            file_handler.write(self.result[:2000])
+        # the first of two segments was partially downloaded before
+        with open(self.file_name + '.part-2000-5999', 'wb') as file_handler:
+            file_handler.write(self.result[2000:2500])
+
+        self.connection.download_file(self.url, None, None, self.file_name, chunk_size_kb=1,
+                                      segments=2, resume=True)
+
+        self.assertEqual(self._read(), self.result)
+
+    def testStaleSegment(self):
+        # a complete looking part of an earlier download is not reused
+        # without resume
+        with open(self.file_name + '.part-0-2499', 'wb') as file_handler:
+            file_handler.write('Z' * 2500)
+
+        self.connection.download_file(self.url, None, None, self.file_name, chunk_size_kb=1, segments=4)
+
+        self.assertEqual(self._read(), self.result)
+        self.assertEqual(len([path for path in self.server.requests if path == '/uws/1/results/csv']), 4)
+
+    def testResumeComplete(self):
+        with open(self.file_name, 'wb') as file_handler:
+            file_handler.write(self.result)
+
+        self.connection.download_file(self.url, None, None, self.file_name, resume=True)
+
+        self.assertEqual(self._read(), self.result)
+        self.assertNotIn('/uws/1/results/csv', self.server.requests)
+
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.result = "id,value\n" + "".join("%d,%d\n" % (i, i * i) for i in range(5000))
+        self.server = UWSServer(jobs={'1': 'COMPLETED', '2': 'ERROR'}, result=self.result)
+        self.server.compress = True
+        self.server.start()
+
+        self.client = UWS.client.Client(self.server.url)
+
+        fd, self.file_name = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        self.server.stop()
+        for file_name in glob.glob(self.file_name + '*'):
+            os.remove(file_name)
+
+    def testDeflateXml(self):
+        self.assertEqual(self.client.get_job('2').phase, ['ERROR'])
+        self.assertEqual([job.id for job in self.client.get_job_list(stream=True)], ['1', '2'])
+
+    def testGzipDownload(self):
+        progress = []
+        file_name = self.client.connection.download_file(self.server.url + '/1/results/csv', None, None,
+                                                         self.file_name, chunk_size_kb=1,
+                                                         callback=lambda total, current: progress.append((total, current)))
+
+        self.assertEqual(file_name, self.file_name)
+        with open(file_name, 'rb') as file_handler:
+            self.assertEqual(file_handler.read(), self.result)
+        # the progress counts the decompressed bytes
+        self.assertEqual(progress[-1], (None, len(self.result)))
+
+    def testKeepCompressed(self):
+        file_name = self.client.connection.download_file(self.server.url + '/1/results/csv', None, None,
+                                                         self.file_name, keep_compressed=True)
+
+        self.assertEqual(file_name, self.file_name + '.gz')
+        with gzip.open(file_name, 'rb') as file_handler:
+            self.assertEqual(file_handler.read(), self.result)
+        self.assertLess(os.path.getsize(file_name), len(self.result))
+
+
+class RedirectTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = UWSServer(jobs={'1': 'COMPLETED', '2': 'ERROR'})
+        self.backend.start()
+
+        self.front = UWSServer()
+        self.front.start()
+
+        self.redirects = UWS.connection.RedirectMap()
+        connection = UWS.connection.Connection(self.front.url, redirects=self.redirects)
+        self.client = UWS.client.Client(connection=connection)
+
+    def tearDown(self):
+        self.front.stop()
+        self.backend.stop()
+
+    def _move(self, status):
+        self.front.moved_to = (status, self.backend.url[:-len('/uws')])
+
+    def testPermanent(self):
+        self._move(301)
+
+        self.assertEqual(self.client.get_job('1').phase, ['COMPLETED'])
+        self.assertEqual(self.client.get_job('2').phase, ['ERROR'])
+        self.assertEqual(self.client.get_phase('1'), 'COMPLETED')
+
+        # only the first request went through the redirecting server
+        self.assertEqual(self.front.requests, ['/uws/1'])
+        self.assertEqual(self.backend.requests, ['/uws/1', '/uws/2', '/uws/1/phase'])
+        self.assertEqual(self.client.connection.url, self.front.url)
+
+    def testTemporary(self):
+        self._move(302)
+
+        for i in range(3):
+            self.client.get_job('1')
+
+        # remembered once the same target was given twice
+        self.assertEqual(self.front.requests, ['/uws/1', '/uws/1'])
+        self.assertEqual(len(self.backend.requests), 3)
+
+    def testPost(self):
+        self._move(307)
+
+        job = self.client.new_job({'query': 'SELECT 1'})
+
+        self.assertEqual(job.job_id, '3')
+        self.assertEqual(self.front.requests, ['POST /uws'])
+        self.assertEqual(self.backend.requests, ['POST /uws', '/uws/3'])
+        self.assertEqual(self.backend.uploads[0][1].count('SELECT 1'), 1)
+
+    def testStaleTarget(self):
+        self._move(301)
+        self.client.get_job('1')
+
+        # the target is not redirected to anymore
+        self.front.moved_to = None
+        self.front.jobs['5'] = 'QUEUED'
+        del self.backend.requests[:]
+
+        self.assertEqual(self.client.get_job('5').phase, ['QUEUED'])
+        self.assertEqual(self.backend.requests, ['/uws/5'])
+        self.assertEqual(self.front.requests, ['/uws/1', '/uws/5'])
+
+
+class RedirectMapTest(unittest.TestCase):
+    key = ('http', 'front', 80)
+
+    def setUp(self):
+        self.redirects = UWS.connection.RedirectMap()
+
+    def testPrefix(self):
+        self.redirects.learn(self.key, '/uws/1', 301, 'http://node/jobs/1')
+
+        self.assertEqual(self.redirects.resolve(self.key, '/uws/1'), 'http://node/jobs/1')
+        self.assertEqual(self.redirects.resolve(self.key, '/uws/2/phase'), 'http://node/jobs/2/phase')
+        self.assertEqual(self.redirects.resolve(self.key, '/other'), None)
+
+    def testTrailingSlash(self):
+        self.redirects.learn(self.key, '/uws', 301, 'http://front/uws/')
+
+        self.assertEqual(self.redirects.resolve(self.key, '/uws'), 'http://front/uws/')
+        self.assertEqual(self.redirects.resolve(self.key, '/uws/123'), None)
+
+    def testExactPath(self):
+        self.redirects.learn(self.key, '/uws/5', 301, 'http://front/archive/old-job-5')
+
+        self.assertEqual(self.redirects.resolve(self.key, '/uws/5'), 'http://front/archive/old-job-5')
+        self.assertEqual(self.redirects.resolve(self.key, '/uws/5/phase'), None)
+
+        self.redirects.forget(self.key, '/uws/5')
+        self.assertEqual(self.redirects.resolve(self.key, '/uws/5'), None)
+
+    def testNoDoubleSlash(self):
+        self.redirects.learn(self.key, '/uws/1', 301, 'http://node/jobs//1')
+
+        self.assertEqual(self.redirects.resolve(self.key, '/uws/2'), 'http://node/jobs/2')
+
+
+class UploadTest(unittest.TestCase):
+    def setUp(self):
+        self.server = UWSServer()
+        self.server.start()
+
+        self.connection = UWS.connection.Connection(self.server.url)
+        self.directory = tempfile.mkdtemp()
+        self.table = ''.join(chr(i % 256) for i in range(200000))
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def _expected_body(self, file_name):
+        return ('----------UWS_Client_Separator\r\n'
+                'Content-Disposition: form-data; name="table"; filename="%s"\r\n'
+                'Content-Type: application/octet-stream\r\n'
+                '\r\n'
+                '%s\r\n'
+                '----------UWS_Client_Separator--\r\n') % (file_name, self.table)
+
+    def testMultipartStream(self):
+        body = UWS.connection.MultipartStream({'query': 'SELECT 1'}, chunk_size=10)
+
+        data = ''.join(iter(lambda: body.read(7), ''))
+        self.assertEqual(body.size, len(data))
+        self.assertEqual(data, '----------UWS_Client_Separator\r\n'
+                               'Content-Disposition: form-data; name="query"\r\n'
+                               '\r\n'
+                               'SELECT 1\r\n'
+                               '----------UWS_Client_Separator--\r\n')
+
+        body.seek(0)
+        self.assertEqual(body.read(10), '----------')
+
+    def testUploadUnicode(self):
+        self.connection.post('', {u'query': u'SELECT 1', u'title': u'M\xe4rz \u2013 Test'})
+
+        headers, body = self.server.uploads[0]
+        self.assertIn('name="query"\r\n\r\nSELECT 1\r\n', body)
+        self.assertIn('name="title"\r\n\r\nM\xc3\xa4rz \xe2\x80\x93 Test\r\n', body)
+        # the length counts bytes, not characters
+        self.assertEqual(headers['content-length'], str(len(body)))
+
+    def testUploadFile(self):
+        file_name = os.path.join(self.directory, 'table')
+        with open(file_name, 'wb') as file_handler:
+            file_handler.write(self.table)
+
+        self.connection.post('', {'table': '@' + file_name})
+
+        headers, body = self.server.uploads[0]
+        self.assertEqual(body, self._expected_body(file_name))
+        self.assertEqual(headers['content-length'], str(len(body)))
+
+    def testUploadPipe(self):
+        file_name = os.path.join(self.directory, 'pipe')
+        os.mkfifo(file_name)
+
+        def write():
+            with open(file_name, 'wb') as file_handler:
+                file_handler.write(self.table)
+        writer = threading.Thread(target=write)
+        writer.start()
+
+        self.connection.post('', {'table': '@' + file_name})
+        writer.join()
+
+        headers, body = self.server.uploads[0]
+        self.assertEqual(body, self._expected_body(file_name))
+        self.assertEqual(headers['transfer-encoding'], 'chunked')
+        self.assertNotIn('content-length', headers)
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.server = UWSServer(jobs={'1': 'COMPLETED'})
+        self.server.start()
+
+        self.retry = UWS.connection.RetryPolicy(backoff=0.01, failure_threshold=3, reset_timeout=60)
+        self.client = UWS.client.Client(self.server.url, retry=self.retry)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testRetryGet(self):
+        self.server.failing = 2
+
+        self.assertEqual(self.client.get_job('1').phase, ['COMPLETED'])
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.retry.counters, {'requests': 3, 'retries': 2, 'failures': 2, 'trips': 0, 'rejected': 0})
+
+    def testNoRetryPost(self):
+        self.server.busy = 1
+
+        self.assertRaises(UWS.UWSError, self.client.new_job, {'query': 'SELECT 1'})
+        self.assertEqual(self.retry.counters['retries'], 0)
+        self.assertEqual(self.server.jobs, {'1': 'COMPLETED'})
+
+    def testCircuitBreaker(self):
+        self.server.failing = 10
+        self.retry.max_retries = 1
+
+        self.assertRaises(UWS.UWSError, self.client.get_job, '1')
+        self.assertRaises(UWS.UWSError, self.client.get_job, '1')
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.retry.counters['trips'], 1)
+
+        # neither the retry of the third failure nor later requests reach
+        # the server while the circuit is open
+        self.assertRaises(UWS.UWSError, self.client.get_phase, '1')
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.retry.counters['rejected'], 2)
+
+    def testOverloaded(self):
+        # 503 with Retry-After counts, Retry-After only sets the delays
+        self.server.failing = 10
+        self.server.overloaded = 1
+        self.retry.max_retries = 2
+        self.retry.max_backoff = 0.2
+
+        self.assertRaises(UWS.UWSError, self.client.get_job, '1')
+        self.assertEqual(self.retry.counters['trips'], 1)
+
+        try:
+            self.retry.check(self.client.connection.pool_key)
+            self.fail("circuit is not open")
+        except UWS.connection.CircuitOpen as e:
+            self.assertTrue(0 < e.retry_after <= 0.2)
+        self.assertEqual(len(self.server.requests), 3)
+
+        # the pause is that of Retry-After, not reset_timeout
+        time.sleep(0.25)
+        self.server.failing = 0
+        self.assertEqual(self.client.get_phase('1'), 'COMPLETED')
+
+    def testBusyPostsDoNotTrip(self):
+        # POSTs are not repeated by the policy, so their 503s do not open
+        # the circuit
+        self.server.busy = 6
+
+        results = list(self.client.new_jobs({'query': 'SELECT %d' % i} for i in range(8)))
+
+        self.assertEqual([job for index, job in results if isinstance(job, UWS.UWSError)], [])
+        self.assertEqual(len(self.server.jobs), 9)
+        self.assertEqual(self.retry.counters['trips'], 0)
+
+    def testPostWaitsForOpenCircuit(self):
+        self.server.failing = 3
+        self.retry.max_retries = 1
+        self.retry.reset_timeout = 0.2
+        self.assertRaises(UWS.UWSError, self.client.get_job, '1')
+        self.assertRaises(UWS.UWSError, self.client.get_job, '1')
+        self.assertEqual(self.retry.counters['trips'], 1)
+        rejected = self.retry.counters['rejected']
+
+        job = self.client._submit({'query': 'SELECT 1'}, False, 2)
+
+        self.assertEqual(job.job_id, '2')
+        self.assertEqual(self.retry.counters['rejected'], rejected + 1)
+
+    def testRetryAfterIsCapped(self):
+        self.assertEqual(self.retry.delay(0, 3600), self.retry.max_backoff)
+        self.assertEqual(self.retry.delay(0, 2), 2)
+
+
+class HooksTest(unittest.TestCase):
+    def setUp(self):
+        self.server = UWSServer(jobs={'1': 'COMPLETED'})
+        self.server.start()
+        self.events = []
+        self.client = UWS.client.Client(self.server.url, pool=UWS.connection.ConnectionPool(),
+                                        hooks=[self.events.append])
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testEvents(self):
+        self.client.get_job('1')
+        self.client.get_job('1')
+
+        request, parse, reused, parse_reused = self.events
+        self.assertEqual((request.type, request.method, request.path, request.status), ('request', 'GET', '/uws/1', 200))
+        self.assertFalse(request.reused)
+        self.assertTrue(reused.reused)
+        self.assertEqual(reused.connect, 0)
+        self.assertTrue(request.bytes_received > 0)
+        self.assertTrue(request.total >= request.first_byte + request.transfer)
+
+        self.assertEqual((parse.type, parse.model, parse.request), ('parse', 'Job', request))
+        self.assertEqual(parse.size, request.bytes_received)
+
+    def testFailedRequest(self):
+        self.server.stop()
+
+        self.assertRaises(UWS.UWSError, self.client.get_job, '1')
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(self.events[0].status, None)
+        self.assertTrue(self.events[0].error)
+
+    def testStats(self):
+        stats = UWS.connection.RequestStats()
+        self.client.connection.hooks.append(stats)
+        self.client.connection.retry = UWS.connection.RetryPolicy(backoff=0)
+        self.server.failing = 1
+
+        self.client.get_job('1')
+        self.client.get_phase('1')
+
+        self.assertEqual(stats.counters['requests'], 3)
+        self.assertEqual(stats.counters['retries'], 1)
+        self.assertEqual(stats.counters['connections'], 1)
+        self.assertEqual(stats.statuses, {200: 2, 502: 1})
+        self.assertEqual(stats.histograms['parse'].count, 1)
+        self.assertIn("3 requests", stats.summary())
+
+    def testCompressed(self):
+        stats = UWS.connection.RequestStats()
+        self.client.connection.hooks.append(stats)
+        self.server.compress = True
+
+        self.client.get_job('1')
+
+        request, parse = self.events
+        self.assertEqual(parse.bytes_received, request.bytes_received)
+        self.assertTrue(parse.size > request.bytes_received)
+        self.assertEqual(stats.counters['bytes_received'], request.bytes_received)
+        self.assertEqual(stats.counters['bytes_parsed'], parse.size)
+
+    def testPassedConnection(self):
+        events = []
+        connection = UWS.connection.Connection(self.server.url)
+        client = UWS.client.Client(connection=connection, hooks=[events.append])
+
+        client.get_job('1')
+
+        self.assertEqual([event.type for event in events], ['request', 'parse'])
+
+    def testDefaultHooks(self):
+        events = []
+        UWS.connection.default_hooks.append(events.append)
+        try:
+            connection = UWS.connection.Connection(self.server.url)
+        finally:
+            UWS.connection.default_hooks.remove(events.append)
+
+        # each connection has its own list of hooks
+        connection.hooks.append(self.events.append)
+        self.assertEqual(UWS.connection.default_hooks, [])
+
+        UWS.client.Client(connection=connection).get_phase('1')
+        self.assertEqual(len(events), 1)
+        self.assertEqual(len(self.events), 1)
+
+    def testHistogram(self):
+        histogram = UWS.connection.Histogram(smallest=1)
+        for value in range(1, 101):
+            histogram.add(value)
+
+        self.assertEqual(histogram.mean(), 50.5)
+        self.assertEqual(histogram.percentile(0.5), 64)
+        self.assertEqual(histogram.percentile(1), 100)
+        self.assertEqual(histogram.counts[:3], [1, 1, 2])
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import unittest
+from StringIO import StringIO
+
+from uws import UWS
+from uws.UWS.index import JobIndex
+
+
+class JobIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.xml = '''<?xml version="1.0" encoding="UTF-8"?>
+<uws:jobs xmlns:uws="http://www.ivoa.net/xml/UWS/v1.0" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1">
+  <uws:jobref id="1" xlink:href="http://example.com/1" xlink:type="simple" ownerId="anna" creationTime="2016-01-01T12:00:00+02:00">
+    <uws:phase>COMPLETED</uws:phase>
+  </uws:jobref>
+  <uws:jobref id="2" xlink:href="http://example.com/2" xlink:type="simple" ownerId="bert" runId="run" creationTime="2016-01-01T09:00:00Z">
+    <uws:phase>ERROR</uws:phase>
+  </uws:jobref>
+  <uws:jobref id="3" xlink:href="http://example.com/3" xlink:type="simple" ownerId="anna" runId="run" creationTime="2016-01-02T00:00:00Z">
+    <uws:phase>COMPLETED</uws:phase>
+  </uws:jobref>
+  <uws:jobref id="4" xlink:href="http://example.com/4" xlink:type="simple">
+    <uws:phase>EXECUTING</uws:phase>
+  </uws:jobref>
+</uws:jobs>
+'''
+        self.index = JobIndex(UWS.models.Jobs(self.xml))
+
+    def _ids(self, jobs):
+        return [job.id for job in jobs]
+
+    def testLookups(self):
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.get('3').ownerId, 'anna')
+        self.assertIsNone(self.index.get('5'))
+
+        self.assertEqual(self._ids(self.index.by_phase('COMPLETED')), ['1', '3'])
+        self.assertEqual(self._ids(self.index.by_phase('EXECUTING', 'ERROR', 'HELD')), ['2', '4'])
+        self.assertEqual(self._ids(self.index.by_owner('anna')), ['1', '3'])
+        self.assertEqual(self._ids(self.index.by_run_id('run')), ['2', '3'])
+
+    def testCreationTime(self):
+        # 12:00+02:00 is 10:00 UTC, after job 2
+        self.assertEqual(self._ids(self.index.created_between()), ['2', '1', '3'])
+        self.assertEqual(self._ids(self.index.created_between(after='2016-01-01T09:00:00')), ['1', '3'])
+        self.assertEqual(self._ids(self.index.created_between(before='2016-01-01T12:00:00+02:00')), ['2'])
+
+    def testSelect(self):
+        self.assertEqual(self._ids(self.index.select(phases=['COMPLETED'], owner='anna', run_id='run')), ['3'])
+        self.assertEqual(self._ids(self.index.select(phases=['COMPLETED', 'ERROR'], after='2016-01-01')), ['1', '2', '3'])
+        self.assertEqual(self._ids(self.index.select()), ['1', '2', '3', '4'])
+
+    def testSelectMany(self):
+        # the intersection of the sorted candidate lists matches a plain filter
+        jobs = [UWS.models.JobRef(id=str(i), phase=['COMPLETED', 'ERROR', 'QUEUED'][i % 3],
+                                  reference=UWS.models.Reference(href='http://example.com/%d' % i))
+                for i in range(500)]
+        for i, job in enumerate(jobs):
+            job.ownerId = 'owner%d' % (i % 7)
+            job.runId = 'run%d' % (i % 4)
+            job.creationTime = None
+        index = JobIndex(jobs)
+
+        expected = [job.id for job in jobs if job.phase == ['ERROR'] and job.ownerId == 'owner3' and job.runId == 'run1']
+        self.assertEqual(len(expected), 6)
+        self.assertEqual(self._ids(index.select(phases=['ERROR'], owner='owner3', run_id='run1')), expected)
+        self.assertEqual(self._ids(index.select(phases=['QUEUED'], owner='missing')), [])
+
+    def testStream(self):
+        index = JobIndex(UWS.models.JobRefStream(StringIO(self.xml), compact=True))
+
+        self.assertEqual(self._ids(index.by_phase('COMPLETED')), ['1', '3'])
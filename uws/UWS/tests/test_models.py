@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import unittest
+from StringIO import StringIO
 
 from uws import UWS
 
@@ -66,7 +67,52 @@ class JobListTest(unittest.TestCase):
         self.assertEqual(job5.reference.href, "https://www.cosmosim.org/uws/query/356246647522833857")
 
 
+
+class JobRefStreamTest(JobListTest):
+    def test(self):
+        job_list = UWS.models.JobRefStream(StringIO(self.xml))
+
+        self.assertEqual(job_list.version, "1.0")
+
+        jobs = list(job_list)
+        self.assertEqual(len(jobs), 5)
+
+        # processed references are removed from the tree
+        self.assertEqual(len(job_list._root), 1)
+        self.assertEqual(len(job_list._root[0]), 0)
+
+        self.assertEqual(jobs[0].id, '2014-06-03T15:33:29:4235')
+        self.assertEqual(jobs[0].phase, ['COMPLETED'])
+        self.assertEqual(jobs[0].reference.href, "https://www.cosmosim.org/uws/query/335912448787925")
+
+        self.assertEqual(jobs[3].id, '2014-05-09T15:13:50:6896')
+        self.assertEqual(jobs[3].phase, ['ERROR'])
+
+        self.assertEqual(jobs[4].id, 'rndSamp2')
+        self.assertEqual(jobs[4].reference.type, "simple")
+        self.assertTrue(job_list._source.closed)
+
+    def testTruncated(self):
+        source = StringIO(self.xml[:self.xml.index('<uws:jobref id="2014-05-28')] + '<uws:jobref id="trunc')
+        jobs = iter(UWS.models.JobRefStream(source))
+
+        self.assertEqual(next(jobs).id, '2014-06-03T15:33:29:4235')
+        next(jobs)
+        self.assertRaises(UWS.UWSError, next, jobs)
+        self.assertTrue(source.closed)
+
+    def testAbandoned(self):
+        source = StringIO(self.xml)
+        jobs = iter(UWS.models.JobRefStream(source))
+
+        next(jobs)
+        jobs.close()
+        self.assertTrue(source.closed)
+
+
 class CompletedJobTest(unittest.TestCase):
+    model = UWS.models.Job
+
     def setUp(self):
         self.xml = '''
 <?xml version="1.0" encoding="UTF-8"?>
@@ -108,7 +154,7 @@ ORDER BY log_mass
         '''[1:]
 
     def test(self):
-        job = UWS.models.Job(self.xml)
+        job = self.model(self.xml)
 
         job_str = "JobId : '335912448787925'\nRunId : 'None'\nOwnerId : 'adrian'\nPhase : 'COMPLETED'\nQuote : 'None'\nCreationTime : 'None'\nStartTime : '2014-06-03T15:33:30+02:00'\nEndTime : '2014-06-03T15:33:31+02:00'\nExecutionDuration : '30'\nDestruction : '2999-12-31T00:00:00+01:00'\nParameters :\nParameter id 'database' byRef: False is_post: False - value: cosmosim_user_adrian\nParameter id 'table' byRef: False is_post: False - value: 2014-06-03T15:33:29:4235\nParameter id 'query' byRef: False is_post: False - value: SELECT 0.25*(0.5+FLOOR(LOG10(Mvir)/0.25)) AS log_mass, COUNT(*) AS num\r\nFROM MDR1.BDMV\r\nWHERE snapnum=85 \r\nGROUP BY FLOOR(LOG10(Mvir)/0.25)\r\nORDER BY log_mass\n-- The query plan used to run this query: --\n--------------------------------------------\n--\n-- CALL paquExec('SELECT 0.25 * ( 0.5 + FLOOR( LOG10( `Mvir` ) / 0.25 ) ) AS `log_mass`,COUNT(*) AS `num`,FLOOR( LOG10( `Mvir` ) / 0.25 ) AS `_FLOOR_LOG10_Mvir_/_0__25_` FROM MDR1.BDMV WHERE ( `snapnum` = 85 )  GROUP BY FLOOR( LOG10( Mvir ) / 0.25 )  ', 'aggregation_tmp_75797262')\n-- USE spider_tmp_shard\n-- SET @i=0\n-- CREATE TABLE cosmosim_user_adrian.`2014-06-03T15:33:29:4235` ENGINE=MyISAM SELECT @i:=@i+1 AS `row_id`,  `log_mass`,SUM(`num`) AS `num`\r FROM `aggregation_tmp_75797262`  GROUP BY `_FLOOR_LOG10_Mvir_/_0__25_` ORDER BY `log_mass` ASC \n-- CALL paquDropTmp('aggregation_tmp_75797262')\n\nParameter id 'queue' byRef: False is_post: False - value: short\nResults :\nResult id 'csv' reference: https://www.cosmosim.org/query/download/stream/table/2014-06-03T15%3A33%3A29%3A4235/format/csv\nResult id 'votable.xml' reference: https://www.cosmosim.org/query/download/stream/table/2014-06-03T15%3A33%3A29%3A4235/format/votable\nResult id 'votableB1.xml' reference: https://www.cosmosim.org/query/download/stream/table/2014-06-03T15%3A33%3A29%3A4235/format/votableB1\nResult id 'votableB2.xml' reference: https://www.cosmosim.org/query/download/stream/table/2014-06-03T15%3A33%3A29%3A4235/format/votableB2\nerrorSummary :\n False\njobInfo :\n"
         self.assertEqual(str(job), job_str)
@@ -175,6 +221,8 @@ ORDER BY log_mass
 
 
 class AbortedJobTest(unittest.TestCase):
+    model = UWS.models.Job
+
     def setUp(self):
         self.xml = '''
 <?xml version="1.0" encoding="UTF-8"?>
@@ -207,7 +255,7 @@ class AbortedJobTest(unittest.TestCase):
         '''[1:]
 
     def test(self):
-        job = UWS.models.Job(self.xml)
+        job = self.model(self.xml)
 
         job_str = "JobId : '308893189727250'\nRunId : 'None'\nOwnerId : 'adrian'\nPhase : 'ABORTED'\nQuote : 'None'\nCreationTime : 'None'\nStartTime : '2014-06-02T10:14:25+02:00'\nEndTime : '2014-06-02T10:14:55+02:00'\nExecutionDuration : '30'\nDestruction : '2999-12-31T00:00:00+01:00'\nParameters :\nParameter id 'database' byRef: False is_post: False - value: cosmosim_user_adrian\nParameter id 'table' byRef: False is_post: False - value: 2014-06-02T10:14:25:1677\nParameter id 'query' byRef: False is_post: False - value: select count(*) from MDR1.Particles85 where x < 1\n-- The query plan used to run this query: --\n--------------------------------------------\n--\n-- CALL paquExec('SELECT COUNT(*) AS `_count_*_` FROM MDR1.Particles85 WHERE ( `x` < 1 )   ', 'aggregation_tmp_49645551')\n-- USE spider_tmp_shard\n-- SET @i=0\n-- CREATE TABLE cosmosim_user_adrian.`2014-06-02T10:14:25:1677` ENGINE=MyISAM SELECT @i:=@i+1 AS `row_id`,  SUM(`_count_*_`) AS `_count_*_`\r FROM `aggregation_tmp_49645551`   \n-- CALL paquDropTmp('aggregation_tmp_49645551')\n\nParameter id 'queue' byRef: False is_post: False - value: short\nResults :\nerrorSummary :\n False\njobInfo :\n"
         self.assertEqual(str(job), job_str)
@@ -254,6 +302,8 @@ class AbortedJobTest(unittest.TestCase):
 
 
 class ErroredJobTest(unittest.TestCase):
+    model = UWS.models.Job
+
     def setUp(self):
         self.xml = '''
 <?xml version="1.0" encoding="UTF-8"?>
@@ -289,7 +339,7 @@ class ErroredJobTest(unittest.TestCase):
         '''[1:]
 
     def test(self):
-        job = UWS.models.Job(self.xml)
+        job = self.model(self.xml)
 
         job_str = "JobId : '1177277256137938'\nRunId : 'None'\nOwnerId : 'adrian'\nPhase : 'ERROR'\nQuote : 'None'\nCreationTime : 'None'\nStartTime : '2014-05-09T15:13:48+02:00'\nEndTime : '2014-05-09T15:13:48+02:00'\nExecutionDuration : '30'\nDestruction : '2999-12-31T00:00:00+01:00'\nParameters :\nParameter id 'database' byRef: False is_post: False - value: cosmosim_user_adrian\nParameter id 'table' byRef: False is_post: False - value: 2014-05-09T15:13:50:6896\nParameter id 'query' byRef: False is_post: False - value: select avg(x) from `MDPL`.`Particles88tmp`;\n-- The query plan used to run this query: --\n--------------------------------------------\n--\n-- CALL paquExec('SELECT  COUNT(x) AS `cnt_avg(x)`, SUM(x) AS `sum_avg(x)` FROM `MDPL`.`Particles88tmp` ', 'aggregation_tmp_9424512')\n-- USE spider_tmp_shard\n-- SET @i=0\n-- CREATE TABLE cosmosim_user_adrian.`2014-05-09T15:13:50:6896` ENGINE=MyISAM SELECT @i:=@i+1 AS `row_id`,   (SUM(`sum_avg(x)`) / SUM(`cnt_avg(x)`)) AS `avg(x)`\r FROM `aggregation_tmp_9424512`   \n-- CALL paquDropTmp('aggregation_tmp_9424512')\n\nParameter id 'queue' byRef: False is_post: False - value: short\nResults :\nerrorSummary :\n Error Summary - type 'transient' hasDetail: False - message: Remote MySQL server has gone away\njobInfo :\n"
         self.assertEqual(str(job), job_str)
@@ -379,6 +429,18 @@ class JobListNamespace2Test(JobListNamespaceTest):
         '''[1:]
 
 
+class FlavourTest(unittest.TestCase):
+    def test(self):
+        flavour = UWS.models.get_flavour({'uws': UWS.models.uws_1_namespace})
+
+        self.assertIsInstance(flavour, UWS.models.UWS1Flavour)
+        self.assertIs(UWS.models.get_flavour({None: UWS.models.uws_1_namespace, 'x': 'other'}), flavour)
+        self.assertEqual(flavour.phase.text, "{http://www.ivoa.net/xml/UWS/v1.0}phase")
+
+    def testUnknownNamespace(self):
+        self.assertRaises(RuntimeError, UWS.models.get_flavour, {'uws': 'http://www.ivoa.net/xml/UWS/v0.9'})
+
+
 class ErroredJobNamespaceTest(ErroredJobTest):
     def setUp(self):
         self.xml = '''
@@ -456,3 +518,66 @@ ORDER BY log_mass
 </job>
         '''[1:]
 
+
+
+class CompletedLazyJobTest(CompletedJobTest):
+    model = UWS.models.LazyJob
+
+
+class AbortedLazyJobTest(AbortedJobTest):
+    model = UWS.models.LazyJob
+
+
+class ErroredLazyJobTest(ErroredJobTest):
+    model = UWS.models.LazyJob
+
+
+class CompletedCompactJobTest(CompletedJobTest):
+    model = UWS.models.CompactJob
+
+
+class ErroredCompactJobTest(ErroredJobTest):
+    model = UWS.models.CompactJob
+
+
+class CompactJobListTest(JobListTest):
+    def test(self):
+        job_list = UWS.models.Jobs(self.xml, compact=True)
+        jobs = job_list.job_reference
+
+        self.assertEqual(len(jobs), 5)
+        self.assertEqual(str(jobs[1]), "Job '2014-06-02T10:14:25:1677' in phase 'ABORTED' - https://www.cosmosim.org/uws/query/308893189727250")
+        self.assertEqual(jobs[0].reference.type, "simple")
+        self.assertEqual(jobs[0].version, "1.0")
+        self.assertFalse(hasattr(jobs[0], '__dict__'))
+
+        # equal phases share one tuple
+        self.assertEqual(jobs[0].phase, ('COMPLETED',))
+        self.assertIs(jobs[0].phase, jobs[2].phase)
+
+        job_list.add_job(id='new', href='http://example.com/new', phase='PENDING')
+        self.assertIsInstance(job_list.job_reference[-1], UWS.models.CompactJobRef)
+        self.assertEqual(job_list.job_reference[-1].phase, ('PENDING',))
+
+
+class LazyJobTest(CompletedJobTest):
+    def test(self):
+        job = UWS.models.LazyJob(self.xml)
+
+        self.assertNotIn('results', job.__dict__)
+        self.assertEqual(job.phase, ['COMPLETED'])
+
+        self.assertEqual(len(job.results), 4)
+        self.assertIn('results', job.__dict__)
+        self.assertIs(job.results, job.results)
+
+        self.assertEqual(len(job.parameters), 4)
+        self.assertEqual(job.error_summary, False)
+        self.assertEqual(job.job_info, [])
+        self.assertFalse(hasattr(job, '_parsed'))
+
+    def testEmpty(self):
+        job = UWS.models.LazyJob()
+
+        self.assertEqual(job.parameters, [])
+        self.assertEqual(job.error_summary, None)
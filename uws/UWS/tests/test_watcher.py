@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from StringIO import StringIO
+
+from uws import UWS
+from uws.cli.dashboard import Dashboard
+from uws.UWS.tests.uws_server import UWSServer
+from uws.UWS.watcher import JobEvent, JobListWatcher
+
+
+class JobListWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = UWSServer(
+            jobs={'1': 'EXECUTING', '2': 'COMPLETED'},
+            created={'1': '2016-01-01T10:00:00Z', '2': '2016-01-01T11:00:00Z'},
+            version="1.1"
+        )
+        self.server.start()
+
+        self.client = UWS.client.Client(self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _events(self, watcher):
+        return sorted((event.type, event.id, event.phase, event.previous_phase) for event in watcher.poll())
+
+    def testIncremental(self):
+        watcher = JobListWatcher(self.client, full_every=2)
+
+        self.assertEqual(self._events(watcher), [
+            (JobEvent.ADDED, '1', 'EXECUTING', None),
+            (JobEvent.ADDED, '2', 'COMPLETED', None),
+        ])
+
+        self.server.jobs['1'] = 'COMPLETED'
+        self.server.jobs['3'] = 'QUEUED'
+        self.server.created['3'] = '2016-01-01T12:00:00Z'
+        del self.server.jobs['2']
+        del self.server.requests[:]
+
+        self.assertEqual(self._events(watcher), [
+            (JobEvent.ADDED, '3', 'QUEUED', None),
+            (JobEvent.PHASE_CHANGED, '1', 'COMPLETED', 'EXECUTING'),
+        ])
+        self.assertEqual(self.server.requests[0], '/uws?AFTER=2016-01-01T10%3A59%3A59')
+        self.assertTrue(self.server.requests[1].startswith('/uws?PHASE=PENDING&PHASE=QUEUED'))
+        self.assertEqual(self.server.requests[2:], ['/uws/1/phase'])
+
+        # deleting a finished job is only noticed by the next complete poll
+        self.assertEqual(self._events(watcher), [
+            (JobEvent.REMOVED, '2', None, None),
+        ])
+
+    def testSameSecond(self):
+        watcher = JobListWatcher(self.client, full_every=10)
+        watcher.poll()
+
+        # created in the same second as the newest job of the first poll
+        self.server.jobs['3'] = 'QUEUED'
+        self.server.created['3'] = '2016-01-01T11:00:00Z'
+
+        self.assertEqual(self._events(watcher), [
+            (JobEvent.ADDED, '3', 'QUEUED', None),
+        ])
+        self.assertEqual(self._events(watcher), [])
+
+    def testFullPolls(self):
+        self.server.version = "1.0"
+        watcher = JobListWatcher(self.client)
+        watcher.poll()
+
+        self.server.jobs['1'] = 'ABORTED'
+        del self.server.jobs['2']
+
+        self.assertEqual(self._events(watcher), [
+            (JobEvent.PHASE_CHANGED, '1', 'ABORTED', 'EXECUTING'),
+            (JobEvent.REMOVED, '2', None, None),
+        ])
+        self.assertEqual(self.server.requests, ['/uws', '/uws'])
+
+    def testWait(self):
+        watcher = JobListWatcher(self.client)
+        watcher.poll()
+        del self.server.requests[:]
+
+        started = time.time()
+        watcher.wait(1)
+        self.assertGreaterEqual(time.time() - started, 1)
+        self.assertEqual(self.server.requests, ['/uws/1?WAIT=1&PHASE=EXECUTING'])
+
+        # without active jobs there is nothing to wait for on the server
+        self.server.jobs['1'] = 'COMPLETED'
+        watcher.poll()
+        del self.server.requests[:]
+        watcher.wait(0.1)
+        self.assertEqual(self.server.requests, [])
+
+
+class DashboardTest(unittest.TestCase):
+    def setUp(self):
+        self.out = StringIO()
+        self.dashboard = Dashboard(self.out, 'http://example.org/uws', (80, 10))
+
+        self.dashboard.update([JobEvent(JobEvent.ADDED, str(id), 'EXECUTING') for id in range(1, 9)])
+        self.out.truncate(0)
+
+    def testPhaseChange(self):
+        self.dashboard.update([JobEvent(JobEvent.PHASE_CHANGED, '8', 'COMPLETED', 'EXECUTING'),
+                               JobEvent(JobEvent.PHASE_CHANGED, '1', 'ERROR', 'EXECUTING')])
+        output = self.out.getvalue()
+
+        # only the header and the line of the visible job are written
+        self.assertNotIn('\x1b[2J', output)
+        self.assertEqual(output.count('\x1b[K'), 4)
+        self.assertIn('\x1b[9;1H8 ', output)
+        self.assertIn('EXECUTING 6  ERROR 1', output)
+        self.assertIn('COMPLETED 1', output)
+        self.assertGreater(self.dashboard.throughput(time.time()), 0)
+
+    def testAddedAndRemoved(self):
+        self.dashboard.update([JobEvent(JobEvent.ADDED, '9', 'QUEUED')])
+        self.assertIn('\x1b[2J', self.out.getvalue())
+
+        self.out.truncate(0)
+        self.dashboard.update([JobEvent(JobEvent.REMOVED, '1')])
+        self.assertNotIn('\x1b[2J', self.out.getvalue())
+        self.assertEqual(self.dashboard.counts['EXECUTING'], 7)
+        self.assertEqual(len(self.dashboard.phases), 8)
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+import gzip
+import hashlib
+import socket
+import zlib
+from StringIO import StringIO
+import threading
+import time
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+import argparse
+import datetime
+
+import dateutil.parser
+
+job_list_xml = '''<?xml version="1.0" encoding="UTF-8"?>
+<uws:jobs xmlns:uws="http://www.ivoa.net/xml/UWS/v1.0" xmlns:xlink="http://www.w3.org/1999/xlink" version="%(version)s">
+%(jobrefs)s
+</uws:jobs>
+'''
+
+jobref_xml = '''  <uws:jobref id="%(id)s" xlink:href="%(url)s/%(id)s" xlink:type="simple"%(created)s>
+    <uws:phase>%(phase)s</uws:phase>
+  </uws:jobref>'''
+
+result_xml = '''    <uws:result id="%(result)s" xlink:href="%(url)s/%(id)s/results/%(result)s" xlink:type="simple"/>'''
+
+job_xml = '''<?xml version="1.0" encoding="UTF-8"?>
+<uws:job xmlns:uws="http://www.ivoa.net/xml/UWS/v1.0" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xlink="http://www.w3.org/1999/xlink" version="%(version)s">
+  <uws:jobId>%(id)s</uws:jobId>
+  <uws:ownerId>anonymous</uws:ownerId>
+  <uws:phase>%(phase)s</uws:phase>
+  <uws:quote xsi:nil="true"/>
+  <uws:startTime>2014-06-03T15:33:30+02:00</uws:startTime>
+  <uws:endTime>2014-06-03T15:33:31+02:00</uws:endTime>
+  <uws:executionDuration>30</uws:executionDuration>
+  <uws:destruction>2999-12-31T00:00:00+01:00</uws:destruction>
+  <uws:parameters>
+    <uws:parameter id="query">SELECT 1</uws:parameter>
+  </uws:parameters>
+  <uws:results>
+%(results)s
+  </uws:results>
+</uws:job>
+'''
+
+
+class UWSHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the jobs of a UWSServer below /uws."""
+    protocol_version = "HTTP/1.1"
+    # write the status line, headers and body in as few packets as possible,
+    # unbuffered headers run into delayed acknowledgements on keep-alive
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        self._delay()
+
+        if self._moved():
+            return
+
+        if server.failing:
+            server.failing -= 1
+            if server.overloaded is None:
+                self._send(502, 'Bad gateway')
+            else:
+                # busy, with the number of seconds to come back after
+                self.send_response(503)
+                self.send_header("Retry-After", str(server.overloaded))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            return
+
+        path, query = (self.path.split('?', 1) + [''])[:2]
+        parts = path.rstrip('/').split('/')[2:]
+        params = urlparse.parse_qs(query)
+
+        if not parts:
+            after = None
+            if 'AFTER' in params:
+                after = dateutil.parser.parse(params['AFTER'][0])
+            jobrefs = [jobref_xml % {'id': id, 'phase': phase, 'url': server.url, 'created': self._created(id)}
+                       for id, phase in sorted(server.jobs.items()) if self._listed(id, params, after)]
+            self._send_cacheable(job_list_xml % {'version': server.version, 'jobrefs': '\n'.join(jobrefs)})
+        elif parts[0] not in server.jobs:
+            self._send(404, 'Not found')
+        elif len(parts) == 1:
+            if 'WAIT' in params and server.version == "1.1":
+                self._wait(parts[0], int(params['WAIT'][0]), params.get('PHASE', [None])[0])
+            self._send_cacheable(self._job(parts[0]))
+        elif parts[1:] == ['phase']:
+            self._send(200, server.jobs[parts[0]], content_type='text/plain')
+        elif parts[1:] == ['results', 'csv']:
+            if server.compress and 'gzip' in self.headers.getheader('accept-encoding', ''):
+                self._send_chunked(self._gzip(server.result), server.chunk_size, encoding='gzip')
+            elif server.ranges:
+                self._send_range(server.result)
+            else:
+                self._send_chunked(server.result, server.chunk_size)
+        elif parts[1] == 'results' and len(parts) == 3 and parts[2] in server.results:
+            self._send_chunked(server.results[parts[2]], server.chunk_size)
+        else:
+            self._send(404, 'Not found')
+
+    def do_HEAD(self):
+        server = self.server
+        server.requests.append('HEAD ' + self.path)
+        self._delay()
+
+        if self._moved():
+            return
+
+        if not server.ranges:
+            self.send_response(405)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(server.result)))
+        self.end_headers()
+
+    def do_POST(self):
+        server = self.server
+        body = self._read_body()
+        server.requests.append('POST ' + self.path)
+        self._delay()
+
+        if self._moved():
+            return
+        server.uploads.append((dict(self.headers), body))
+        parts = self.path.rstrip('/').split('/')[2:]
+
+        if not parts and server.busy:
+            # ask the client to come back later
+            server.busy -= 1
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        elif not parts:
+            with server.lock:
+                server.last_id += 1
+                id = str(server.last_id)
+                server.jobs[id] = 'PENDING'
+        elif parts[0] not in server.jobs:
+            self._send(404, 'Not found')
+            return
+        else:
+            id = parts[0]
+            if 'name="PHASE"\r\n\r\nRUN' in body:
+                server.jobs[id] = 'QUEUED'
+                if server.run_time is not None:
+                    server.execute(id)
+            elif 'name="PHASE"\r\n\r\nABORT' in body:
+                server.jobs[id] = 'ABORTED'
+
+        self._redirect('%s/%s' % (server.url, id))
+
+    def do_DELETE(self):
+        server = self.server
+        server.requests.append('DELETE ' + self.path)
+        self._delay()
+
+        if self._moved():
+            return
+
+        id = self.path.rstrip('/').split('/')[2]
+        server.jobs.pop(id, None)
+        self._redirect(server.url)
+
+    def _read_body(self):
+        if self.headers.getheader('transfer-encoding', '').lower() != 'chunked':
+            return self.rfile.read(int(self.headers.getheader('content-length', 0)))
+
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(';', 1)[0], 16)
+            if size == 0:
+                self.rfile.readline()
+                return ''.join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def _delay(self):
+        # simulated network and service latency
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def _created(self, id):
+        if id not in self.server.created:
+            return ''
+        return ' creationTime="%s"' % self.server.created[id]
+
+    def _listed(self, id, params, after):
+        server = self.server
+        if 'PHASE' in params and server.jobs[id] not in params['PHASE']:
+            return False
+        if after is not None:
+            if id not in server.created:
+                return False
+            if id not in server.created_times:
+                server.created_times[id] = dateutil.parser.parse(server.created[id]).replace(tzinfo=None)
+            return server.created_times[id] > after
+        return True
+
+    def _wait(self, id, wait, phase):
+        # block while the job stays in the given (or any active) phase
+        server = self.server
+        started = time.time()
+        initial = server.jobs[id]
+        while wait < 0 or time.time() - started < wait:
+            current = server.jobs[id]
+            if current != initial or (phase and current != phase):
+                break
+            if current not in ('PENDING', 'QUEUED', 'EXECUTING'):
+                break
+            time.sleep(0.01)
+
+    def _job(self, id):
+        server = self.server
+        results = '\n'.join(result_xml % {'id': id, 'result': result, 'url': server.url}
+                            for result in server.result_ids)
+        return job_xml % {'id': id, 'phase': server.jobs[id], 'url': server.url, 'version': server.version,
+                          'results': results}
+
+    def _send(self, status, body, content_type='text/xml'):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _gzip(self, body):
+        buffer = StringIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as compressed:
+            compressed.write(body)
+        return buffer.getvalue()
+
+    def _send_cacheable(self, body):
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        encoding = None
+        if self.server.compress and 'deflate' in self.headers.getheader('accept-encoding', ''):
+            body = zlib.compress(body)
+            encoding = 'deflate'
+
+        if self.headers.getheader('if-none-match') == etag:
+            self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_range(self, body):
+        byte_range = self.headers.getheader('range')
+        if byte_range is None:
+            self._send(200, body, content_type='text/csv')
+            return
+
+        start, end = byte_range.split('=', 1)[1].split('-')
+        start = int(start)
+        end = int(end) if end else len(body) - 1
+        part = body[start:end + 1]
+
+        self.send_response(206)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, len(body)))
+        self.send_header("Content-Length", str(len(part)))
+        self.end_headers()
+        self.wfile.write(part)
+
+    def _send_chunked(self, body, chunk_size=1000, encoding=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Transfer-Encoding", "chunked")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        for i in range(0, len(body), chunk_size):
+            chunk = body[i:i + chunk_size]
+            self.wfile.write("%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write("0\r\n\r\n")
+
+    def _moved(self):
+        # send everything to another server, like a load balancer
+        if self.server.moved_to is None:
+            return False
+
+        status, root = self.server.moved_to
+        self._redirect(root + self.path, status)
+        return True
+
+    def _redirect(self, location, status=303):
+        self.send_response(status)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UWSServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Minimal UWS service on localhost, running in a background thread."""
+    daemon_threads = True
+
+    def __init__(self, jobs=None, version="1.0", result="id,value\n1,2\n", ranges=False, created=None,
+                 latency=0, run_time=None, port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), UWSHandler)
+        self.jobs = dict(jobs or {})
+        # ids of new jobs count up, ids of deleted jobs are not given again
+        self.last_id = max([0] + [int(id) for id in self.jobs if id.isdigit()])
+        self.created = dict(created or {})
+        # parsed creation times, for AFTER
+        self.created_times = {}
+        self.version = version
+        self.result = result
+        self.ranges = ranges
+        # the results listed in a job, csv is the result above, the others
+        # are served from results and missing ones answered with 404
+        self.result_ids = ['csv']
+        self.results = {}
+        # seconds each request is delayed, and a job runs before it completes
+        self.latency = latency
+        self.run_time = run_time
+        self.chunk_size = 1000
+        self.url = "http://127.0.0.1:%d/uws" % self.server_address[1]
+        self.requests = []
+        self.uploads = []
+        self.not_modified = 0
+        self.busy = 0
+        self.failing = 0
+        self.overloaded = None
+        self.compress = False
+        self.moved_to = None
+        self.sockets = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def generated(cls, count, phases=('COMPLETED', 'ERROR', 'ABORTED', 'EXECUTING', 'PENDING'), **kwargs):
+        """Returns a server with count jobs, cycling through the given phases
+        and created one second apart."""
+        start = datetime.datetime(2016, 1, 1)
+        jobs = {}
+        created = {}
+        for i in range(count):
+            id = str(i + 1)
+            jobs[id] = phases[i % len(phases)]
+            created[id] = (start + datetime.timedelta(seconds=i)).isoformat()
+        return cls(jobs=jobs, created=created, **kwargs)
+
+    def execute(self, id):
+        # a started job executes for run_time seconds and then completes
+        def complete():
+            if self.jobs.get(id) == 'EXECUTING':
+                self.jobs[id] = 'COMPLETED'
+
+        self.jobs[id] = 'EXECUTING'
+        timer = threading.Timer(self.run_time, complete)
+        timer.daemon = True
+        timer.start()
+
+    def process_request(self, request, client_address):
+        self.sockets.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        self.sockets.discard(request)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+        # end handlers waiting on idle keep-alive connections
+        for request in list(self.sockets):
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves generated jobs as a local UWS service.")
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    parser.add_argument('-n', '--jobs', type=int, default=1000, help="number of jobs in the job list")
+    parser.add_argument('--version', default="1.1", choices=["1.0", "1.1"])
+    parser.add_argument('--latency', type=float, default=0, help="seconds each request is delayed")
+    parser.add_argument('--run-time', type=float, default=1, help="seconds a started job executes")
+    parser.add_argument('--result-size', type=int, default=1024, help="size of each job result in kB")
+    parser.add_argument('--ranges', action='store_true', help="support range requests for results")
+    parser.add_argument('--compress', action='store_true', help="compress job lists and results")
+    parser.add_argument('--moved-to', help="redirect every request to this root url (307)")
+    arguments = parser.parse_args()
+
+    row = "1234567,0.123456789,-12.3456789\n"
+    result = "id,ra,dec\n" + row * (arguments.result_size * 1024 // len(row))
+
+    server = UWSServer.generated(arguments.jobs, version=arguments.version, result=result, ranges=arguments.ranges,
+                                 latency=arguments.latency, run_time=arguments.run_time, port=arguments.port)
+    server.compress = arguments.compress
+    server.chunk_size = 65536
+    if arguments.moved_to:
+        server.moved_to = (307, arguments.moved_to)
+
+    print "Serving %d jobs at %s" % (len(server.jobs), server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
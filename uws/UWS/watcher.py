@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import datetime
+import time
+
+import models
+from errors import UWSError
+from index import utc_datetime
+
+
+class JobEvent(object):
+    ADDED = 'added'
+    REMOVED = 'removed'
+    PHASE_CHANGED = 'phase_changed'
+
+    def __init__(self, type, id, phase=None, previous_phase=None):
+        self.type = type
+        self.id = id
+        self.phase = phase
+        self.previous_phase = previous_phase
+
+    def __unicode__(self):
+        if self.type == self.PHASE_CHANGED:
+            return "Job '%s' changed phase from '%s' to '%s'" % (self.id, self.previous_phase, self.phase)
+        elif self.type == self.ADDED:
+            return "Job '%s' added in phase '%s'" % (self.id, self.phase)
+        else:
+            return "Job '%s' removed" % self.id
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+
+class JobListWatcher(object):
+    """Polls the job list of a service and reports the differences to the
+    previous poll as JobEvents.
+
+    The first poll fetches the whole job list. If the service implements
+    UWS 1.1 and no filters are given, later polls only ask for the jobs
+    created since the newest known job (AFTER) and for the jobs in phases
+    which can still change. Only jobs which left these phases are looked
+    up one by one, so the work per poll follows the number of changes.
+    Jobs deleted while in a final phase are noticed by the complete
+    resynchronisation done every full_every polls.
+    """
+    # phases a job can still leave
+    open_phases = [phase for phase in models.JobPhases.phases
+                   if phase not in models.JobPhases.final_phases]
+
+    def __init__(self, client, filters=None, full_every=20):
+        self.client = client
+        self.filters = filters
+        self.full_every = full_every
+
+        self.phases = {}
+        self.version = None
+        self._open = set()
+        self._latest = None
+        self._incremental = False
+        self._polls = 0
+
+    def poll(self):
+        """Returns the list of changes since the previous poll."""
+        if self._incremental and self._polls % self.full_every:
+            events = self._poll_changes()
+        else:
+            events = self._poll_all()
+
+        self._polls += 1
+        return events
+
+    def watch(self, interval=5):
+        """Polls every interval seconds and yields each change."""
+        while True:
+            for event in self.poll():
+                yield event
+            self.wait(interval)
+
+    def wait(self, interval):
+        """Waits up to interval seconds before the next poll.
+
+        On UWS 1.1 services this is a WAIT request for one of the active
+        jobs, preferably an executing one, so the wait ends as soon as that
+        job changes its phase.
+        """
+        waiting = None
+        if self.version == "1.1":
+            waiting = self._waiting_job()
+
+        if waiting is None:
+            time.sleep(interval)
+            return
+
+        id, phase = waiting
+        try:
+            self.client.get_job(id, wait=str(max(1, int(interval))), phase=phase)
+        except UWSError:
+            # e.g. the job was deleted, the next poll will tell
+            time.sleep(interval)
+
+    def _poll_all(self):
+        job_list = self.client.get_job_list(self.filters, compact=True)
+
+        current = {}
+        events = []
+        for job in job_list.job_reference:
+            current[job.id] = job.phase[0]
+            self._add(job, events)
+
+        for id in set(self.phases) - set(current):
+            del self.phases[id]
+            self._open.discard(id)
+            events.append(JobEvent(JobEvent.REMOVED, id))
+
+        self.version = job_list.version
+        self._incremental = (self.filters is None and job_list.version == "1.1" and
+                             self._latest is not None)
+        return events
+
+    def _poll_changes(self):
+        events = []
+
+        # AFTER is strictly after, usually with a resolution of seconds, so
+        # the second of the newest known job is asked for again to catch
+        # jobs created in the same second; known jobs are skipped by id
+        filters = {'after': str(self._latest - datetime.timedelta(seconds=1))}
+        for job in self.client.get_job_list(filters, compact=True).job_reference:
+            if job.id not in self.phases:
+                self._add(job, events)
+
+        open_jobs = self.client.get_job_list({'phases': self.open_phases}, compact=True)
+        still_open = set()
+        for job in open_jobs.job_reference:
+            still_open.add(job.id)
+            self._add(job, events)
+
+        # only the open jobs are checked, not all known jobs
+        for id in self._open - still_open:
+            self._update(id, events)
+
+        return events
+
+    def _add(self, job, events):
+        phase = job.phase[0]
+        previous = self.phases.get(job.id)
+
+        if previous is None:
+            events.append(JobEvent(JobEvent.ADDED, job.id, phase))
+        elif previous != phase:
+            events.append(JobEvent(JobEvent.PHASE_CHANGED, job.id, phase, previous))
+        self._set_phase(job.id, phase)
+
+        # the creation time of a known job cannot have changed
+        if previous is None and job.creationTime is not None:
+            created = utc_datetime(job.creationTime)
+            if self._latest is None or created > self._latest:
+                self._latest = created
+
+    def _update(self, id, events):
+        # the job left the open phases since the last poll
+        try:
+            phase = self.client.get_phase(id).strip()
+        except UWSError as e:
+            if e.msg != 'Resource does not exist':
+                raise
+            del self.phases[id]
+            self._open.discard(id)
+            events.append(JobEvent(JobEvent.REMOVED, id))
+            return
+
+        events.append(JobEvent(JobEvent.PHASE_CHANGED, id, phase, self.phases[id]))
+        self._set_phase(id, phase)
+
+    def _set_phase(self, id, phase):
+        self.phases[id] = phase
+        if phase in self.open_phases:
+            self._open.add(id)
+        else:
+            self._open.discard(id)
+
+    def _waiting_job(self):
+        # an open job in an active phase, the one closest to finishing
+        best = None
+        for id in self._open:
+            phase = self.phases[id]
+            if phase in models.JobPhases.active_phases:
+                rank = models.JobPhases.active_phases.index(phase)
+                if best is None or rank > best[0]:
+                    best = (rank, id, phase)
+                    if phase == models.JobPhases.EXECUTING:
+                        break
+
+        if best is None:
+            return None
+        return best[1], best[2]
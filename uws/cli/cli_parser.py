@@ -9,6 +9,20 @@ def build_argparse():
     parser.add_argument('--password', help='password')
     parser.add_argument('-P', action='store_true', help='hidden password (type at prompt)')
     parser.add_argument('-D', '--dbg', action='store_true', help='debug mode')
+    parser.add_argument('--stats', action='store_true', help='print the number, latency and throughput of the requests at exit')
+
+    subparsers = parser.add_subparsers(dest='command', help='commands for UWS')
+    build_list_argparse(subparsers)
+    build_job_argparse(subparsers)
+    build_watch_argparse(subparsers)
+    build_shell_argparse(subparsers)
+
+    return parser
+
+
+def build_command_argparse():
+    # parses the lines of 'uws shell', the connection is set up by the shell
+    parser = argparse.ArgumentParser(prog='uws')
 
     subparsers = parser.add_subparsers(dest='command', help='commands for UWS')
     build_list_argparse(subparsers)
@@ -31,6 +45,7 @@ def build_list_argparse(subparsers):
     parser_list.add_argument('--suspended', action='store_true', help='show suspended jobs')
     parser_list.add_argument('--after', action='store', help='[UWS1.1] show only jobs started after given UTC time or local time + timezone')
     parser_list.add_argument('--last', action='store', help='[UWS1.1] show only most recently started jobs')
+    parser_list.add_argument('--format', choices=['table', 'jsonl', 'csv', 'tsv'], default='table', help='output as table, or one JSON object (JSON Lines), CSV or TSV row per job, written while the job list is read (default: table)')
 
     return parser_list
 
@@ -43,6 +58,7 @@ def build_job_argparse(subparsers):
     parser_job_show.add_argument('id', help='job id')
     parser_job_show.add_argument('-w', '--wait', nargs='?', const='-1', default=None, help='[UWS1.1] wait for phase change before returning, but at most the specified amount of seconds or infinitely, if no value is given')
     parser_job_show.add_argument('-s', '--phase', help='[UWS1.1] required phase while waiting')
+    parser_job_show.add_argument('--format', choices=['table', 'jsonl', 'csv', 'tsv'], default='table', help='output as table, as JSON object, or as CSV or TSV rows of field and value (default: table)')
 
     parser_job_phase = job_subparsers.add_parser('phase', help='show the phase of specific job')
     parser_job_phase.add_argument('id', help='job id')
@@ -55,6 +71,13 @@ def build_job_argparse(subparsers):
                                                                   'destruction (Destruction time of the job), ' +
                                                                   'executionDuration (Execution duration of the job in seconds)')
 
+    parser_job_batch_new = job_subparsers.add_parser('batch-new', help='create one job for each parameter set in a file')
+    parser_job_batch_new.add_argument('file', help='file with one parameter set per line, as JSON object (JSON Lines) or CSV row with the parameter names in the header, "-" reads from stdin')
+    parser_job_batch_new.add_argument('--format', choices=['jsonl', 'csv'], help='format of the file (default: csv for .csv files, jsonl otherwise)')
+    parser_job_batch_new.add_argument('-r', '--run', action='store_true', help='immediately submits each job on creation')
+    parser_job_batch_new.add_argument('-j', '--max-in-flight', type=int, default=8, help='number of jobs submitted at the same time (default: 8)')
+    parser_job_batch_new.add_argument('-m', '--manifest', help='write the created jobs as JSON Lines to this file')
+
     parser_job_set = job_subparsers.add_parser('set', help='set parameters for the specific job')
     parser_job_set.add_argument('id', help='job id')
     parser_job_set.add_argument('job_parameters', nargs='*', help='unspecified list of UWS service parameters in the form' +
@@ -63,18 +86,47 @@ def build_job_argparse(subparsers):
                                                                   'destruction (Destruction time of the job), ' +
                                                                   'executionDuration (Execution duration of the job in seconds)')
 
-    parser_job_run = job_subparsers.add_parser('run', help="run the specific job if its state is pending")
-    parser_job_run.add_argument('id', help='job id')
+    parser_job_run = job_subparsers.add_parser('run', help="run the specific jobs if their state is pending")
+    build_batch_argparse(parser_job_run)
 
-    parser_job_abort = job_subparsers.add_parser('abort', help="aborts the execution of a specific job")
-    parser_job_abort.add_argument('id', help='job id')
+    parser_job_abort = job_subparsers.add_parser('abort', help="aborts the execution of specific jobs")
+    build_batch_argparse(parser_job_abort)
 
-    parser_job_abort = job_subparsers.add_parser('delete', help="delete a specific job")
-    parser_job_abort.add_argument('id', help='job id')
+    parser_job_delete = job_subparsers.add_parser('delete', help="delete specific jobs")
+    build_batch_argparse(parser_job_delete)
 
     parser_job_results = job_subparsers.add_parser('results', help="download results of a specific job")
     parser_job_results.add_argument('id', help='job id')
     parser_job_results.add_argument('result_id', nargs='?', help='result id (e.g. for specifying the format, optional)')
     parser_job_results.add_argument('-f', '--file_base', help='basename of output file (optional), will be appended with result_id')
+    parser_job_results.add_argument('-n', '--segments', type=int, default=1, help='number of parallel segments per result, if the server supports range requests (default: 1)')
+    parser_job_results.add_argument('-c', '--resume', action='store_true', help='continue partially downloaded files instead of starting over')
+    parser_job_results.add_argument('-j', '--parallel', type=int, default=4, help='number of results downloaded at the same time (default: 4)')
+    parser_job_results.add_argument('-z', '--keep-compressed', action='store_true', help='store results the server sends gzip compressed as .gz files')
 
     return parser_job_results
+
+
+def build_batch_argparse(parser):
+    parser.add_argument('id', nargs='*', help='job ids')
+    parser.add_argument('--phase', action='append', type=str.upper, help='select all jobs in this phase, can be given several times')
+    parser.add_argument('--owner', help='select only jobs of this owner')
+    parser.add_argument('--before', help='select only jobs created before given UTC time or local time + timezone')
+    parser.add_argument('-j', '--parallel', type=int, default=8, help='number of jobs handled at the same time (default: 8)')
+
+    return parser
+
+
+def build_watch_argparse(subparsers):
+    parser_watch = subparsers.add_parser('watch', help='follow the jobs on the UWS service, showing each change of phase')
+    parser_watch.add_argument('-i', '--interval', type=int, default=5, help='seconds between polls, [UWS1.1] the wait ends earlier when an active job changes (default: 5)')
+    parser_watch.add_argument('-n', '--polls', type=int, default=0, help='stop after this number of polls (default: watch until interrupted)')
+
+    return parser_watch
+
+
+def build_shell_argparse(subparsers):
+    parser_shell = subparsers.add_parser('shell', help='run list and job commands interactively or from a script, with one connection')
+    parser_shell.add_argument('script', nargs='?', help='file with one command per line, "-" reads from stdin (default: interactive, or stdin if it is not a terminal)')
+
+    return parser_shell
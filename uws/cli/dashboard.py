@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import collections
+import time
+
+from uws import UWS
+
+
+class Dashboard(object):
+    """Shows the jobs reported by a JobListWatcher on a terminal.
+
+    The header with the number of jobs per phase and the throughput is
+    written on every update, but of the job lines only those of jobs which
+    changed their phase. The whole screen is drawn again only when the
+    visible jobs or the terminal size changed, so the work per update
+    follows the number of changes, not the number of jobs.
+
+    As many jobs as fit on the terminal are shown, the last ones in the
+    order they appeared: first the job list, then the jobs created later.
+    """
+    header = 4
+    # seconds over which the completed jobs per minute are averaged
+    window = 300
+
+    def __init__(self, out, url, size):
+        self.out = out
+        self.url = url
+        self.size = size
+
+        self.phases = {}
+        self.changed = {}
+        self.order = []
+        self.counts = collections.Counter()
+        self.completed = collections.deque()
+        self.started = time.time()
+        self.updates = 0
+
+        self._lines = {}
+        self._visible = None
+
+        # hide the cursor while watching
+        self.out.write("\x1b[?25l")
+
+    def update(self, events, size=None):
+        now = time.time()
+        redraw = []
+        removed = False
+
+        for event in events:
+            if event.type == UWS.watcher.JobEvent.REMOVED:
+                self.counts[self.phases.pop(event.id)] -= 1
+                self.changed.pop(event.id, None)
+                removed = True
+                continue
+
+            if event.type == UWS.watcher.JobEvent.ADDED:
+                self.order.append(event.id)
+            else:
+                self.counts[event.previous_phase] -= 1
+                redraw.append(event.id)
+
+            self.counts[event.phase] += 1
+            self.phases[event.id] = event.phase
+            self.changed[event.id] = now
+
+            # jobs which were already completed when watching started do
+            # not count for the throughput
+            if event.phase == UWS.models.JobPhases.COMPLETED and self.updates:
+                self.completed.append(now)
+
+        if removed:
+            self.order = [id for id in self.order if id in self.phases]
+        while self.completed and self.completed[0] < now - self.window:
+            self.completed.popleft()
+        self.updates += 1
+
+        if size is not None and size != self.size:
+            self.size = size
+            self._visible = None
+
+        # one line is left free for the cursor
+        visible = self.order[-max(1, self.size[1] - self.header - 1):]
+        if visible != self._visible:
+            self._draw_all(visible, now)
+        else:
+            self._draw(self._header(now) + [(self._lines[id], self._job_line(id)) for id in redraw
+                                            if id in self._lines])
+        self.out.flush()
+
+    def close(self):
+        # leave the cursor below the dashboard
+        self.out.write("\x1b[%d;1H\x1b[?25h\n" % (self.header + len(self._lines) + 1))
+        self.out.flush()
+
+    def throughput(self, now):
+        """Returns the jobs completed per minute over the last window
+        seconds."""
+        minutes = min(self.window, now - self.started) / 60.0
+        if minutes <= 0:
+            return 0.0
+        return len(self.completed) / minutes
+
+    def _header(self, now):
+        counts = ["%s %d" % (phase, self.counts[phase]) for phase in UWS.models.JobPhases.phases
+                  if self.counts[phase] > 0]
+        return [
+            (0, "%s  %s  %d jobs" % (self.url, time.strftime('%H:%M:%S', time.localtime(now)), len(self.phases))),
+            (1, "  ".join(counts)),
+            (2, "%.1f jobs completed per minute" % self.throughput(now)),
+        ]
+
+    def _job_line(self, id):
+        return "%-30s %-10s %s" % (id, self.phases[id], time.strftime('%H:%M:%S', time.localtime(self.changed[id])))
+
+    def _draw_all(self, visible, now):
+        self._visible = visible
+        self._lines = dict((id, self.header + row) for row, id in enumerate(visible))
+
+        self.out.write("\x1b[H\x1b[2J")
+        columns = [(self.header - 1, "%-30s %-10s %s" % ("Job Id", "Phase", "Since"))]
+        self._draw(self._header(now) + columns + [(self._lines[id], self._job_line(id)) for id in visible])
+
+    def _draw(self, lines):
+        # lines are (row, text) tuples, written in one go
+        width = self.size[0] - 1
+        self.out.write("".join("\x1b[%d;1H%s\x1b[K" % (row + 1, text[:width]) for row, text in lines))
@@ -1,15 +1,24 @@
+import errno
 import getpass
+import os
 import sys
+import threading
+import time
 
 from functools import wraps
-import texttable as tt
-from uws.lib.terminalsize import terminalsize as console
 
 import cli_parser
 from uws import UWS
 
+# texttable, the terminal size, the UWS submodules and the modules for the
+# shell and the file formats are imported by the commands which need them,
+# a plain 'uws job phase' starts without them
+
 debug = False
 
+# the client of a 'uws shell' session, used by all of its commands
+shell_client = None
+
 
 def handle_error(handler):
     @wraps(handler)
@@ -27,9 +36,15 @@ def handle_error(handler):
     return handle
 
 
+def _client(url, user_name, password):
+    if shell_client is not None:
+        return shell_client
+    return UWS.client.Client(url=url, user=user_name, password=password)
+
+
 @handle_error
-def list_jobs(url, user_name, password, phases, after=None, last=None):
-    uws_client = UWS.client.Client(url=url, user=user_name, password=password)
+def list_jobs(url, user_name, password, phases, after=None, last=None, format='table'):
+    uws_client = _client(url, user_name, password)
 
     filters = {}
     if phases:
@@ -39,40 +54,31 @@ def list_jobs(url, user_name, password, phases, after=None, last=None):
     if last:
         filters['last'] = last
 
-    jobs = uws_client.get_job_list(filters=filters)
-
-    job_phases = UWS.models.JobPhases
+    # parse the job list while it is downloaded instead of building
+    # the complete document in memory first, except in a shell, where an
+    # unchanged job list is taken from the cache
+    jobs = uws_client.get_job_list(filters=filters, stream=shell_client is None, compact=format != 'table')
+    version = jobs.version
+    if shell_client is not None:
+        jobs = jobs.job_reference
+
+    if format != 'table':
+        # each job is written as soon as it is parsed, nothing is kept
+        if phases and version != "1.1":
+            jobs = (job for job in jobs if any(job_phase in phases for job_phase in job.phase))
+        _write_records(job_reference_fields, (_job_reference_record(job) for job in jobs), format)
+        return
 
     # we will apply client side filtering anyways, since we are not
     # sure that a UWS service is version 1.1 and supports server side
     # filtering.
+    if phases and version != "1.1":
+        jobs = UWS.index.JobIndex(jobs).by_phase(*phases)
+
     rows = [["Job Id", "[Run]", "[Owner]", "[Creation Time]", "Status"]]
-    for job in jobs.job_reference:
-        if not phases or jobs.version == "1.1":
-            _register_job_reference_for_table(rows, job)
-        else:
-            if job_phases.COMPLETED in phases and job_phases.COMPLETED in job.phase:
-                    _register_job_reference_for_table(rows, job)
-            if job_phases.PENDING in phases and job_phases.PENDING in job.phase:
-                    _register_job_reference_for_table(rows, job)
-            if job_phases.QUEUED in phases and job_phases.QUEUED in job.phase:
-                    _register_job_reference_for_table(rows, job)
-            if job_phases.EXECUTING in phases and job_phases.EXECUTING in job.phase:
-                    _register_job_reference_for_table(rows, job)
-            if job_phases.ERROR in phases and job_phases.ERROR in job.phase:
-                    _register_job_reference_for_table(rows, job)
-            if job_phases.ABORTED in phases and job_phases.ABORTED in job.phase:
-                    _register_job_reference_for_table(rows, job)
-            if job_phases.UNKNOWN in phases and job_phases.UNKNOWN in job.phase:
-                    _register_job_reference_for_table(rows, job)
-            if job_phases.HELD in phases and job_phases.HELD in job.phase:
-                    _register_job_reference_for_table(rows, job)
-            if job_phases.SUSPENDED in phases and job_phases.SUSPENDED in job.phase:
-                    _register_job_reference_for_table(rows, job)
-            # add ARCHIVED phase as well for services with version 1.0 that already support this
-            if job_phases.ARCHIVED in phases and job_phases.ARCHIVED in job.phase:
-                    _register_job_reference_for_table(rows, job)
-    (console_width, console_height) = console.get_terminal_size()
+    for job in jobs:
+        _register_job_reference_for_table(rows, job)
+    (console_width, console_height) = _terminal_size()
 
     # Now we have the rows all stored. Check if all columns exist and remove
     # empty columns for a more friendly output.
@@ -93,6 +99,8 @@ def list_jobs(url, user_name, password, phases, after=None, last=None):
     # remove empty cols (in-place removal)
     rows[:] = [ [ col for i, col in enumerate(row) if existing_col[i] == 1 ] for row in rows ]
 
+    import texttable as tt
+
     table = tt.Texttable(max_width=console_width)
     table.set_deco(tt.Texttable.HEADER)
     table.set_cols_dtype(dtypes)  # ['t', 't', 't', 't', 't'])
@@ -112,13 +120,7 @@ def _register_job_reference_for_table(rows, jobref):
     # only the href-id, if they differ. Because this really MUST be the
     # correct jobId.
 
-    cols = [jobref.id]
-
-    if (jobref.reference.href is not None):
-        href_jobid = jobref.reference.href.rsplit("/", 1)[1]
-        if href_jobid != jobref.id:
-            # replace id with href_jobid
-            cols[0] = href_jobid
+    cols = [_job_reference_id(jobref)]
 
     if (jobref.runId is not None):
         cols.append(jobref.runId)
@@ -140,30 +142,103 @@ def _register_job_reference_for_table(rows, jobref):
     rows.append(cols)
 
 
+def _job_reference_id(jobref):
+    if (jobref.reference.href is not None):
+        href_jobid = jobref.reference.href.rsplit("/", 1)[1]
+        if href_jobid != jobref.id:
+            # replace id with href_jobid
+            return href_jobid
+    return jobref.id
+
+
+# columns of 'uws list' in the machine readable formats
+job_reference_fields = ['id', 'runId', 'ownerId', 'creationTime', 'phase', 'href']
+
+
+def _job_reference_record(jobref):
+    return [_job_reference_id(jobref), jobref.runId, jobref.ownerId, jobref.creationTime,
+            ', '.join(jobref.phase), jobref.reference.href]
+
+
+def _write_records(fields, records, format):
+    # records are lists of values in the order of fields, written one by one
+    # as JSON objects or as rows with a header line
+    import csv
+
+    try:
+        if format == 'jsonl':
+            keys = ['"%s": ' % field for field in fields]
+            for record in records:
+                sys.stdout.write('{%s}\n' % ', '.join([key + _json_value(value) for key, value in zip(keys, record)]))
+        else:
+            writer = csv.writer(sys.stdout, dialect='excel-tab' if format == 'tsv' else 'excel', lineterminator='\n')
+            writer.writerow(fields)
+            for record in records:
+                writer.writerow([_text_value(value) for value in record])
+        sys.stdout.flush()
+    except IOError as e:
+        # the reader went away, e.g. piped into head
+        if e.errno != errno.EPIPE:
+            raise
+
+
+def _json_value(value):
+    import json
+
+    if value is None:
+        return 'null'
+    if isinstance(value, basestring):
+        return json.encoder.encode_basestring_ascii(value)
+    return json.dumps(value)
+
+
+def _text_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
 @handle_error
-def show_job(url, user_name, password, id, wait, phase):
-    uws_client = UWS.client.Client(url=url, user=user_name, password=password)
+def show_job(url, user_name, password, id, wait, phase, format='table'):
+    uws_client = _client(url, user_name, password)
 
     job = uws_client.get_job(id, wait, phase)
 
     if wait and job.version != "1.1":
-        print "Warning: Wait keyword is (probably) not supported by the server's UWS version %s (need 1.1). Server will probably ignore wait and return immediately." % job.version
-
-    _print_job(job)
+        # not mixed into machine readable output
+        out = sys.stdout if format == 'table' else sys.stderr
+        out.write("Warning: Wait keyword is (probably) not supported by the server's UWS version %s (need 1.1). Server will probably ignore wait and return immediately.\n" % job.version)
+
+    if format == 'jsonl':
+        _write_records(job_fields, [_job_record(job)], format)
+    elif format != 'table':
+        _write_records(["Field", "Value"], _job_rows(job)[1:], format)
+    else:
+        _print_job(job)
 
 
 @handle_error
 def show_phase(url, user_name, password, id):
-    uws_client = UWS.client.Client(url=url, user=user_name, password=password)
+    # the phase is plain text, so neither the client nor the XML models are
+    # needed, which keeps this command fast when it is called from scripts
+    if shell_client is not None:
+        connection = shell_client.connection
+    else:
+        connection = UWS.connection.Connection(url, user_name, password)
 
-    phase = uws_client.get_phase(id)
+    try:
+        phase = connection.get(id + '/phase').read()
+    except Exception as e:
+        raise UWS.UWSError(str(e))
 
     print(phase)
 
 
 @handle_error
 def new_job(url, user_name, password, parameters={}, run=False):
-    uws_client = UWS.client.Client(url=url, user=user_name, password=password)
+    uws_client = _client(url, user_name, password)
 
     job = uws_client.new_job(parameters)
 
@@ -171,7 +246,7 @@ def new_job(url, user_name, password, parameters={}, run=False):
         # execute the job
         job = uws_client.run_job(job.job_id)
 
-    (console_width, console_height) = console.get_terminal_size()
+    (console_width, console_height) = _terminal_size()
 
     _print_job(job)
 
@@ -183,9 +258,113 @@ def new_job(url, user_name, password, parameters={}, run=False):
     print "*" * (console_width - 1)
 
 
+def _batch_client(url, user_name, password, workers):
+    # one idle connection per worker, so all of them can be reused
+    pool = UWS.connection.ConnectionPool(max_size=workers)
+    # long batches should survive a temporarily overloaded server
+    return UWS.client.Client(url=url, user=user_name, password=password, pool=pool,
+                             retry=UWS.connection.RetryPolicy())
+
+
+@handle_error
+def batch_new_job(url, user_name, password, file_name, format=None, run=False, max_in_flight=8, manifest_name=None):
+    uws_client = _batch_client(url, user_name, password, max_in_flight)
+
+    if format is None:
+        format = 'csv' if file_name.lower().endswith('.csv') else 'jsonl'
+
+    if file_name == '-':
+        source = sys.stdin
+    else:
+        source = open(file_name, 'rb')
+
+    manifest = None
+    if manifest_name:
+        manifest = open(manifest_name, 'w')
+
+    import json
+
+    created = 0
+    failed = 0
+    try:
+        parameter_sets = _read_parameter_sets(source, format)
+        jobs = uws_client.new_jobs(parameter_sets, max_in_flight=max_in_flight, run=run)
+        # when the file is malformatted or the user presses Ctrl-C, new_jobs
+        # still yields the jobs being submitted before raising the error, so
+        # they are in the manifest as well
+        interrupted = False
+        while True:
+            try:
+                if interrupted:
+                    # pressed while a job was recorded, new_jobs is told
+                    interrupted = False
+                    index, job = jobs.throw(KeyboardInterrupt)
+                else:
+                    index, job = next(jobs)
+            except StopIteration:
+                break
+
+            try:
+                if isinstance(job, UWS.UWSError):
+                    failed += 1
+                    entry = {'record': index + 1, 'error': job.msg}
+                    print "Record %d failed: %s" % (index + 1, job.msg)
+                else:
+                    created += 1
+                    entry = {'record': index + 1, 'job_id': job.job_id, 'phase': job.phase[0]}
+                    if manifest is None:
+                        print "Record %d: job %s in phase %s" % (index + 1, job.job_id, job.phase[0])
+
+                # written as the jobs arrive, so an interrupted batch can be continued
+                if manifest is not None:
+                    manifest.write(json.dumps(entry) + "\n")
+                    manifest.flush()
+            except KeyboardInterrupt:
+                interrupted = True
+    finally:
+        if manifest is not None:
+            manifest.close()
+        if source is not sys.stdin:
+            source.close()
+
+    print "%d jobs created, %d failed." % (created, failed)
+
+
+def _read_parameter_sets(source, format):
+    # yields one parameter dictionary per record, reading the file lazily
+    import csv
+    import json
+
+    if format == 'csv':
+        for row in csv.DictReader(source):
+            yield row
+        return
+
+    for line_number, line in enumerate(source, 1):
+        if not line.strip():
+            continue
+        try:
+            parameters = json.loads(line)
+        except ValueError as e:
+            raise UWS.UWSError("Malformatted JSON in line %d: %s" % (line_number, e))
+        if not isinstance(parameters, dict):
+            raise UWS.UWSError("Line %d does not contain a JSON object" % line_number)
+
+        yield dict((key.encode('utf-8'), _parameter_value(value)) for key, value in parameters.items())
+
+
+def _parameter_value(value):
+    import json
+
+    if isinstance(value, basestring):
+        return value.encode('utf-8')
+    # numbers, booleans and null as written in JSON
+    return json.dumps(value)
+
+
 @handle_error
 def set_parameters_job(url, user_name, password, id, parameters={}):
-    uws_client = UWS.client.Client(url=url, user=user_name, password=password)
+    uws_client = _client(url, user_name, password)
 
     if len(parameters) == 0:
         job = uws_client.get_job(id)
@@ -197,7 +376,7 @@ def set_parameters_job(url, user_name, password, id, parameters={}):
 
 @handle_error
 def run_job(url, user_name, password, id):
-    uws_client = UWS.client.Client(url=url, user=user_name, password=password)
+    uws_client = _client(url, user_name, password)
 
     job = uws_client.run_job(id)
 
@@ -206,7 +385,7 @@ def run_job(url, user_name, password, id):
 
 @handle_error
 def abort_job(url, user_name, password, id):
-    uws_client = UWS.client.Client(url=url, user=user_name, password=password)
+    uws_client = _client(url, user_name, password)
 
     job = uws_client.abort_job(id)
 
@@ -215,7 +394,7 @@ def abort_job(url, user_name, password, id):
 
 @handle_error
 def delete_job(url, user_name, password, id):
-    uws_client = UWS.client.Client(url=url, user=user_name, password=password)
+    uws_client = _client(url, user_name, password)
 
     success = uws_client.delete_job(id)
 
@@ -224,16 +403,112 @@ def delete_job(url, user_name, password, id):
 
 
 @handle_error
-def results_job(url, user_name, password, id, result_id, user_file_base):
-    def print_progress(total_size, current):
-        if total_size:
-            sys.stdout.write("\r%d bytes" % current)    # or print >> sys.stdout, "\r%d%%" %i,
-            sys.stdout.flush()
-        else:
-            sys.stdout.write("\rDownloaded %d bytes" % current)    # or print >> sys.stdout, "\r%d%%" %i,
-            sys.stdout.flush()
+def batch_job(url, user_name, password, action, ids, phases=None, owner=None, before=None, parallel=8):
+    uws_client = _batch_client(url, user_name, password, parallel)
+
+    ids = list(ids)
+    if phases or owner or before:
+        seen = set(ids)
+        for id in _select_jobs(uws_client, phases, owner, before):
+            if id not in seen:
+                seen.add(id)
+                ids.append(id)
+
+    if not ids:
+        print "No jobs selected."
+        return
 
-    uws_client = UWS.client.Client(url=url, user=user_name, password=password)
+    results = getattr(uws_client, action + '_jobs')(ids, concurrency=parallel)
+
+    failed = [id for id in ids if isinstance(results[id], UWS.UWSError)]
+    for id in failed:
+        print "Job %s failed: %s" % (id, results[id].msg)
+
+    done = {'run': 'started', 'abort': 'aborted', 'delete': 'deleted'}[action]
+    print "%d of %d jobs %s, %d failed." % (len(ids) - len(failed), len(ids), done, len(failed))
+
+
+def _select_jobs(uws_client, phases, owner, before):
+    filters = {}
+    if phases:
+        filters['phases'] = phases
+
+    jobs = UWS.index.JobIndex(uws_client.get_job_list(filters=filters, compact=True))
+    return [job.id for job in jobs.select(phases=phases, owner=owner, before=before)]
+
+
+class DownloadProgress(object):
+    """Combined progress display for concurrent downloads, showing the
+    bytes written and the rate for each file and in total. For compressed
+    results these are the decompressed bytes, not the bytes on the wire."""
+    def __init__(self, names, interval=0.2):
+        self.names = names
+        self.interval = interval
+
+        self.started = time.time()
+        self.progress = {}
+        self.last_draw = 0
+        self.lock = threading.Lock()
+
+        (self.console_width, console_height) = _terminal_size()
+
+    def start(self, name, initial=0):
+        # initial is the size of a partial file which is resumed
+        with self.lock:
+            now = time.time()
+            self.progress[name] = [now, initial, initial, now]
+
+    def callback(self, name):
+        def print_progress(total_size, current):
+            with self.lock:
+                now = time.time()
+                self.progress[name][2:] = [current, now]
+
+                if now - self.last_draw >= self.interval or (total_size and current >= total_size):
+                    self.last_draw = now
+                    self.draw()
+        return print_progress
+
+    def draw(self):
+        parts = []
+        transferred = 0
+        last_update = self.started
+        for name in self.names:
+            if name not in self.progress:
+                continue
+            started, initial, current, updated = self.progress[name]
+            transferred += current - initial
+            last_update = max(last_update, updated)
+            parts.append("%s: %s (%s/s)" % (name, _format_bytes(current),
+                                            _format_bytes((current - initial) / max(updated - started, 1e-3))))
+
+        if len(self.names) > 1:
+            parts.append("total: %s/s" % _format_bytes(transferred / max(last_update - self.started, 1e-3)))
+
+        line = " | ".join(parts)[:self.console_width - 1]
+        sys.stdout.write("\r" + line.ljust(self.console_width - 1))
+        sys.stdout.flush()
+
+
+def _terminal_size():
+    from uws.lib.terminalsize import terminalsize
+    return terminalsize.get_terminal_size()
+
+
+def _format_bytes(size):
+    for unit in ['bytes', 'kB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024.0
+    if unit == 'bytes':
+        return "%d %s" % (size, unit)
+    return "%.1f %s" % (size, unit)
+
+
+@handle_error
+def results_job(url, user_name, password, id, result_id, user_file_base, segments=1, resume=False, parallel=4,
+                keep_compressed=False):
+    uws_client = _client(url, user_name, password)
 
     job = uws_client.get_job(id)
 
@@ -255,29 +530,80 @@ def results_job(url, user_name, password, id, result_id, user_file_base):
     if user_file_base:
         file_base = user_file_base
 
-    retrieved = False
+    downloads = []
     for result in job.results:
         if not result_id or result_id == result.id:
-
             filename = file_base + '.' + result.id
-
-            url = str(result.reference)
-
             print "Downloading %s into file '%s'" % (result.id, filename)
-            uws_client.connection.download_file(url, user_name, password, filename, callback=print_progress)
-            print ""
-            print "Finished downloading file '%s'\n" % (filename)
-            retrieved = True
+            downloads.append((result, filename))
 
-    if not retrieved:
+    if not downloads:
         if result_id:
             print "Result Id '%s' not available. Use 'uws job show %s' for a list of available results." % (result_id, job.job_id)
         else:
             print "The job with id '%s' has no results." % (job.job_id)
             print "Check with 'uws job show %s' the details, the job results may have been deleted." % (job.job_id)
+        return
 
+    progress = DownloadProgress([result.id for result, filename in downloads])
 
-def _print_job(job):
+    def download(item):
+        result, filename = item
+
+        initial = 0
+        if resume and os.path.exists(filename):
+            initial = os.path.getsize(filename)
+        progress.start(result.id, initial)
+
+        try:
+            filename = uws_client.connection.download_file(str(result.reference), user_name, password, filename,
+                                                           callback=progress.callback(result.id),
+                                                           segments=segments, resume=resume,
+                                                           keep_compressed=keep_compressed)
+        except Exception as e:
+            return filename, e
+        return filename, None
+
+    # fetch the results concurrently, but with a bounded number of workers
+    from multiprocessing.pool import ThreadPool
+    workers = ThreadPool(max(1, min(parallel, len(downloads))))
+    try:
+        finished = workers.map(download, downloads)
+    finally:
+        workers.terminate()
+
+    progress.draw()
+    print ""
+
+    for filename, error in finished:
+        if error is None:
+            print "Finished downloading file '%s'" % (filename)
+        else:
+            print "Failed downloading file '%s': %s" % (filename, error)
+    print ""
+
+
+# keys of 'uws job show' in JSON Lines
+job_fields = ['jobId', 'runId', 'ownerId', 'phase', 'quote', 'creationTime', 'startTime', 'endTime',
+              'executionDuration', 'destruction', 'parameters', 'results', 'errorSummary', 'jobInfo']
+
+
+def _job_record(job):
+    errors = None
+    try:
+        if(job.error_summary):
+            errors = job.error_summary.messages
+    except:
+        pass
+
+    return [job.job_id, job.run_id, job.owner_id, ', '.join(job.phase), job.quote, job.creation_time,
+            job.start_time, job.end_time, job.execution_duration, job.destruction,
+            dict((param.id, param.value) for param in job.parameters),
+            dict((result.id, result.reference.href) for result in job.results),
+            errors, [unicode(info) for info in job.job_info]]
+
+
+def _job_rows(job):
     # format stuff
     rows = [["Field", "Value"]]
     rows.append(["Job id", job.job_id])
@@ -315,11 +641,18 @@ def _print_job(job):
     for info in job.job_info:
         rows.append(["Job info", unicode(info)])
 
-    (console_width, console_height) = console.get_terminal_size()
+    return rows
+
+
+def _print_job(job):
+    rows = _job_rows(job)
+
+    (console_width, console_height) = _terminal_size()
 
     fields = [row[0] for row in rows]
     max_field_len = len(max(fields, key=len))
 
+    import texttable as tt
     table = tt.Texttable(max_width=console_width)
     table.set_deco(tt.Texttable.HEADER)
     table.set_cols_dtype(['t', 't'])
@@ -382,6 +715,74 @@ def _check_joblist_last(argument):
     return argument
 
 
+@handle_error
+def watch_jobs(url, user_name, password, interval=5, polls=0):
+    # unchanged job lists are answered with 304 and not parsed again
+    uws_client = UWS.client.Client(url=url, user=user_name, password=password,
+                                   cache=UWS.connection.ResponseCache())
+    watcher = UWS.watcher.JobListWatcher(uws_client)
+
+    dashboard = None
+    if sys.stdout.isatty():
+        from uws.cli.dashboard import Dashboard
+        dashboard = Dashboard(sys.stdout, url, _terminal_size())
+
+    count = 0
+    try:
+        while True:
+            events = watcher.poll()
+            if dashboard is not None:
+                dashboard.update(events, _terminal_size())
+            else:
+                # e.g. piped into a file, one line per change
+                for event in events:
+                    print "%s %s" % (time.strftime('%Y-%m-%d %H:%M:%S'), event)
+                sys.stdout.flush()
+
+            count += 1
+            if polls and count >= polls:
+                break
+            watcher.wait(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if dashboard is not None:
+            dashboard.close()
+
+
+def run_shell(url, user_name, password, script=None):
+    global shell_client
+    from uws.cli.shell import UWSShell
+
+    # one client for the whole session, which keeps its connections alive
+    # and caches job lists and jobs until they change on the server
+    shell_client = UWS.client.Client(url=url, user=user_name, password=password,
+                                     cache=UWS.connection.ResponseCache())
+
+    def shell(stdin=None):
+        return UWSShell(url, user_name, password, shell_client, run_command, debug, stdin=stdin)
+
+    try:
+        if script == '-' or (script is None and not sys.stdin.isatty()):
+            shell(sys.stdin).cmdloop()
+        elif script is not None:
+            with open(script) as stdin:
+                shell(stdin).cmdloop()
+        else:
+            session = shell()
+            intro = "Connected to %s, type 'help' for the available commands or 'exit' to leave." % url
+            while True:
+                try:
+                    session.cmdloop(intro)
+                    break
+                except KeyboardInterrupt:
+                    # abandon the line being typed, like other shells
+                    print
+                    intro = ''
+    finally:
+        shell_client = None
+
+
 def main():
     global debug
     parser = cli_parser.build_argparse()
@@ -397,6 +798,27 @@ def main():
 
         arguments.password = getpass.getpass("Enter password: ")
 
+    stats = None
+    if arguments.stats:
+        # collects the requests of every connection the command opens
+        stats = UWS.connection.RequestStats()
+        UWS.connection.default_hooks.append(stats)
+
+    try:
+        if arguments.command == "watch":
+            watch_jobs(arguments.host, arguments.user, arguments.password, arguments.interval, arguments.polls)
+        elif arguments.command == "shell":
+            run_shell(arguments.host, arguments.user, arguments.password, arguments.script)
+        else:
+            run_command(parser, arguments)
+    finally:
+        if stats is not None:
+            UWS.connection.default_hooks.remove(stats)
+            # on stderr, so the output of the command can still be piped
+            sys.stderr.write(stats.summary() + "\n")
+
+
+def run_command(parser, arguments):
     phases = []
     if arguments.command == "list":
         if arguments.completed:
@@ -428,12 +850,12 @@ def main():
         if arguments.last:
             last = _check_joblist_last(arguments.last)
 
-        list_jobs(arguments.host, arguments.user, arguments.password, phases, after, last)
+        list_jobs(arguments.host, arguments.user, arguments.password, phases, after, last, arguments.format)
 
     if arguments.command == "job":
         if arguments.job_command == "show":
             wait, phase = _check_job_wait_args(arguments)
-            show_job(arguments.host, arguments.user, arguments.password, arguments.id, wait, phase)
+            show_job(arguments.host, arguments.user, arguments.password, arguments.id, wait, phase, arguments.format)
         elif arguments.job_command == "phase":
             show_phase(arguments.host, arguments.user, arguments.password, arguments.id)
         elif arguments.job_command == "new":
@@ -441,19 +863,28 @@ def main():
             job_parameters = _check_job_parameter_args(arguments.job_parameters)
 
             new_job(arguments.host, arguments.user, arguments.password, job_parameters, arguments.run)
+        elif arguments.job_command == "batch-new":
+            batch_new_job(arguments.host, arguments.user, arguments.password, arguments.file, arguments.format,
+                          arguments.run, arguments.max_in_flight, arguments.manifest)
         elif arguments.job_command == "set":
             # parse the job parameters and store in argument list
             job_parameters = _check_job_parameter_args(arguments.job_parameters)
 
             set_parameters_job(arguments.host, arguments.user, arguments.password, arguments.id, job_parameters)
-        elif arguments.job_command == "run":
-            run_job(arguments.host, arguments.user, arguments.password, arguments.id)
-        elif arguments.job_command == "abort":
-            abort_job(arguments.host, arguments.user, arguments.password, arguments.id)
-        elif arguments.job_command == "delete":
-            delete_job(arguments.host, arguments.user, arguments.password, arguments.id)
+        elif arguments.job_command in ("run", "abort", "delete"):
+            selector = arguments.phase or arguments.owner or arguments.before
+            if not arguments.id and not selector:
+                parser.error("give job ids or select jobs with --phase, --owner or --before")
+
+            if len(arguments.id) == 1 and not selector:
+                single = {"run": run_job, "abort": abort_job, "delete": delete_job}[arguments.job_command]
+                single(arguments.host, arguments.user, arguments.password, arguments.id[0])
+            else:
+                batch_job(arguments.host, arguments.user, arguments.password, arguments.job_command, arguments.id,
+                          arguments.phase, arguments.owner, arguments.before, arguments.parallel)
         elif arguments.job_command == "results":
-            results_job(arguments.host, arguments.user, arguments.password, arguments.id, arguments.result_id, arguments.file_base)
+            results_job(arguments.host, arguments.user, arguments.password, arguments.id, arguments.result_id, arguments.file_base,
+                        arguments.segments, arguments.resume, arguments.parallel, arguments.keep_compressed)
         else:
             print "Error: Unknown command %s\n" % (arguments.job_command)
 
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import cmd
+import shlex
+import traceback
+
+import cli_parser
+
+
+class UWSShell(cmd.Cmd):
+    """Runs 'list' and 'job ...' commands, one per line, with the client of
+    the shell session.
+
+    run_command is called with the parser and the arguments of each command,
+    with debug the traceback of an unexpected error is printed as well.
+    """
+    prompt = 'uws> '
+
+    job_commands = ['show', 'phase', 'new', 'batch-new', 'set', 'run', 'abort', 'delete', 'results']
+
+    def __init__(self, url, user_name, password, client, run_command, debug=False, stdin=None):
+        cmd.Cmd.__init__(self, stdin=stdin)
+        self.url = url
+        self.user_name = user_name
+        self.password = password
+        self.client = client
+        self.run_command = run_command
+        self.debug = debug
+        self.parser = cli_parser.build_command_argparse()
+
+        if stdin is not None:
+            # commands from a script are read without prompt
+            self.use_rawinput = False
+            self.prompt = ''
+
+    def precmd(self, line):
+        if line.strip().startswith('#'):
+            return ''
+        return line
+
+    def emptyline(self):
+        # unlike cmd.Cmd, do not repeat the previous command
+        pass
+
+    def default(self, line):
+        print "Unknown command '%s', type 'help' for the available commands." % line.split()[0]
+
+    def do_list(self, line):
+        """list [options]: list the jobs, see 'list -h' for the options"""
+        self._run('list', line)
+
+    def do_job(self, line):
+        """job COMMAND [id] [options]: show, create, run, abort or delete jobs, see 'job -h'"""
+        self._run('job', line)
+
+    def complete_job(self, text, line, begidx, endidx):
+        if len(line[:begidx].split()) == 1:
+            return [command for command in self.job_commands if command.startswith(text)]
+        return [id for id in self._job_ids() if id.startswith(text)]
+
+    def do_exit(self, line):
+        """exit: leave the shell"""
+        return True
+
+    do_quit = do_exit
+
+    def do_EOF(self, line):
+        if self.use_rawinput:
+            print
+        return True
+
+    def _job_ids(self):
+        # the cached job list, only downloaded again when it changed
+        try:
+            return [job.id for job in self.client.get_job_list(compact=True).job_reference]
+        except Exception:
+            return []
+
+    def _run(self, command, line):
+        try:
+            arguments = self.parser.parse_args([command] + shlex.split(line))
+            arguments.host = self.url
+            arguments.user = self.user_name
+            arguments.password = self.password
+
+            self.run_command(self.parser, arguments)
+        except SystemExit:
+            # argparse has printed the usage or the error already
+            pass
+        except KeyboardInterrupt:
+            print "\nInterrupted."
+        except Exception as e:
+            print "An error occurred:\n   %s" % e
+            if self.debug:
+                traceback.print_exc()